@@ -0,0 +1,384 @@
+import numpy as np
+
+import intersection as base
+
+
+# -----------------------------------------------------------------------------
+# block-structured adaptive refinement of the corridor: level 0 is the
+# uniform grid of set_mesh(), every finer level is a list of patches that
+# refine cells of a parent patch by ratio in space and in time (subcycling),
+# each holding ng ghost cells per end filled from the parent
+class Patch(object):
+
+    def __init__(self, level, lo, hi, g, parent=None):
+        self.level = level
+        self.lo = lo  # first cell, in the index space of the level
+        self.hi = hi  # one past the last cell
+        self.g = g  # ghost cells per end
+        self.parent = parent
+        self.u = np.zeros((lmax, hi - lo + 2 * g))
+        self.old = None  # state at the start of the current step
+        self.flux = None  # time integral of the interface fluxes of the step
+        self.fl = np.zeros(lmax)  # time integral of the flux through the
+        self.fr = np.zeros(lmax)  # left and right end over a parent step
+
+    def interior(self):
+        return self.u[:, self.g:self.g + self.hi - self.lo]
+
+
+# -----------------------------------------------------------------------------
+# set computational mesh
+def set_mesh():
+    dx = (xmax - xmin) / (nx - 1.)
+    x = np.linspace(xmin, xmax, nx)
+    return x, dx
+
+
+# -----------------------------------------------------------------------------
+# hand the model and scheme to the whole-array kernels
+def setup():
+    for name in ('model', 'lmax', 'state', 'method', 'avmodel',
+                 'kappa2', 'kappa4', 'k', 'c0', 'nx'):
+        setattr(base, name, globals()[name])
+    base.backend = 'numpy'
+
+
+# -----------------------------------------------------------------------------
+# define initial condition; returns the levels, refined around the junction
+def ic():
+    root = Patch(0, 0, nx, 0)
+    if (model == 'lwr'):
+        root.u[0, :] = rho0
+    elif (model == 'pw'):
+        root.u[0, :] = rho0
+        root.u[1, :] = rho0 * base.vel_vec(rho0)
+    elif (model == 'zhang'):
+        root.u[0, :] = rho0
+        root.u[1, :] = 0.
+    return regrid([[root]])
+
+
+# -----------------------------------------------------------------------------
+# cell size of a level and index of its cell holding the signal
+def spacing(l):
+    return dx / ratio ** l
+
+
+def junction(l):
+    return (nx // 2) * ratio ** l + ratio ** l // 2
+
+
+# -----------------------------------------------------------------------------
+# state of a patch at fraction theta of its current step
+def between(p, theta):
+    if (p.old is None): return p.u
+    return (1 - theta) * p.old + theta * p.u
+
+
+# -----------------------------------------------------------------------------
+# values of the cells lo..hi-1 of the level above p from a limited linear
+# reconstruction of p; keeps the average of every parent cell
+def prolong(p, lo, hi, theta=1.):
+    u = between(p, theta)
+    i = np.arange(lo, hi)
+    j = i // ratio - p.lo + p.g
+    dl = u[:, j] - u[:, j - 1]
+    dr = u[:, j + 1] - u[:, j]
+    slope = np.where(dl * dr > 0, np.sign(dl) * np.minimum(abs(dl), abs(dr)), 0.)
+    return u[:, j] + slope * ((i % ratio + .5) / ratio - .5)
+
+
+# -----------------------------------------------------------------------------
+# fill the ghost cells of a patch from its parent at fraction theta of the
+# parent step
+def fill(p, theta):
+    p.u[:, :p.g] = prolong(p.parent, p.lo - p.g, p.lo, theta)
+    p.u[:, -p.g:] = prolong(p.parent, p.hi, p.hi + p.g, theta)
+
+
+# -----------------------------------------------------------------------------
+# replace the parent cells under a patch by the average of the patch cells
+def restrict(p):
+    q = p.parent
+    a = p.lo // ratio - q.lo + q.g
+    b = p.hi // ratio - q.lo + q.g
+    q.u[:, a:b] = p.interior().reshape((lmax, -1, ratio)).mean(axis=-1)
+
+
+# -----------------------------------------------------------------------------
+# conservative flux correction: the parent cells next to a patch see the
+# time integral of the patch fluxes through its ends instead of the parent flux
+def reflux(p):
+    q = p.parent
+    h = spacing(q.level)
+    a = p.lo // ratio - q.lo + q.g
+    b = p.hi // ratio - q.lo + q.g
+    q.u[:, a - 1] -= (p.fl - q.flux[:, a - 1]) / h
+    q.u[:, b] += (p.fr - q.flux[:, b - 1]) / h
+
+
+# -----------------------------------------------------------------------------
+# solver; returns the new state and the flux that advanced it
+def solver(u, dt, h, lam0=None):
+    base.dt = dt
+    base.dx = h
+    if (method == 'maccormack'):
+        for stage in range(0, 2):
+            if (stage > 0): lam0 = None
+            e = base.flux_vec(u, stage, lam0)
+            res = base.residual_vec(u, e)
+            if (stage == 0):
+                u_old = np.copy(u)
+                e_old = e
+                u += dt * res
+            elif (stage == 1):
+                u = .5 * (u + u_old + dt * res)
+                e = .5 * (e + e_old)
+    elif (method == 'rk4'):
+        alpha = [1. / 4, 1. / 3, 1. / 2, 1.]
+        u_old = np.copy(u)
+        for stage in range(0, 4):
+            if (stage > 0): lam0 = None
+            e = base.flux_vec(u, lam0=lam0)
+            res = base.residual_vec(u, e)
+            u = u_old + alpha[stage] * dt * res
+    elif (base.get_stages(method) is not None):
+        # the flux of the step is the same combination of the stage fluxes
+        u_old = np.copy(u)
+        f = 0.
+        for (stage, (a, b)) in enumerate(base.get_stages(method)):
+            if (stage > 0): lam0 = None
+            e = base.flux_vec(u, lam0=lam0)
+            res = base.residual_vec(u, e)
+            u = a * u_old + b * (u + dt * res)
+            f = b * (f + e)
+        e = f
+    else:
+        e = base.flux_vec(u, lam0=lam0)
+        res = base.residual_vec(u, e)
+        u += dt * res
+    return u, e
+
+
+# -----------------------------------------------------------------------------
+# signal at the junction cell of a patch; outflow at the ends of the road
+def bc(p, time):
+    red = time < tmax * fr
+    j = junction(p.level)
+    if (p.lo <= j < p.hi):
+        rho = 1. if red else rho0
+        j = j - p.lo + p.g
+        p.u[0, j] = rho
+        if (model == 'pw'):
+            p.u[1, j] = rho * base.vel_vec(rho)
+        elif (model == 'zhang'):
+            p.u[1, j] = 0.
+    if (p.level == 0):
+        p.u[:, 0] = p.u[:, 1]
+        p.u[:, -1] = p.u[:, -2]
+    return 'r' if red else 'g'
+
+
+# -----------------------------------------------------------------------------
+# advance level l and, recursively, all finer levels from time over dt;
+# finer levels take ratio steps per step of their parent, after which the
+# parent is corrected at the patch ends and overwritten under the patches
+def advance(levels, l, time, dt, lam0):
+    h = spacing(l)
+    for p in levels[l]:
+        p.old = np.copy(p.u)
+        (p.u, e) = solver(p.u, dt, h, lam0)
+        p.flux = dt * e
+        if (l > 0):
+            p.fl += p.flux[:, p.g - 1]
+            p.fr += p.flux[:, -p.g]
+        bc(p, time + dt)
+    if (l + 1 < len(levels)):
+        for c in levels[l + 1]:
+            c.fl[:] = 0.
+            c.fr[:] = 0.
+        for s in range(0, ratio):
+            for c in levels[l + 1]:
+                fill(c, s / float(ratio))
+            advance(levels, l + 1, time + s * dt / ratio, dt / ratio, lam0)
+        for c in levels[l + 1]:
+            reflux(c)
+            restrict(c)
+
+
+# -----------------------------------------------------------------------------
+# cells of patch p to refine, as (lo, hi) ranges in the index space of its
+# level: large density gradients, large values of the AV shock sensor and the
+# junction, widened by the distance a wave travels until the next regrid
+def cluster(p):
+    rho = p.interior()[0]
+    du = abs(np.diff(rho))
+    edge = (du / spacing(p.level) > tolgrad) | (kappa2 * du / .5 > tolav)
+    flag = np.zeros(len(rho), dtype=bool)
+    flag[:-1] |= edge
+    flag[1:] |= edge
+    j = junction(p.level) - p.lo
+    if (0 <= j < len(flag)): flag[j] = True
+
+    nbuf = int(np.ceil(cfl * nregrid * ratio ** p.level))
+    flag = np.convolve(flag, np.ones(2 * nbuf + 1), 'same') > 0
+    # keep every patch ng cells inside its parent for the ghost-cell stencil
+    flag[:ng] = False
+    flag[len(flag) - ng:] = False
+
+    edges = np.diff(np.concatenate([[0], flag.astype(int), [0]]))
+    runs = []
+    for (a, b) in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        if (runs and a - runs[-1][1] < ng):
+            runs[-1][1] = b
+        else:
+            runs.append([a, b])
+    return [(p.lo + a, p.lo + b) for (a, b) in runs]
+
+
+# -----------------------------------------------------------------------------
+# rebuild all levels above the root from the refinement flags, coarse to
+# fine; new cells are copied from the old patches where they overlap and
+# prolonged from the parent elsewhere
+def regrid(levels):
+    new = [levels[0]]
+    for l in range(0, nlevel - 1):
+        old = levels[l + 1] if (l + 1 < len(levels)) else []
+        children = []
+        for p in new[l]:
+            p.old = None
+            for (lo, hi) in cluster(p):
+                c = Patch(l + 1, lo * ratio, hi * ratio, ng, p)
+                c.u[:, ng:-ng] = prolong(p, c.lo, c.hi)
+                for o in old:
+                    a = max(c.lo, o.lo)
+                    b = min(c.hi, o.hi)
+                    if (a < b): c.u[:, a - c.lo + ng:b - c.lo + ng] = o.u[:, a - o.lo + ng:b - o.lo + ng]
+                fill(c, 1.)
+                children.append(c)
+        if not children: break
+        new.append(children)
+    return new
+
+
+# -----------------------------------------------------------------------------
+# cell centres and states of the composite grid (finest data everywhere)
+def composite(levels):
+    x = []
+    u = []
+    for (l, level) in enumerate(levels):
+        for p in level:
+            keep = np.ones(p.hi - p.lo, dtype=bool)
+            if (l + 1 < len(levels)):
+                for c in levels[l + 1]:
+                    if (c.parent is p):
+                        keep[c.lo // ratio - p.lo:c.hi // ratio - p.lo] = False
+            i = np.arange(p.lo, p.hi)[keep]
+            x.append(xmin - .5 * dx + (i + .5) * spacing(l))
+            u.append(p.interior()[:, keep])
+    x = np.concatenate(x)
+    order = np.argsort(x)
+    return x[order], np.concatenate(u, axis=1)[:, order]
+
+
+# -----------------------------------------------------------------------------
+# cell updates per root step; the uniform finest grid takes
+# nx * ratio ** (2 * (nlevel - 1))
+def cells(levels):
+    return sum(ratio ** l * sum(p.hi - p.lo for p in level)
+               for (l, level) in enumerate(levels))
+
+
+# -----------------------------------------------------------------------------
+# time loop; the patches are rebuilt every nregrid steps and monitor(i,
+# time, color) is called after every step with the simulated time
+def run(levels, monitor=None):
+    time = 0
+    tsim = 0
+    for i in range(0, imax):
+        if (i > 0 and i % nregrid == 0): levels = regrid(levels)
+        lam = max(base.maxlam(p.interior()) for level in levels for p in level)
+        dt = cfl * dx / lam
+        advance(levels, 0, time, dt, lam)
+        time += dt
+        tsim += dt
+        color = 'r' if (time < tmax * fr) else 'g'
+
+        if time > tmax: time = 0
+
+        if (monitor is not None): monitor(i, tsim, color)
+    return levels, tsim
+
+
+if __name__ == '__main__':
+
+    # -----------------------------------------------------------------------------
+    # parameters
+    xmin = 0
+    xmax = 200
+    nx = 151  # number of grid points of the root level
+
+    rho0 = 0.3
+    fr = 0.5
+    cfl = 0.5
+    imax = 800
+    tmax = 50
+    k = 0.9  # for Greenshield model
+    c0 = 0.5  # for PW model
+
+    # -----------------------------------------------------------------------------
+    # refinement
+    nlevel = 3  # levels including the root
+    ratio = 2  # refinement ratio between levels, in space and time
+    ng = 2  # ghost cells at each patch end
+    nregrid = 4  # root steps between regrids
+    tolgrad = 0.02  # refine where |d rho / dx| exceeds this
+    tolav = 0.05  # or where the AV sensor kappa2 |du| / u0 exceeds this
+
+    # -----------------------------------------------------------------------------
+    # traffic flow model
+    # acceptable values: lwr, pw, zhang
+    model = 'lwr'
+    lmax = 1 if (model == 'lwr') else 2
+
+    # relationship between density and speed
+    # acceptable values: greenshield, greenberg, underwood
+    state = 'greenshield'
+
+    # -----------------------------------------------------------------------------
+    # numerical methods (explicit)
+    # acceptable values:
+    ## lax, lax-wendroff, maccormack, steger-warming
+    ## rk4, roe, tvd-superbee, tvd-vanleer
+    ## muscl-minmod, muscl-mc, weno5
+    method = 'lax-wendroff'
+
+    avmodel = True
+    kappa2 = .2
+    kappa4 = 0.02
+
+    # turn off AV model for first-order schemes and the reconstructions
+    order = base.get_order(method)
+    if (order == 1 or base.get_stages(method) is not None): avmodel = False
+    # the stencil of WENO5 reaches three cells past a patch end
+    if (method == 'weno5'): ng = 3
+
+    (x, dx) = set_mesh()
+    setup()
+    levels = ic()
+    (levels, tsim) = run(levels)
+
+    print('%d cell updates per root step, %d on the uniform finest grid'
+          % (cells(levels), nx * ratio ** (2 * (nlevel - 1))))
+
+    import matplotlib.pyplot as plt
+    (xc, uc) = composite(levels)
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.plot(xc, uc[0], '-o', ms=2)
+    for (l, level) in enumerate(levels[1:]):
+        for p in level:
+            ax.axvspan(xmin - .5 * dx + p.lo * spacing(l + 1),
+                       xmin - .5 * dx + p.hi * spacing(l + 1), alpha=.1, color='k')
+    ax.set_ylim(0, 1)
+    plt.show()
@@ -0,0 +1,210 @@
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import intersection
+import main
+import simulation
+import sweep
+
+# -----------------------------------------------------------------------------
+# benchmark matrix; every configuration is timed for at least budget seconds
+# of wall time (and at least one step after a warm-up step)
+methods = ['lax', 'lax-wendroff', 'maccormack', 'rk4', 'beam-warming',
+           'steger-warming', 'roe', 'tvd-superbee', 'tvd-vanleer']
+models = ['lwr', 'pw', 'zhang']
+states = ['greenshield', 'greenberg', 'underwood']
+sizes = [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+backends = ['numpy']
+dtypes = ['float64']
+budget = 0.5
+
+# the characteristic schemes need the 2x2 systems of the second-order models
+skip = {'lwr': ['steger-warming', 'roe', 'tvd-superbee', 'tvd-vanleer']}
+
+# parameters of the intersection.py scenario not given by the matrix
+scenario = {'xmin': -100, 'xmax': 100, 'nx': 151, 'rho0': 0.3, 'fr': 0.3, 'cfl': 0.5,
+            'eps': 1e-5, 'tmax': 50, 'k': 0.9, 'c0': 0.5, 'model': 'lwr',
+            'state': 'greenshield', 'method': 'lax-wendroff', 'avmodel': True,
+            'kappa2': .2, 'kappa4': 0.02, 'backend': 'numpy', 'steady': False,
+            'dtype': 'float64'}
+
+# fields identifying a result when two runs are compared
+key = ['scenario', 'model', 'state', 'method', 'backend', 'dtype', 'nx']
+
+
+# -----------------------------------------------------------------------------
+# repeat advance() until the budget is spent; returns the number of steps
+# and the wall time they took
+def timeit(advance):
+    advance()
+    steps = 0
+    t0 = time.perf_counter()
+    wall = 0.
+    while (steps == 0 or wall < budget):
+        advance()
+        steps += 1
+        wall = time.perf_counter() - t0
+    return steps, wall
+
+
+# -----------------------------------------------------------------------------
+# peak of the memory allocated during one call of advance(), in bytes
+def peak(advance):
+    tracemalloc.start()
+    try:
+        advance()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# -----------------------------------------------------------------------------
+# step() plus solver() of the corridor in main.py
+def corridor(config):
+    sweep.setup(config)
+
+    def advance():
+        main.dt = main.step()
+        main.solver()
+
+    (steps, wall) = timeit(advance)
+    return {'steps': steps, 'wall': wall, 'cells': main.nx, 'nx': main.nx,
+            'state_bytes': main.u.nbytes, 'peak_bytes': peak(advance)}
+
+
+# -----------------------------------------------------------------------------
+# one step of the corridor as a simulation.Simulation with preallocated buffers
+def instance(config):
+    sim = simulation.Simulation(config)
+    (steps, wall) = timeit(sim.advance)
+    return {'steps': steps, 'wall': wall, 'cells': sim.nx, 'nx': sim.nx,
+            'state_bytes': sim.u.nbytes, 'peak_bytes': peak(sim.advance)}
+
+
+# -----------------------------------------------------------------------------
+# time loop of the four arms of intersection.py, junction included
+def junction(config):
+    param = dict(scenario)
+    param.update(config)
+    for (name, value) in param.items():
+        setattr(intersection, name, value)
+    intersection.lmax = 1 if (intersection.model == 'lwr') else 2
+    if (not sweep.needs_av(intersection.method)): intersection.avmodel = False
+    intersection.imax = 1
+    (intersection.x, intersection.dx) = intersection.set_mesh()
+    intersection.u = np.stack([intersection.ic() for a in range(0, 4)])
+
+    (steps, wall) = timeit(intersection.run)
+    return {'steps': steps, 'wall': wall, 'cells': 4 * intersection.nx, 'nx': intersection.nx,
+            'state_bytes': intersection.u.nbytes,
+            'peak_bytes': peak(intersection.run)}
+
+
+# -----------------------------------------------------------------------------
+# time one configuration; a configuration that raises is recorded, not
+# propagated
+def measure(name, config):
+    out = dict(config, scenario=name, status='ok', steps=0, wall=0.,
+               cups=0., state_bytes=0, peak_bytes=0, error='')
+    try:
+        with np.errstate(all='ignore'):
+            out.update(scenarios[name](config))
+        out['cups'] = out.pop('cells') * out['steps'] / out['wall']
+    except Exception as err:
+        out['status'] = 'failed'
+        out['error'] = '%s: %s' % (type(err).__name__, err)
+    return out
+
+
+scenarios = {'corridor': corridor, 'simulation': instance, 'intersection': junction}
+
+
+# -----------------------------------------------------------------------------
+# the corridor over the whole matrix, the Simulation object and the
+# intersection over the grid sizes
+def suite():
+    configs = [('corridor', config) for config in
+               sweep.grid(model=models, state=states, method=methods,
+                          backend=backends, dtype=dtypes, nx=sizes)
+               if config['method'] not in skip.get(config['model'], [])]
+    configs += [('simulation', config) for config in
+                sweep.grid(model=models, state=['greenshield'],
+                           method=['lax-wendroff', 'rk4'], backend=backends,
+                           dtype=dtypes, nx=sizes)]
+    configs += [('intersection', config) for config in
+                sweep.grid(model=['lwr'], state=['greenshield'],
+                           method=['lax', 'lax-wendroff'], backend=backends,
+                           dtype=dtypes, nx=sizes)]
+    return configs
+
+
+# -----------------------------------------------------------------------------
+# machine and version the results were taken on
+def environment():
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                      stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git': rev, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'budget': budget}
+
+
+# -----------------------------------------------------------------------------
+# run the suite and write the results as JSON
+def bench(path, configs=None, verbose=True):
+    if (configs is None): configs = suite()
+    results = []
+    for (name, config) in configs:
+        results.append(measure(name, config))
+        if verbose: show(results[-1])
+    with open(path, 'w') as f:
+        json.dump({'meta': environment(), 'results': results}, f, indent=1)
+    return results
+
+
+# -----------------------------------------------------------------------------
+# one line of the progress report
+def show(r):
+    print('%-12s %-6s %-12s %-15s %8d %10.3e cells/s %10.3e B %s'
+          % (r['scenario'], r.get('model', ''), r.get('state', ''),
+             r.get('method', r['scenario']), r.get('nx', 0), r['cups'], r['peak_bytes'],
+             r['error']))
+
+
+# -----------------------------------------------------------------------------
+# speed and memory ratios (new / old) of the results two runs have in common
+def compare(old, new):
+    with open(old) as f:
+        a = json.load(f)['results']
+    with open(new) as f:
+        b = json.load(f)['results']
+    index = dict((tuple(r.get(name) for name in key), r) for r in a)
+    rows = []
+    for r in b:
+        s = index.get(tuple(r.get(name) for name in key))
+        if (s is None or s['status'] != 'ok' or r['status'] != 'ok'): continue
+        rows.append((r, r['cups'] / s['cups'], r['peak_bytes'] / max(s['peak_bytes'], 1)))
+    return rows
+
+
+if __name__ == '__main__':
+
+    # python bench.py [results.json]
+    # python bench.py compare old.json new.json
+    if (len(sys.argv) > 1 and sys.argv[1] == 'compare'):
+        for (r, speed, memory) in compare(sys.argv[2], sys.argv[3]):
+            print('%-12s %-6s %-12s %-15s %8d  speed x%6.2f  memory x%6.2f'
+                  % (r['scenario'], r.get('model', ''), r.get('state', ''),
+                     r.get('method', r['scenario']), r['nx'], speed, memory))
+    else:
+        bench(sys.argv[1] if (len(sys.argv) > 1) else 'bench.json')
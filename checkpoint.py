@@ -0,0 +1,184 @@
+import json
+import sys
+import time
+
+import numpy as np
+
+import diagram
+import intersection
+import main
+import snapshot
+import sweep
+
+# scenarios that can be checkpointed, by the name recorded with them
+scenarios = {'main': main, 'intersection': intersection}
+
+
+# -----------------------------------------------------------------------------
+# record of one checkpoint slot: a sequence number (0 while the slot is being
+# written), the number of steps done, the signal clock, the simulated time,
+# the signal phase (1 for red), the residual history and the state
+def layout(shape, dtype, imax):
+    return np.dtype([('seq', '<i8'), ('step', '<i8'), ('time', '<f8'), ('tsim', '<f8'),
+                     ('red', 'i1'), ('history', '<f8', (imax,)),
+                     ('u', np.dtype(dtype), tuple(shape))])
+
+
+# -----------------------------------------------------------------------------
+# periodic checkpoints of a run in a memory-mapped .npy file of two slots and
+# a JSON sidecar with the run parameters. A write goes to the older slot and
+# sets its sequence number last, so a process that dies while writing leaves
+# the other slot intact; it copies the state and the residuals of the steps
+# since that slot was last written, and leaves the flushing to disk to the
+# operating system. Writes closer than every seconds of wall time to the
+# previous one are skipped unless forced
+class Checkpoint(object):
+
+    def __init__(self, path, shape, dtype, imax, meta=None, every=5.):
+        self.path = path
+        self.every = every
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=layout(shape, dtype, imax),
+                                              shape=(2,))
+        self.data['seq'] = 0
+        self.seq = 0
+        self.done = [0, 0]  # steps of the history each slot holds
+        self.twrite = time.perf_counter()
+        meta = dict(meta or {})
+        meta.update({'shape': list(shape), 'dtype': np.dtype(dtype).name, 'imax': imax})
+        with open(snapshot.sidecar(path), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    # continue writing to an existing checkpoint file
+    @classmethod
+    def open(cls, path, every=5.):
+        self = cls.__new__(cls)
+        self.path = path
+        self.every = every
+        self.data = np.load(path, mmap_mode='r+')
+        self.seq = int(self.data['seq'].max())
+        self.done = [int(s['step']) if (s['seq'] > 0) else 0 for s in self.data]
+        self.twrite = time.perf_counter()
+        return self
+
+    def write(self, u, step, clock, tsim, history, color, force=False):
+        now = time.perf_counter()
+        if (not force and now - self.twrite < self.every): return False
+        s = int(np.argmin(self.data['seq']))
+        slot = self.data[s:s + 1]
+        slot['seq'] = 0
+        slot['u'][0] = u
+        done = min(self.done[s], step)
+        slot['history'][0, done:step] = history[done:step]
+        slot['step'] = step
+        slot['time'] = clock
+        slot['tsim'] = tsim
+        slot['red'] = (color == 'r')
+        self.seq += 1
+        slot['seq'] = self.seq
+        self.done[s] = step
+        self.twrite = now
+        return True
+
+    def close(self):
+        self.data.flush()
+        del self.data
+
+
+# -----------------------------------------------------------------------------
+# latest complete checkpoint of a file and the run parameters
+def load(path):
+    with open(snapshot.sidecar(path)) as f:
+        meta = json.load(f)
+    data = np.load(path, mmap_mode='r')
+    s = int(np.argmax(data['seq']))
+    if (data['seq'][s] <= 0): raise ValueError('%s holds no complete checkpoint' % path)
+    step = int(data['step'][s])
+    rec = {'step': step, 'time': float(data['time'][s]), 'tsim': float(data['tsim'][s]),
+           'color': 'r' if data['red'][s] else 'g',
+           'history': np.array(data['history'][s, :step]), 'u': np.array(data['u'][s])}
+    return rec, meta
+
+
+# -----------------------------------------------------------------------------
+# what is saved of a streamed forcing (inflow, signal): None when there is
+# none, else its type and its key() where it has one (as timing.Plan). The
+# forcing itself is not; a restart is given it again and checked against this
+def forcing(f):
+    if (f is None): return None
+    if hasattr(f, 'key'): return [type(f).__name__, list(f.key())]
+    return [type(f).__name__]
+
+
+# -----------------------------------------------------------------------------
+# run a scenario, set up as for module.run, and checkpoint it to path every
+# few seconds and at the end; returns what module.run returns. A diagram
+# instance as state is saved by its description
+def run(module, path, every=5., monitor=None):
+    meta = dict((name, getattr(module, name)) for name in sweep.defaults if hasattr(module, name))
+    if isinstance(meta.get('state'), diagram.Diagram): meta['state'] = meta['state'].describe()
+    meta['scenario'] = module.__name__
+    meta['inflow'] = forcing(module.inflow)
+    meta['signal'] = forcing(module.signal)
+    ck = Checkpoint(path, module.u.shape, module.u.dtype, module.imax, meta, every)
+    return proceed(module, ck, None, monitor)
+
+
+# -----------------------------------------------------------------------------
+# continue the run of a checkpoint file from its latest checkpoint, still
+# checkpointing to it; the steps it takes are those the run would have taken
+# without the interruption. The run's streamed forcing is passed again as
+# inflow and signal; forcing that does not match the saved one is refused
+def restart(path, every=5., monitor=None, inflow=None, signal=None):
+    (rec, meta) = load(path)
+    module = scenarios[meta['scenario']]
+    for (name, f) in (('inflow', inflow), ('signal', signal)):
+        if (forcing(f) != meta.get(name)):
+            raise ValueError('%s was run with %s %s, not %s' % (path, name, meta.get(name), forcing(f)))
+    (module.inflow, module.signal) = (inflow, signal)
+    for name in meta:
+        if name in sweep.defaults: setattr(module, name, meta[name])
+    if isinstance(module.state, dict): module.state = diagram.get(module.state)
+    module.lmax = 1 if (module.model == 'lwr') else 2
+    if (not sweep.needs_av(module.method)): module.avmodel = False
+    (module.x, module.dx) = module.set_mesh()
+    module.u = rec['u']
+    return proceed(module, Checkpoint.open(path, every), rec, monitor)
+
+
+# -----------------------------------------------------------------------------
+# module.run with a monitor writing the checkpoints
+def proceed(module, ck, resume, monitor):
+    last = {'time': 0., 'tsim': 0., 'color': 'g'}
+    if (resume is not None): last.update(resume)
+
+    # main passes the simulated time and keeps the signal clock in clock;
+    # intersection passes its time, which is both
+    def write(i, t, color):
+        last.update(tsim=t, color=color, time=getattr(module, 'clock', t))
+        ck.write(module.u, i + 1, last['time'], t, module.history, color)
+        if (monitor is not None): monitor(i, t, color)
+
+    try:
+        out = module.run(write, resume)
+        ck.write(module.u, len(module.history), last['time'], last['tsim'],
+                 module.history, last['color'], force=True)
+    finally:
+        ck.close()
+    return out
+
+
+if __name__ == '__main__':
+
+    # run the corridor of main.py with checkpoints, or continue one:
+    # python checkpoint.py run.ckpt.npy [model] [method] [nx] [imax]
+    # python checkpoint.py restart run.ckpt.npy
+    if (sys.argv[1] == 'restart'):
+        tsim = restart(sys.argv[2])
+    else:
+        sweep.setup({'model': sys.argv[2] if (len(sys.argv) > 2) else 'lwr',
+                     'method': sys.argv[3] if (len(sys.argv) > 3) else 'lax-wendroff',
+                     'nx': int(float(sys.argv[4])) if (len(sys.argv) > 4) else 151,
+                     'imax': int(sys.argv[5]) if (len(sys.argv) > 5) else 800})
+        tsim = run(main, sys.argv[1])
+    print('t = %.6f after %d steps, max rho = %.6f'
+          % (tsim, len(main.history), main.u[0].max()))
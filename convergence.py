@@ -0,0 +1,123 @@
+import sys
+import time
+
+import numpy as np
+
+import main
+import sweep
+
+# schemes compared on lwr; the systems pw and zhang also take the schemes
+# that need their 2x2 Jacobians
+methods = ['lax', 'lax-wendroff', 'maccormack', 'rk4', 'beam-warming',
+           'muscl-minmod', 'muscl-mc', 'weno5']
+systems = ['steger-warming', 'roe', 'tvd-superbee', 'tvd-vanleer']
+
+# grids compared, each of twice the cells of the previous one so that they
+# share their grid points and the signal cell, and the reference grid
+grids = [51, 101, 201, 401, 801, 1601]
+reference = 6401
+
+
+# -----------------------------------------------------------------------------
+# run the corridor of a configuration (see sweep.defaults) until simulated
+# time horizon, the last step cut short to end on it; returns the density,
+# the number of steps and the wall time of the time loop
+def solve(config, horizon):
+    sweep.setup(config)
+    tsim = 0.
+    steps = 0
+    t0 = time.perf_counter()
+    with np.errstate(all='ignore'):
+        while (tsim < horizon):
+            main.dt = main.step()
+            if (tsim + main.dt > horizon): main.dt = main.tau = horizon - tsim
+            main.solver()
+            tsim += main.dt
+            steps += 1
+            main.bc(tsim, tsim)
+    wall = time.perf_counter() - t0
+    return (np.array(main.u[0], dtype=float), steps, wall)
+
+
+# -----------------------------------------------------------------------------
+# error against wall time of every method on every grid: the L1 norm of the
+# density against a WENO5 run on the reference grid, interpolated to the
+# grid points, at horizon (by default 80% of the red phase, while the queue
+# grows behind the signal). The error of the coarse grids is mostly the
+# place of the queue tail, set by the mass the signal cell adds, which
+# converges at first order for every scheme. Every run takes the best wall
+# time of repeat runs; returns one row per method and grid
+def study(config=None, methods=None, grids=grids, reference=reference, horizon=None,
+          repeat=3):
+    param = dict(sweep.defaults)
+    param.update(config or {})
+    if (methods is None):
+        methods = globals()['methods'] + ([] if (param['model'] == 'lwr') else systems)
+    if (horizon is None): horizon = .8 * param['tmax'] * param['fr']
+    (uref, steps, wall) = solve(dict(param, method='weno5', nx=reference), horizon)
+    xref = np.linspace(param['xmin'], param['xmax'], reference)
+    rows = []
+    for method in methods:
+        for nx in grids:
+            cfg = dict(param, method=method, nx=nx)
+            walls = []
+            for r in range(0, repeat):
+                (u, steps, wall) = solve(cfg, horizon)
+                walls.append(wall)
+            x = np.linspace(param['xmin'], param['xmax'], nx)
+            dx = (param['xmax'] - param['xmin']) / (nx - 1.)
+            error = dx * float(np.sum(abs(u - np.interp(x, xref, uref))))
+            rows.append({'method': method, 'nx': nx, 'steps': steps, 'wall': min(walls),
+                         'error': error if np.isfinite(error) else np.inf})
+    return rows
+
+
+# -----------------------------------------------------------------------------
+# observed order of every row: the rate the error falls at against the
+# previous grid of its method (nan for its first grid)
+def orders(rows):
+    out = []
+    prev = {}
+    for r in rows:
+        p = prev.get(r['method'])
+        with np.errstate(all='ignore'):
+            rate = np.log(p['error'] / r['error']) / np.log((r['nx'] - 1.) / (p['nx'] - 1.)) \
+                if (p is not None) else np.nan
+        out.append(float(rate))
+        prev[r['method']] = r
+    return out
+
+
+# -----------------------------------------------------------------------------
+# for every method the run of least wall time whose error is within
+# tolerance, sorted by wall time, then the methods none of whose grids
+# meets it (with nx None)
+def cheapest(rows, tolerance):
+    best = {}
+    for r in rows:
+        if (r['error'] > tolerance): continue
+        if (r['method'] not in best or r['wall'] < best[r['method']]['wall']):
+            best[r['method']] = r
+    found = sorted(best.values(), key=lambda r: r['wall'])
+    return found + [{'method': m, 'nx': None} for m in dict.fromkeys(r['method'] for r in rows)
+                    if m not in best]
+
+
+if __name__ == '__main__':
+
+    # error against wall time on the red-signal corridor and the cheapest
+    # grid per scheme: python convergence.py [tolerance] [model]
+    tolerance = float(sys.argv[1]) if (len(sys.argv) > 1) else .5
+    model = sys.argv[2] if (len(sys.argv) > 2) else 'lwr'
+    rows = study({'model': model})
+    print('%-14s %6s %6s %10s %10s %6s' % ('method', 'nx', 'steps', 'wall s', 'L1 error', 'order'))
+    for (r, rate) in zip(rows, orders(rows)):
+        print('%-14s %6d %6d %10.4f %10.4g %6.2f'
+              % (r['method'], r['nx'], r['steps'], r['wall'], r['error'], rate))
+    print()
+    print('cheapest grid with L1 error <= %g:' % tolerance)
+    for r in cheapest(rows, tolerance):
+        if (r['nx'] is None):
+            print('%-14s none of the grids' % r['method'])
+        else:
+            print('%-14s nx = %5d  %8.4f s  error %.4g' % (r['method'], r['nx'], r['wall'], r['error']))
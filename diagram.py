@@ -0,0 +1,241 @@
+import sys
+
+import numpy as np
+
+
+# -----------------------------------------------------------------------------
+# fundamental diagram: speed v(rho), its derivative dv(rho) and the flux
+# rho v(rho), all whole-array; k may be an array broadcasting against rho.
+# v and dv write to the array out if given (the allocation-free kernels of
+# main.py)
+class Diagram(object):
+
+    rhomax = 1.  # upper end of the densities the diagram is used for
+
+    def v(self, rho, out=None):
+        raise NotImplementedError
+
+    def dv(self, rho, out=None):
+        raise NotImplementedError
+
+    def flux(self, rho):
+        return rho * self.v(rho)
+
+    # critical density, where the flux has its maximum
+    def critical(self, n=4097):
+        rho = np.linspace(0, self.rhomax, n)
+        return rho[np.argmax(self.flux(rho))]
+
+    # lookup table of n points over [0, rhomax] for expensive curves
+    def table(self, n=1025, rhomax=None):
+        return Table(self, n, rhomax)
+
+    # JSON-ready description: the class name and the arguments it is built
+    # from, which get() builds the diagram from again
+    def describe(self):
+        return {'diagram': type(self).__name__}
+
+
+class Greenshield(Diagram):
+
+    def __init__(self, k=0.9):
+        self.k = k
+        self.rhomax = 1 / k
+
+    def v(self, rho, out=None):
+        if (out is None): return 1 - self.k * rho
+        np.multiply(rho, self.k, out=out)
+        return np.subtract(1, out, out=out)
+
+    def dv(self, rho, out=None):
+        if (out is None): return -self.k
+        out[...] = -self.k
+        return out
+
+    def critical(self, n=None):
+        return 1 / (2 * self.k)
+
+    def describe(self):
+        return {'diagram': 'Greenshield', 'k': np.asarray(self.k).tolist()}
+
+
+class Greenberg(Diagram):
+
+    vmax = 10.
+
+    def __init__(self, k=None):
+        self.rhoc = float(1 / np.exp(self.vmax))  # below rhoc the speed is vmax
+
+    def v(self, rho, out=None):
+        if (out is None):
+            return np.where(rho < self.rhoc, self.vmax,
+                            np.minimum(self.vmax, np.log(1 / np.maximum(rho, self.rhoc))))
+        low = rho < self.rhoc
+        np.maximum(rho, self.rhoc, out=out)
+        np.divide(1, out, out=out)
+        np.log(out, out=out)
+        np.minimum(out, self.vmax, out=out)
+        np.copyto(out, self.vmax, where=low)
+        return out
+
+    def dv(self, rho, out=None):
+        if (out is None): return np.where(rho < self.rhoc, 0., -1 / np.maximum(rho, self.rhoc))
+        low = rho < self.rhoc
+        np.maximum(rho, self.rhoc, out=out)
+        np.divide(-1, out, out=out)
+        np.copyto(out, 0., where=low)
+        return out
+
+    def critical(self, n=None):
+        return 1 / np.exp(1)
+
+
+class Underwood(Diagram):
+
+    def __init__(self, k=None):
+        self.rhomax = 10.
+
+    def v(self, rho, out=None):
+        if (out is None): return np.exp(-rho)
+        np.negative(rho, out=out)
+        return np.exp(out, out=out)
+
+    def dv(self, rho, out=None):
+        if (out is None): return -np.exp(-rho)
+        self.v(rho, out)
+        return np.negative(out, out=out)
+
+    def critical(self, n=None):
+        return 1.
+
+
+# -----------------------------------------------------------------------------
+# calibrated curve through the points (rho, v) with increasing rho, linear in
+# between and constant beyond the first and last point
+class Curve(Diagram):
+
+    def __init__(self, rho, v):
+        self.rho = np.asarray(rho, dtype=float)
+        self.speed = np.asarray(v, dtype=float)
+        self.slope = np.diff(self.speed) / np.diff(self.rho)
+        self.rhomax = self.rho[-1]
+
+    def v(self, rho, out=None):
+        return put(np.interp(rho, self.rho, self.speed), out)
+
+    def dv(self, rho, out=None):
+        i = np.searchsorted(self.rho, rho, side='right') - 1
+        inside = (i >= 0) & (i < len(self.slope))
+        return put(np.where(inside, self.slope[np.clip(i, 0, len(self.slope) - 1)], 0.), out)
+
+    def describe(self):
+        return {'diagram': 'Curve', 'rho': self.rho.tolist(), 'v': self.speed.tolist()}
+
+    # curve from detector samples of density and flow: the speed of a density
+    # bin is its mean flow over its mean density, made non-increasing in the
+    # density over the nbin bins
+    @classmethod
+    def from_detector(cls, rho, flow, nbin=20):
+        rho = np.asarray(rho, dtype=float)
+        flow = np.asarray(flow, dtype=float)
+        edges = np.linspace(0, rho.max(), nbin + 1)
+        b = np.clip(np.searchsorted(edges, rho, side='right') - 1, 0, nbin - 1)
+        full = np.bincount(b, minlength=nbin) > 0
+        r = np.bincount(b, rho, minlength=nbin)[full]
+        q = np.bincount(b, flow, minlength=nbin)[full]
+        return cls(r / np.bincount(b, minlength=nbin)[full], np.minimum.accumulate(q / r))
+
+
+# -----------------------------------------------------------------------------
+# v and dv of another diagram tabulated at n evenly spaced densities of
+# [0, rhomax]; lookups interpolate linearly by direct indexing and hold the
+# end values outside the range
+class Table(Diagram):
+
+    def __init__(self, source, n=1025, rhomax=None):
+        self.source = source
+        self.rhomax = source.rhomax if (rhomax is None) else rhomax
+        rho = np.linspace(0, self.rhomax, n)
+        self.scale = (n - 1) / self.rhomax
+        self.vt = self.pair(source.v(rho), n)
+        self.dvt = self.pair(source.dv(rho), n)
+
+    # values and slopes per table interval; the last interval has slope 0 so
+    # the end of the range needs no special index
+    def pair(self, t, n):
+        t = np.asarray(t, dtype=float) * np.ones(n)
+        return (t, np.append(np.diff(t), 0.))
+
+    def lookup(self, table, rho):
+        (t, dt) = table
+        x = np.clip(rho * self.scale, 0, len(t) - 1)
+        i = x.astype(np.intp)
+        x -= i
+        return t[i] + x * dt[i]
+
+    def v(self, rho, out=None):
+        return put(self.lookup(self.vt, rho), out)
+
+    def dv(self, rho, out=None):
+        return put(self.lookup(self.dvt, rho), out)
+
+    def critical(self, n=None):
+        return self.source.critical()
+
+    def describe(self):
+        return {'diagram': 'Table', 'source': self.source.describe(), 'n': len(self.vt[0]),
+                'rhomax': float(self.rhomax)}
+
+
+# -----------------------------------------------------------------------------
+# a, or a copied to out if given
+def put(a, out):
+    if (out is None): return a
+    np.copyto(out, a)
+    return out
+
+
+diagrams = {'greenshield': Greenshield, 'greenberg': Greenberg,
+            'underwood': Underwood}
+
+# classes a description names
+kinds = {'Greenshield': Greenshield, 'Greenberg': Greenberg, 'Underwood': Underwood,
+         'Curve': Curve, 'Table': Table}
+
+
+# -----------------------------------------------------------------------------
+# diagram of a state parameter: one of the names in diagrams (with the
+# Greenshield k), a Diagram instance, used as is, or a description of one
+# (see Diagram.describe)
+def get(state, k=0.9):
+    if isinstance(state, Diagram): return state
+    if isinstance(state, dict):
+        args = dict(state)
+        kind = args.pop('diagram')
+        if (kind not in kinds): raise ValueError('unknown diagram %s' % kind)
+        if ('source' in args): args['source'] = get(args['source'])
+        return kinds[kind](**args)
+    return diagrams[state](k)
+
+
+if __name__ == '__main__':
+
+    # speed of the table lookup over direct evaluation, and its error:
+    # python diagram.py [state] [n]
+    import time
+
+    state = sys.argv[1] if (len(sys.argv) > 1) else 'greenberg'
+    n = int(sys.argv[2]) if (len(sys.argv) > 2) else 1025
+    fd = get(state)
+    tab = fd.table(n)
+    rho = np.random.rand(10 ** 6) * fd.critical() * 2
+    for (name, f) in (('v', lambda d: d.v(rho)), ('flux', lambda d: d.flux(rho))):
+        wall = []
+        for d in (fd, tab):
+            f(d)
+            t0 = time.perf_counter()
+            for rep in range(0, 10):
+                f(d)
+            wall.append((time.perf_counter() - t0) / 10 * 1e3)
+        print('%-5s direct %8.3f ms  table %8.3f ms  max error %.2e'
+              % (name, wall[0], wall[1], abs(f(fd) - f(tab)).max()))
@@ -0,0 +1,150 @@
+import numpy as np
+
+import intersection as base
+
+
+# -----------------------------------------------------------------------------
+# set computational mesh
+def set_mesh():
+    dx = (xmax - xmin) / (nx - 1.)
+    x = np.linspace(xmin, xmax, nx)
+    return x, dx
+
+
+# -----------------------------------------------------------------------------
+# broadcast the per-scenario parameters to one entry per member and hand the
+# model and scheme to the whole-array kernels; parameters multiplying cell
+# values become (nbatch, 1) columns so they broadcast against u[:, l, :]
+def setup():
+    global rho0, fr, cfl, k, c0, nbatch
+    (rho0, fr, cfl, k, c0) = [np.array(p, dtype=float).ravel() for p in
+                              np.broadcast_arrays(rho0, fr, cfl, k, c0)]
+    nbatch = rho0.size
+    for name in ('model', 'lmax', 'state', 'method', 'avmodel',
+                 'kappa2', 'kappa4', 'nx', 'dx'):
+        setattr(base, name, globals()[name])
+    base.backend = 'numpy'
+    base.k = k[:, np.newaxis].astype(dtype)
+    base.c0 = c0[:, np.newaxis].astype(dtype)
+
+
+# -----------------------------------------------------------------------------
+# define initial condition of every member, shape (nbatch, lmax, nx)
+def ic():
+    u = np.ones((nbatch, lmax, nx), dtype=dtype)
+    rho = rho0[:, np.newaxis]
+    if (model == 'lwr'):
+        u[:, 0, :] *= rho
+    elif (model == 'pw'):
+        u[:, 0, :] *= rho
+        u[:, 1, :] *= rho * base.vel_vec(rho)
+    elif (model == 'zhang'):
+        u[:, 0, :] *= rho
+        u[:, 1, :] *= 0.
+    return u
+
+
+# -----------------------------------------------------------------------------
+# compute step size of every member, or one step shared by all of them
+def step(u):
+    lam = base.maxlam(u)
+    dt = cfl * dx / lam
+    if (dtmode == 'shared'): dt = np.full(nbatch, dt.min())
+    return dt, lam
+
+
+# -----------------------------------------------------------------------------
+# signal at the middle of the road and outflow boundaries
+def bc(u, time):
+    c = nx // 2
+    red = time < tmax * fr
+    u[:, 0, c] = np.where(red, 1., rho0)
+    if (model == 'pw'):
+        rho = u[:, 0, c:c + 1]
+        u[:, 1, c] = (rho * base.vel_vec(rho))[:, 0]
+    elif (model == 'zhang'):
+        u[:, 1, c] = 0.
+    u[:, :, 0] = u[:, :, 1]
+    u[:, :, -1] = u[:, :, -2]
+    return red
+
+
+# -----------------------------------------------------------------------------
+# advance all members over imax steps; step sizes and times stay float64
+def run():
+    setup()
+    u = ic()
+    time = np.zeros(nbatch)
+    for i in range(0, imax):
+        (dt, lam) = step(u)
+        base.dt = dt[:, np.newaxis, np.newaxis].astype(dtype)
+        u = base.solver(u, lam)
+        time += dt
+        bc(u, time)
+        time[time > tmax] = 0
+    return u, time
+
+
+if __name__ == '__main__':
+
+    # -----------------------------------------------------------------------------
+    # parameters
+    xmin = 0
+    xmax = 200
+    nx = 151  # number of grid points
+
+    imax = 800
+    tmax = 50
+
+    # per-scenario parameters, scalars or arrays broadcast against each other
+    rho0, fr = np.meshgrid(np.linspace(.1, .6, 20), [.3, .5, .7])
+    cfl = 0.5
+    k = 0.9  # for Greenshield model
+    c0 = 0.5  # for PW model
+
+    # floating-point type of the states; float32 halves memory and bandwidth
+    dtype = 'float64'
+
+    # step size
+    # acceptable values:
+    ## member (every scenario advances at its own CFL step)
+    ## shared (all scenarios take the smallest step)
+    dtmode = 'member'
+
+    # -----------------------------------------------------------------------------
+    # traffic flow model
+    # acceptable values: lwr, pw, zhang
+    model = 'lwr'
+    lmax = 1 if (model == 'lwr') else 2
+
+    # relationship between density and speed
+    # acceptable values: greenshield, greenberg, underwood
+    state = 'greenshield'
+
+    # -----------------------------------------------------------------------------
+    # numerical methods
+    # acceptable values:
+    ## lax, lax-wendroff, maccormack, steger-warming
+    ## rk4, roe, tvd-superbee, tvd-vanleer
+    ## muscl-minmod, muscl-mc, weno5 (reconstructions with SSP Runge-Kutta)
+    method = 'lax-wendroff'
+
+    avmodel = True
+    kappa2 = .2
+    kappa4 = 0.02
+
+    # turn off AV model for first-order schemes and the reconstructions
+    order = base.get_order(method)
+    if (order == 1 or base.get_stages(method) is not None): avmodel = False
+
+    # grid points
+    (x, dx) = set_mesh()
+
+    (u, time) = run()
+
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.plot(x, u[:, 0, :].T)
+    ax.set_ylim(0, 1)
+    plt.show()
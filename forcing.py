@@ -0,0 +1,160 @@
+import csv
+import os
+import sys
+
+import numpy as np
+
+
+# -----------------------------------------------------------------------------
+# sources of a time series: functions returning a fresh iterator over chunks
+# (t, value) of at most chunk samples, t increasing. Only the chunk being
+# read is held in memory
+
+# columns time and value of a CSV file with a header row
+def csv_source(path, time='time', value='value', chunk=4096):
+    def chunks():
+        with open(path, newline='') as f:
+            rows = csv.reader(f)
+            header = next(rows)
+            (it, iv) = (header.index(time), header.index(value))
+            (t, v) = ([], [])
+            for row in rows:
+                t.append(float(row[it]))
+                v.append(float(row[iv]))
+                if (len(t) == chunk):
+                    yield (np.array(t), np.array(v))
+                    (t, v) = ([], [])
+            if t: yield (np.array(t), np.array(v))
+    return chunks
+
+
+# (n, 2) records of time and value, from a .npy file (memory-mapped) or a raw
+# binary file of dtype
+def binary_source(path, chunk=65536, dtype='<f8'):
+    def chunks():
+        if (os.path.splitext(path)[1] == '.npy'):
+            data = np.load(path, mmap_mode='r')
+            for s in range(0, len(data), chunk):
+                block = np.array(data[s:s + chunk], dtype=float)
+                yield (block[:, 0], block[:, 1])
+        else:
+            with open(path, 'rb') as f:
+                while True:
+                    block = np.fromfile(f, dtype, 2 * chunk).astype(float)
+                    if (block.size == 0): return
+                    block = block.reshape(-1, 2)
+                    yield (block[:, 0], block[:, 1])
+    return chunks
+
+
+# -----------------------------------------------------------------------------
+# streamed time series, evaluated at a time by linear interpolation between
+# its samples (or holding the last sample before it, for logs of states) and
+# constant before the first and after the last sample. Chunks are read as the
+# time advances, keeping the last sample of the previous chunk to
+# interpolate across their border; a time before the chunk in memory reads
+# the source again from its start. transform maps the values of every chunk
+# as it is read, e.g. detector counts to densities
+class Series(object):
+
+    def __init__(self, source, hold=False, transform=None):
+        self.source = source
+        self.hold = hold
+        self.transform = transform
+        self.rewind()
+
+    def rewind(self):
+        self.chunks = self.source()
+        self.t = np.empty(0)
+        self.v = np.empty(0)
+        self.done = False
+        self.load()
+        if self.done: raise ValueError('the time series has no samples')
+        self.first = True  # the chunk in memory is the first one
+
+    # next chunk behind the last sample of the current one
+    def load(self):
+        for (t, v) in self.chunks:
+            if (self.transform is not None): v = self.transform(v)
+            self.t = np.concatenate((self.t[-1:], t))
+            self.v = np.concatenate((self.v[-1:], v))
+            self.first = False
+            return
+        self.done = True
+
+    def __call__(self, time):
+        if (time < self.t[0] and not self.first): self.rewind()
+        while (time >= self.t[-1] and not self.done):
+            self.load()
+        i = np.searchsorted(self.t, time, side='right') - 1
+        if (i < 0): return float(self.v[0])
+        if (i >= len(self.t) - 1 or self.hold): return float(self.v[i])
+        (t0, t1) = (self.t[i], self.t[i + 1])
+        return float(self.v[i] + (time - t0) / (t1 - t0) * (self.v[i + 1] - self.v[i]))
+
+
+# -----------------------------------------------------------------------------
+# density of the flows on the free-flow branch of a diagram (diagram.py), by
+# bisection on [0, critical density]; flows above capacity give the critical
+# density
+def density(flow, law, n=60):
+    flow = np.asarray(flow, dtype=float)
+    lo = np.zeros(flow.shape)
+    hi = np.full(flow.shape, float(law.critical()))
+    for i in range(0, n):
+        mid = .5 * (lo + hi)
+        low = law.flux(mid) < flow
+        lo = np.where(low, mid, lo)
+        hi = np.where(low, hi, mid)
+    return .5 * (lo + hi)
+
+
+if __name__ == '__main__':
+
+    # replay synthetic detector data of a day (one sample every dt seconds)
+    # through a series and report the peak memory, which does not grow with
+    # the length of the file: python forcing.py [dt] [csv|npy]
+    import tempfile
+    import time
+    import tracemalloc
+
+    import diagram
+
+    dt = float(sys.argv[1]) if (len(sys.argv) > 1) else 1.
+    kind = sys.argv[2] if (len(sys.argv) > 2) else 'csv'
+    law = diagram.get('greenshield')
+    for days in (1, 8):
+        t = np.arange(0, days * 86400., dt)
+        # counts per sample interval, morning and evening peaks
+        q = .15 + .1 * np.sin(2 * np.pi * t / 86400.) ** 2 + .02 * np.random.rand(len(t))
+        path = os.path.join(tempfile.mkdtemp(), 'detector.' + kind)
+        if (kind == 'csv'):
+            with open(path, 'w', newline='') as f:
+                w = csv.writer(f)
+                w.writerow(['time', 'value'])
+                w.writerows(zip(t.tolist(), q.tolist()))
+            source = csv_source(path)
+        else:
+            np.save(path, np.stack((t, q), axis=1))
+            source = binary_source(path, chunk=4096)
+
+        # lookups every 7.3 s; timed, then again under tracemalloc
+        def replay():
+            series = Series(source, transform=lambda c: density(c, law))
+            (n, total, s) = (0, 0., 0.)
+            while (s < days * 86400.):
+                total += series(s)
+                n += 1
+                s += 7.3
+            return (n, total)
+
+        t0 = time.perf_counter()
+        (n, total) = replay()
+        wall = time.perf_counter() - t0
+        tracemalloc.start()
+        replay()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%d day(s), %8d samples: %7d lookups in %6.3f s, peak %8d B, '
+              'mean density %.4f' % (days, len(t), n, wall, peak, total / n))
+        os.remove(path)
@@ -0,0 +1,164 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import deque
+
+import numpy as np
+
+import main
+
+# phases timed where the target has them: step size, solver, kernels,
+# boundary and junction conditions, residual norm and the time loop; the
+# monitor passed to run (rendering, snapshots) is timed as monitor
+phases = ['run', 'step', 'maxlam', 'solver', 'flux', 'residual', 'source', 'source_vec',
+          'av', 'av_vec', 'smoothing', 'bw_vec', 'roe_avg', 'reconstruct', 'update', 'bc',
+          'junction', 'resnorm']
+
+
+# -----------------------------------------------------------------------------
+# per-phase timers of a module (main, intersection, ...) or a
+# simulation.Simulation. start() replaces the phase functions of the targets
+# by timed wrappers and stop() puts the originals back, so a profiler costs
+# nothing while stopped and can be switched at any time, also from within a
+# run: the time loop looks its functions up at every call. For every phase
+# it counts the calls and sums the inclusive and the self time (without the
+# phases called from it); with memory it also sums the bytes allocated above
+# the level at the start of every call (tracemalloc, which slows numpy
+# allocations down). The last maxevents calls are kept as Chrome trace events
+class Profiler(object):
+
+    def __init__(self, targets=(main,), names=None, memory=False, maxevents=10 ** 6):
+        self.targets = list(targets)
+        self.names = phases if (names is None) else names
+        self.memory = memory
+        self.stats = {}  # name: [calls, inclusive, self, allocated bytes]
+        self.events = deque(maxlen=maxevents)
+        self.saved = []
+        self.local = threading.local()
+        self.t0 = time.perf_counter()
+
+    def start(self):
+        if self.saved: return self
+        if (self.memory and not tracemalloc.is_tracing()): tracemalloc.start()
+        for target in self.targets:
+            for name in self.names:
+                f = getattr(target, name, None)
+                if not callable(f): continue
+                self.saved.append((target, name, vars(target).get(name)))
+                setattr(target, name, self.wrap(f, name, getattr(target, '__name__',
+                                                                 type(target).__name__)))
+        return self
+
+    def stop(self):
+        for (target, name, f) in reversed(self.saved):
+            if (f is None):
+                delattr(target, name)
+            else:
+                setattr(target, name, f)
+        self.saved = []
+        if (self.memory and tracemalloc.is_tracing()): tracemalloc.stop()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # f timed as phase name; run also times the monitor it is given
+    def wrap(self, f, name, cat):
+        @functools.wraps(f)
+        def timed(*args, **kwargs):
+            if (name == 'run'):
+                if (args and callable(args[0])):
+                    args = (self.wrap(args[0], 'monitor', cat),) + args[1:]
+                elif callable(kwargs.get('monitor')):
+                    kwargs['monitor'] = self.wrap(kwargs['monitor'], 'monitor', cat)
+            stack = self.stack()
+            if self.memory:
+                # the peak so far belongs to the caller, the new one to this call
+                (base, peak) = tracemalloc.get_traced_memory()
+                if stack: stack[-1][1] = max(stack[-1][1], peak)
+                tracemalloc.reset_peak()
+            frame = [0., 0]  # time and peak bytes of the phases called from this one
+            stack.append(frame)
+            t = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t
+                stack.pop()
+                s = self.stats.setdefault(name, [0, 0., 0., 0])
+                s[0] += 1
+                s[1] += dt
+                s[2] += dt - frame[0]
+                if stack: stack[-1][0] += dt
+                if self.memory:
+                    peak = max(tracemalloc.get_traced_memory()[1], frame[1])
+                    s[3] += peak - base
+                    if stack: stack[-1][1] = max(stack[-1][1], peak)
+                self.events.append((name, cat, t, dt, threading.get_ident()))
+        return timed
+
+    # phases entered by this thread, innermost last
+    def stack(self):
+        if not hasattr(self.local, 'stack'): self.local.stack = []
+        return self.local.stack
+
+    # one row per phase, by decreasing self time: name, calls, inclusive and
+    # self seconds, mean microseconds per call, share of the total self time
+    # and allocated bytes
+    def summary(self):
+        total = sum(s[2] for s in self.stats.values()) or 1.
+        rows = [{'phase': name, 'calls': s[0], 'total': s[1], 'self': s[2],
+                 'mean_us': s[1] / s[0] * 1e6, 'share': s[2] / total, 'bytes': s[3]}
+                for (name, s) in self.stats.items()]
+        return sorted(rows, key=lambda r: -r['self'])
+
+    def report(self, f=sys.stdout):
+        f.write('%-12s %9s %10s %10s %11s %7s %12s\n'
+                % ('phase', 'calls', 'total s', 'self s', 'us/call', 'self %', 'alloc B'))
+        for r in self.summary():
+            f.write('%-12s %9d %10.4f %10.4f %11.2f %6.1f%% %12s\n'
+                    % (r['phase'], r['calls'], r['total'], r['self'], r['mean_us'],
+                       100 * r['share'], r['bytes'] if self.memory else '-'))
+
+    # the kept calls as Chrome trace-event JSON (chrome://tracing, Perfetto)
+    def write(self, path):
+        pid = os.getpid()
+        events = [{'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': (t - self.t0) * 1e6, 'dur': dt * 1e6}
+                  for (name, cat, t, dt, tid) in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def reset(self):
+        self.stats = {}
+        self.events.clear()
+        self.t0 = time.perf_counter()
+
+
+if __name__ == '__main__':
+
+    # profile the corridor of main.py and write its trace:
+    # python instrument.py [model] [method] [nx] [imax] [trace.json]
+    import sweep
+
+    config = {'model': sys.argv[1] if (len(sys.argv) > 1) else 'zhang',
+              'method': sys.argv[2] if (len(sys.argv) > 2) else 'tvd-superbee',
+              'nx': int(float(sys.argv[3])) if (len(sys.argv) > 3) else 10 ** 4,
+              'imax': int(sys.argv[4]) if (len(sys.argv) > 4) else 200}
+    path = sys.argv[5] if (len(sys.argv) > 5) else 'main.trace.json'
+    for memory in (False, True):
+        sweep.setup(config)
+        with np.errstate(all='ignore'), Profiler(memory=memory) as prof:
+            main.run(lambda i, tsim, color: None)
+        prof.report()
+        print()
+    prof.write(path)
+    print('trace of %d calls in %s' % (len(prof.events), path))
@@ -1,5 +1,8 @@
 import numpy as np
-import matplotlib.pyplot as plt
+
+import diagram
+import jitkernels
+import snapshot
 
 
 # -----------------------------------------------------------------------------
@@ -13,7 +16,7 @@ def set_mesh():
 # -----------------------------------------------------------------------------
 # define initial condition
 def ic():
-    u = np.ones((lmax, nx))
+    u = np.ones((lmax, nx), dtype=dtype)
     if model == 'lwr':
         u[0, :] *= rho0
     elif model == 'pw':
@@ -27,18 +30,21 @@ def ic():
 
 # -----------------------------------------------------------------------------
 # compute step size
-def step(u):
-    dt = cfl * dx / maxlam(u)
+def step(u, lam0=None):
+    if lam0 is None: lam0 = maxlam(u)
+    dt = cfl * dx / float(lam0)
     return dt
 
 
 # -----------------------------------------------------------------------------
 # solver
-def solver(u):
+def solver(u, lam0=None):
+    global res
     if method == 'maccormack':
         for stage in range(0, 2):
-            e = flux(u, stage)
-            res = residual(e)
+            if stage > 0: lam0 = None
+            e = flux(u, stage, lam0)
+            res = residual(u, e)
             if stage == 0:
                 u_old = np.copy(u)
                 u += dt * res
@@ -48,12 +54,21 @@ def solver(u):
         alpha = [1. / 4, 1. / 3, 1. / 2, 1.]
         u_old = np.copy(u)
         for stage in range(0, 4):
-            e = flux(u)
-            res = residual(e)
+            if stage > 0: lam0 = None
+            e = flux(u, lam0=lam0)
+            res = residual(u, e)
             u = u_old + alpha[stage] * dt * res
+    elif get_stages(method) is not None:
+        # strong-stability-preserving Runge-Kutta in Shu-Osher form
+        u_old = np.copy(u)
+        for (stage, (a, b)) in enumerate(get_stages(method)):
+            if stage > 0: lam0 = None
+            e = flux(u, lam0=lam0)
+            res = residual(u, e)
+            u = a * u_old + b * (u + dt * res)
     else:
-        e = flux(u)
-        res = residual(e)
+        e = flux(u, lam0=lam0)
+        res = residual(u, e)
         u += dt * res
     return u
 
@@ -61,6 +76,9 @@ def solver(u):
 # -----------------------------------------------------------------------------
 # compute maximum eigenvalue of Jacobi matrix
 def maxlam(u):
+    if backend == 'numba' and jitkernels.usable(u, state, k, c0):
+        return jitkernels.maxlam(u, jitkernels.MODELS[model], jitkernels.STATES[state], k, c0)
+    if backend != 'loop': return lam_vec(u).max(axis=-1)
     lam = 0.
     for i in range(0, nx):
         if model == 'lwr':
@@ -69,24 +87,31 @@ def maxlam(u):
             lam = max(lam, abs(u[1, i] / u[0, i]) + c0)
         elif model == 'zhang':
             vi = u[1, i] / u[0, i] + vel(u[0, i])
-            lam = max(lam, abs(vi), abs(vi + u[0, i] * (-k)))
+            lam = max(lam, abs(vi), abs(vi + u[0, i] * dvel(u[0, i])))
     return lam
 
 
 # -----------------------------------------------------------------------------
-# model for velocity
+# fundamental diagram of the state and k parameters (see diagram.py), built
+# again when either is reassigned
+law = None
+
+
+def fd():
+    global law
+    if law is None or law[0] is not state or law[1] is not k:
+        law = (state, k, diagram.get(state, k))
+    return law[2]
+
+
+# -----------------------------------------------------------------------------
+# model for velocity and its derivative
 def vel(rho):
-    if state == 'greenshield':
-        v = 1 - k * rho
-    elif state == 'greenberg':
-        vmax = 10.
-        if rho < 1 / np.exp(vmax):
-            v = vmax
-        else:
-            v = min(vmax, np.log(1 / rho))
-    elif state == 'underwood':
-        v = np.exp(-rho)
-    return v
+    return fd().v(rho)
+
+
+def dvel(rho):
+    return fd().dv(rho)
 
 
 # -----------------------------------------------------------------------------
@@ -118,8 +143,8 @@ def aa(ui):
     elif model == 'zhang':
         rhoi = ui[0]
         mi = ui[1]
-        ai = np.array([[rhoi * (-k) + vel(rhoi), 1], \
-                       [-mi ** 2 / rhoi ** 2 + mi * (-k), 2 * mi / rhoi + vel(rhoi)]])
+        ai = np.array([[rhoi * dvel(rhoi) + vel(rhoi), 1], \
+                       [-mi ** 2 / rhoi ** 2 + mi * dvel(rhoi), 2 * mi / rhoi + vel(rhoi)]])
     return ai
 
 
@@ -132,7 +157,7 @@ def tt(ui):
     elif model == 'zhang':
         rhoi = ui[0]
         vi = ui[1] / rhoi + vel(rhoi)
-        ti = np.array([[1, 1], [vi - vel(rhoi) - rhoi * (-k), vi - vel(rhoi)]])
+        ti = np.array([[1, 1], [vi - vel(rhoi) - rhoi * dvel(rhoi), vi - vel(rhoi)]])
     return ti
 
 
@@ -154,17 +179,30 @@ def roe_avg(u1, u2):
         v2 = u2[1] / rho2 + vel(rho2)
         avgv = (R * v2 + v1) / (R + 1)
         avgu = [avgrho, avgrho * (avgv - vel(avgrho))]
-        avglam = np.array([avgv, avgv + avgrho * (-k)])
+        avglam = np.array([avgv, avgv + avgrho * dvel(avgrho)])
     avgt = tt(avgu)
     avgsig = np.sign(avglam)
-    delta = np.dot(np.linalg.inv(avgt), u2 - u1)
+    # inverse of T = [[1, 1], [t10, t11]] in closed form
+    det = avgt[1, 1] - avgt[1, 0]
+    d = u2 - u1
+    delta = np.array([(avgt[1, 1] * d[0] - d[1]) / det, (-avgt[1, 0] * d[0] + d[1]) / det])
     return (delta, avglam, avgt, avgsig)
 
 
 # -----------------------------------------------------------------------------
 # flux vector
-def flux(u, stage=0):
+def flux(u, stage=0, lam0=None):
+    if backend == 'numba' and method in jitkernels.METHODS and \
+            jitkernels.usable(u, state, k, c0, dt):
+        if lam0 is None: lam0 = maxlam(u)
+        return jitkernels.flux(u, stage, lam0, jitkernels.MODELS[model], jitkernels.STATES[state],
+                               jitkernels.METHODS[method], k, c0, dt, dx, avmodel, kappa2, kappa4)
+    # the reconstructions only have whole-array kernels
+    if backend != 'loop' or get_stages(method) is not None: return flux_vec(u, stage, lam0)
     e = np.zeros((lmax, nx - 1))
+    # Roe averages of every interface, shared by its neighbours in TVD
+    if method == 'roe' or method[:3] == 'tvd':
+        roe = [roe_avg(u[:, i], u[:, i + 1]) for i in range(0, nx - 1)]
     for i in range(0, nx - 1):
         # Lax method
         if method == 'lax':
@@ -205,13 +243,13 @@ def flux(u, stage=0):
                 v1 = u[1, i] / rho1 + vel(rho1)
                 v2 = u[1, i + 1] / rho2 + vel(rho2)
                 lam1_p = max(v1, 0)
-                lam2_p = max(v1 + rho1 * (-k), 0)
+                lam2_p = max(v1 + rho1 * dvel(rho1), 0)
                 lam1_m = min(v2, 0)
-                lam2_m = min(v2 + rho2 * (-k), 0)
+                lam2_m = min(v2 + rho2 * dvel(rho2), 0)
             Lam_p = np.array([[lam1_p, 0], [0, lam2_p]])
             Lam_m = np.array([[lam1_m, 0], [0, lam2_m]])
-            a_p = np.dot(tt(u[:, i]), Lam_p, np.linalg.inv(tt(u[:, i])))
-            a_m = np.dot(tt(u[:, i + 1]), Lam_m, np.linalg.inv(tt(u[:, i + 1])))
+            a_p = np.dot(np.dot(tt(u[:, i]), Lam_p), np.linalg.inv(tt(u[:, i])))
+            a_m = np.dot(np.dot(tt(u[:, i + 1]), Lam_m), np.linalg.inv(tt(u[:, i + 1])))
             e_p = np.dot(a_p, u[:, i])
             e_m = np.dot(a_m, u[:, i + 1])
             e[:, i] = e_p + e_m
@@ -219,7 +257,7 @@ def flux(u, stage=0):
         elif method == 'roe':
             e1 = ee(u[:, i])
             e2 = ee(u[:, i + 1])
-            (delta, avglam, avgt, avgsig) = roe_avg(u[:, i], u[:, i + 1])
+            (delta, avglam, avgt, avgsig) = roe[i]
             e[:, i] = .5 * (e1 + e2)
             for l in range(0, lmax):
                 e[:, i] -= .5 * delta[l] * abs(avglam[l]) * avgt[:, l]
@@ -230,12 +268,9 @@ def flux(u, stage=0):
 
             e[:, i] = .5 * (e1 + e2)
             if 0 < i < nx - 2:
-                (delta, avglam, avgt, avgsig) = \
-                    roe_avg(u[:, i], u[:, i + 1])
-                (delta1, avglam1, avgt1, avgsig1) = \
-                    roe_avg(u[:, i - 1], u[:, i])
-                (delta2, avglam2, avgt2, avgsig2) = \
-                    roe_avg(u[:, i + 1], u[:, i + 2])
+                (delta, avglam, avgt, avgsig) = roe[i]
+                delta1 = roe[i - 1][0]
+                delta2 = roe[i + 1][0]
                 for l in range(0, lmax):
                     if avgsig[l] > 0:
                         r = 1e2 if (delta[l] == 0) else delta1[l] / delta[l]
@@ -250,7 +285,7 @@ def flux(u, stage=0):
                                                         - avgsig[l])) * delta[l] * abs(avglam[l]) * avgt[:, l]
 
     # artificial viscosity
-    if (avmodel): e = av(u, e)
+    if (avmodel): e = av(u, e, lam0)
     return e
 
 
@@ -269,7 +304,10 @@ def source(u):
 
 # -----------------------------------------------------------------------------
 # residual
-def residual(e):
+def residual(u, e):
+    if backend == 'numba' and jitkernels.usable(u, state, k):
+        return jitkernels.residual(u, e, jitkernels.MODELS[model], jitkernels.STATES[state], k, dx)
+    if backend != 'loop': return residual_vec(u, e)
     res = np.zeros((lmax, nx))
     for i in range(1, nx - 1):
         res[:, i] = -(e[:, i] - e[:, i - 1]) / dx
@@ -279,9 +317,9 @@ def residual(e):
 
 # -----------------------------------------------------------------------------
 # artificial viscosity
-def av(u, e):
+def av(u, e, lam0=None):
     # Von-Neumann & Ritchmyer
-    lam0 = maxlam(u)
+    if lam0 is None: lam0 = maxlam(u)
     u0 = .5
     for i in range(1, nx - 2):
         du = u[:, i + 1] - u[:, i]
@@ -292,6 +330,297 @@ def av(u, e):
     return e
 
 
+# -----------------------------------------------------------------------------
+# model for velocity and its derivative (whole array)
+def vel_vec(rho):
+    return fd().v(rho)
+
+
+def dvel_vec(rho):
+    return fd().dv(rho)
+
+
+# -----------------------------------------------------------------------------
+# spectral radius of Jacobi matrix at all grid points
+def lam_vec(u):
+    if model == 'lwr':
+        lam = abs(vel_vec(u[..., 0, :]))
+    elif model == 'pw':
+        lam = abs(u[..., 1, :] / u[..., 0, :]) + c0
+    elif model == 'zhang':
+        vi = u[..., 1, :] / u[..., 0, :] + vel_vec(u[..., 0, :])
+        lam = np.maximum(abs(vi), abs(vi + u[..., 0, :] * dvel_vec(u[..., 0, :])))
+    return lam
+
+
+# -----------------------------------------------------------------------------
+# flux vectors at all grid points, shape (..., lmax, n)
+def ee_vec(u):
+    if model == 'lwr':
+        rho = u[..., 0, :]
+        e = (rho * vel_vec(rho))[..., np.newaxis, :]
+    elif model == 'pw':
+        rho = u[..., 0, :]
+        v = u[..., 1, :] / u[..., 0, :]
+        e = np.stack([rho * v, rho * v ** 2 + c0 ** 2 * rho], axis=-2)
+    elif model == 'zhang':
+        rho = u[..., 0, :]
+        m = u[..., 1, :]
+        e = np.stack([m + rho * vel_vec(rho), m ** 2 / rho + m * vel_vec(rho)], axis=-2)
+    return e
+
+
+# -----------------------------------------------------------------------------
+# Jacobi matrices A at all grid points, shape (..., lmax, lmax, n)
+def aa_vec(u):
+    if model == 'lwr':
+        return vel_vec(u[..., 0, :])[..., np.newaxis, np.newaxis, :]
+    a = np.empty(u.shape[:-2] + (2, 2, u.shape[-1]), dtype=u.dtype)
+    if model == 'pw':
+        v = u[..., 1, :] / u[..., 0, :]
+        a[..., 0, 0, :] = 0
+        a[..., 0, 1, :] = 1
+        a[..., 1, 0, :] = c0 ** 2 - v ** 2
+        a[..., 1, 1, :] = 2 * v
+    elif model == 'zhang':
+        rho = u[..., 0, :]
+        m = u[..., 1, :]
+        a[..., 0, 0, :] = rho * dvel_vec(rho) + vel_vec(rho)
+        a[..., 0, 1, :] = 1
+        a[..., 1, 0, :] = -m ** 2 / rho ** 2 + m * dvel_vec(rho)
+        a[..., 1, 1, :] = 2 * m / rho + vel_vec(rho)
+    return a
+
+
+# -----------------------------------------------------------------------------
+# modal matrices T at all grid points, shape (..., 2, 2, n)
+def tt_vec(u):
+    t = np.ones(u.shape[:-2] + (2, 2, u.shape[-1]), dtype=u.dtype)
+    if model == 'pw':
+        v = u[..., 1, :] / u[..., 0, :]
+        t[..., 1, 0, :] = v + c0
+        t[..., 1, 1, :] = v - c0
+    elif model == 'zhang':
+        rho = u[..., 0, :]
+        v = u[..., 1, :] / rho + vel_vec(rho)
+        t[..., 1, 0, :] = v - vel_vec(rho) - rho * dvel_vec(rho)
+        t[..., 1, 1, :] = v - vel_vec(rho)
+    return t
+
+
+# -----------------------------------------------------------------------------
+# Roe-averaging at all interfaces between u1 and u2
+def roe_avg_vec(u1, u2):
+    rho1 = np.maximum(u1[..., 0, :], 1e-3)
+    rho2 = np.maximum(u2[..., 0, :], 1e-3)
+    R = np.sqrt(rho2 / rho1)
+    avgrho = R * rho1
+    avgu = np.empty(u1.shape, dtype=u1.dtype)
+    avgu[..., 0, :] = avgrho
+    if model == 'pw':
+        v1 = np.minimum(u1[..., 1, :] / u1[..., 0, :], 10.)
+        v2 = np.minimum(u2[..., 1, :] / u2[..., 0, :], 10.)
+        avgv = (R * v2 + v1) / (R + 1)
+        avgu[..., 1, :] = avgrho * avgv
+        avglam = np.stack([avgv + c0, avgv - c0], axis=-2)
+    elif model == 'zhang':
+        v1 = u1[..., 1, :] / rho1 + vel_vec(rho1)
+        v2 = u2[..., 1, :] / rho2 + vel_vec(rho2)
+        avgv = (R * v2 + v1) / (R + 1)
+        avgu[..., 1, :] = avgrho * (avgv - vel_vec(avgrho))
+        avglam = np.stack([avgv, avgv + avgrho * dvel_vec(avgrho)], axis=-2)
+    avgt = tt_vec(avgu)
+    avgsig = np.sign(avglam)
+    # inverse of T = [[1, 1], [t10, t11]] in closed form
+    (t10, t11) = (avgt[..., 1, 0, :], avgt[..., 1, 1, :])
+    det = t11 - t10
+    d = u2 - u1
+    delta = np.stack([(t11 * d[..., 0, :] - d[..., 1, :]) / det,
+                      (-t10 * d[..., 0, :] + d[..., 1, :]) / det], axis=-2)
+    return (delta, avglam, avgt, avgsig)
+
+
+# -----------------------------------------------------------------------------
+# T w for the modal matrices T = [[1, 1], [t10, t11]] of roe_avg_vec
+def modes(avgt, w):
+    return np.stack([w[..., 0, :] + w[..., 1, :],
+                     avgt[..., 1, 0, :] * w[..., 0, :] + avgt[..., 1, 1, :] * w[..., 1, :]], axis=-2)
+
+
+# -----------------------------------------------------------------------------
+# largest characteristic speed at all grid points; lam_vec of lwr is the
+# vehicle speed, not the slope of the flux
+def speed_vec(u):
+    if model == 'lwr':
+        rho = u[..., 0, :]
+        return abs(vel_vec(rho) + rho * dvel_vec(rho))
+    return lam_vec(u)
+
+
+# -----------------------------------------------------------------------------
+# fifth-order WENO value at the right face of cell v2 from cells v0..v4
+# (Jiang & Shu smoothness indicators)
+def weno5(v0, v1, v2, v3, v4):
+    eps = 1e-6
+    q0 = (2 * v0 - 7 * v1 + 11 * v2) / 6
+    q1 = (-v1 + 5 * v2 + 2 * v3) / 6
+    q2 = (2 * v2 + 5 * v3 - v4) / 6
+    b0 = 13. / 12 * (v0 - 2 * v1 + v2) ** 2 + .25 * (v0 - 4 * v1 + 3 * v2) ** 2
+    b1 = 13. / 12 * (v1 - 2 * v2 + v3) ** 2 + .25 * (v1 - v3) ** 2
+    b2 = 13. / 12 * (v2 - 2 * v3 + v4) ** 2 + .25 * (3 * v2 - 4 * v3 + v4) ** 2
+    a0 = .1 / (eps + b0) ** 2
+    a1 = .6 / (eps + b1) ** 2
+    a2 = .3 / (eps + b2) ** 2
+    return (a0 * q0 + a1 * q1 + a2 * q2) / (a0 + a1 + a2)
+
+
+# -----------------------------------------------------------------------------
+# states left and right of all interfaces, reconstructed from the cells
+# around them by MUSCL (minmod or monotonized central slopes) or WENO5; the
+# ends of the arms are extended by copies of their end cells
+def reconstruct(u):
+    n = u.shape[-1]
+    if method == 'weno5':
+        v = np.pad(u, [(0, 0)] * (u.ndim - 1) + [(2, 2)], mode='edge')
+        # c[j] holds cell i - 2 + j of every interface i
+        c = [v[..., j:j + n - 1] for j in range(0, 6)]
+        return (weno5(c[0], c[1], c[2], c[3], c[4]), weno5(c[5], c[4], c[3], c[2], c[1]))
+    v = np.pad(u, [(0, 0)] * (u.ndim - 1) + [(1, 1)], mode='edge')
+    dm = v[..., 1:-1] - v[..., :-2]
+    dp = v[..., 2:] - v[..., 1:-1]
+    if method == 'muscl-minmod':
+        s = np.minimum(abs(dm), abs(dp))
+    elif method == 'muscl-mc':
+        s = np.minimum(np.minimum(2 * abs(dm), 2 * abs(dp)), .5 * abs(dm + dp))
+    s = np.where(dm * dp > 0, np.sign(dm) * s, 0.)
+    return (u[..., :-1] + .5 * s[..., :-1], u[..., 1:] - .5 * s[..., 1:])
+
+
+# -----------------------------------------------------------------------------
+# flux vector at all interfaces at once; lam0 has the batch shape u.shape[:-2]
+def flux_vec(u, stage=0, lam0=None):
+    ul = u[..., :-1]
+    ur = u[..., 1:]
+    # Lax method
+    if method == 'lax':
+        ev = ee_vec(u)
+        e = .5 * (ev[..., :-1] + ev[..., 1:]) - .5 * dx / dt * (ur - ul)
+    # Lax-Wendroff method
+    elif method == 'lax-wendroff':
+        ev = ee_vec(u)
+        ai = aa_vec(u)
+        a = .5 * (ai[..., :-1] + ai[..., 1:])
+        de = ev[..., 1:] - ev[..., :-1]
+        e = .5 * (ev[..., :-1] + ev[..., 1:]) - \
+            .5 * dt / dx * np.einsum('...ijn,...jn->...in', a, de)
+    # MacCormack method
+    elif method == 'maccormack':
+        ev = ee_vec(u)
+        if stage == 0:
+            e = ev[..., 1:]
+        elif stage == 1:
+            e = ev[..., :-1]
+    # Jameson 4-stage Runga-Kutta / Beam & Warming method
+    elif method == 'rk4' or method == 'beam-warming':
+        ev = ee_vec(u)
+        e = .5 * (ev[..., :-1] + ev[..., 1:])
+    # Steger & Warming flux vetcor splitting
+    elif method == 'steger-warming':
+        if model == 'pw':
+            v = u[..., 1, :] / u[..., 0, :]
+            lam1 = v + c0
+            lam2 = v - c0
+        elif model == 'zhang':
+            rho = u[..., 0, :]
+            v = u[..., 1, :] / rho + vel_vec(rho)
+            lam1 = v
+            lam2 = v + rho * dvel_vec(rho)
+        # E+ = T Lam+ T^-1 u from the left cell, E- = T Lam- T^-1 u from the
+        # right one, with the characteristic variables w = T^-1 u of every
+        # cell in closed form
+        t = tt_vec(u)
+        (t10, t11) = (t[..., 1, 0, :], t[..., 1, 1, :])
+        det = t11 - t10
+        w1 = (t11 * u[..., 0, :] - u[..., 1, :]) / det
+        w2 = (-t10 * u[..., 0, :] + u[..., 1, :]) / det
+        g1p = np.maximum(lam1[..., :-1], 0) * w1[..., :-1]
+        g2p = np.maximum(lam2[..., :-1], 0) * w2[..., :-1]
+        g1m = np.minimum(lam1[..., 1:], 0) * w1[..., 1:]
+        g2m = np.minimum(lam2[..., 1:], 0) * w2[..., 1:]
+        e = np.stack([(g1p + g2p) + (g1m + g2m),
+                      (t10[..., :-1] * g1p + t11[..., :-1] * g2p) +
+                      (t10[..., 1:] * g1m + t11[..., 1:] * g2m)], axis=-2)
+    # Roe's approximate Riemann solver
+    elif method == 'roe':
+        ev = ee_vec(u)
+        (delta, avglam, avgt, avgsig) = roe_avg_vec(ul, ur)
+        e = .5 * (ev[..., :-1] + ev[..., 1:]) - .5 * modes(avgt, delta * abs(avglam))
+    # TVD method
+    elif method[:3] == 'tvd':
+        ev = ee_vec(u)
+        e = .5 * (ev[..., :-1] + ev[..., 1:])
+        # one Roe average per interface; the limiter of interface i takes the
+        # jumps of its neighbours i - 1 and i + 1 by slicing
+        (delta, avglam, avgt, avgsig) = roe_avg_vec(ul, ur)
+        (delta1, delta2) = (delta[..., :-2], delta[..., 2:])
+        (delta, avglam, avgt, avgsig) = (delta[..., 1:-1], avglam[..., 1:-1],
+                                         avgt[..., 1:-1], avgsig[..., 1:-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(avgsig > 0, delta1 / delta, delta2 / delta)
+        r = np.where(delta == 0, 1e2, r)
+        # Roe superbee limiter
+        if method == 'tvd-superbee':
+            phi = np.maximum(0, np.maximum(np.minimum(1, 2 * r), np.minimum(r, 2)))
+        elif method == 'tvd-vanleer':
+            phi = (r + abs(r)) / (1 + abs(r))
+        w = .5 * (avgsig + phi * (avglam * dt / dx - avgsig)) * delta * abs(avglam)
+        e[..., 1:-1] -= modes(avgt, w)
+    # MUSCL / WENO5 reconstruction with the local Lax-Friedrichs flux
+    elif get_stages(method) is not None:
+        (ul, ur) = reconstruct(u)
+        a = np.maximum(speed_vec(ul), speed_vec(ur))[..., np.newaxis, :]
+        e = .5 * (ee_vec(ul) + ee_vec(ur)) - .5 * a * (ur - ul)
+
+    # artificial viscosity
+    if (avmodel): e = av_vec(u, e, lam0)
+    return e
+
+
+# -----------------------------------------------------------------------------
+# source vector at all grid points
+def source_vec(u):
+    s = np.zeros(u.shape, dtype=u.dtype)
+    tau = 1.
+    rho = u[..., 0, :]
+    v = u[..., 1, :] / u[..., 0, :]
+    s[..., 1, :] = rho * (vel_vec(rho) - v) / tau
+    return s
+
+
+# -----------------------------------------------------------------------------
+# residual at all grid points
+def residual_vec(u, e):
+    res = np.zeros(u.shape, dtype=u.dtype)
+    res[..., 1:-1] = -(e[..., 1:] - e[..., :-1]) / dx
+    if model == 'pw': res += source_vec(u)
+    return res
+
+
+# -----------------------------------------------------------------------------
+# artificial viscosity at all interfaces
+def av_vec(u, e, lam0=None):
+    # Von-Neumann & Ritchmyer
+    if lam0 is None: lam0 = maxlam(u)
+    lam0 = np.asarray(lam0)[..., np.newaxis, np.newaxis]
+    u0 = .5
+    du = u[..., 2:-1] - u[..., 1:-2]
+    d3u = u[..., 3:] - 3 * u[..., 2:-1] + 3 * u[..., 1:-2] - u[..., :-3]
+    eps2 = kappa2 * abs(du) / u0
+    eps4 = kappa4
+    e[..., 1:-1] -= (eps2 * du - eps4 * d3u) * lam0
+    return e
+
+
 # -----------------------------------------------------------------------------
 # determine the order of given method
 def get_order(method):
@@ -302,10 +631,136 @@ def get_order(method):
              'steger-warming': 1,
              'roe': 1,
              'tvd-superbee': 2,
-             'tvd-vanleer': 2}
+             'tvd-vanleer': 2,
+             'muscl-minmod': 2,
+             'muscl-mc': 2,
+             'weno5': 5}
     return order[method]
 
 
+# -----------------------------------------------------------------------------
+# stages (a, b) of the strong-stability-preserving Runge-Kutta scheme of a
+# reconstructing method, u = a * u_old + b * (u + dt * res) (see main.py);
+# None for the other methods
+def get_stages(method):
+    stages = {'muscl-minmod': [(0., 1.), (.5, .5)],
+              'muscl-mc': [(0., 1.), (.5, .5)],
+              'weno5': [(0., 1.), (.75, .25), (1. / 3, 2. / 3)]}
+    return stages.get(method)
+
+
+# -----------------------------------------------------------------------------
+# arms stopped at the junction in the red phase and in the green one
+groups = [[0, 1], [2, 3]]
+
+# streamed forcing (see forcing.py) as functions of the time: the upstream
+# densities of the arms (None for an arm keeps its upstream end) and the
+# signal state (above .5 for red on the arms of groups[0]); None keeps the
+# fixed red phase fr of the cycle tmax
+inflow = None
+signal = None
+
+
+# -----------------------------------------------------------------------------
+# signal at the junction of the arms and outflow boundaries
+def bc(time):
+    red = time < tmax * fr if signal is None else signal(time) > .5
+    if red:
+        color = 'r'
+        if model == 'lwr': junction(groups[0], groups[1])
+    else:
+        color = 'g'
+        if model == 'lwr': junction(groups[1], groups[0])
+    u[..., -1] = u[..., -2]
+    if inflow is not None:
+        for (ua, q) in zip(u, inflow):
+            if q is None: continue
+            ua[0, 0] = q(time)
+            if model == 'pw':
+                ua[1, 0] = ua[0, 0] * vel(ua[0, 0])
+            elif model == 'zhang':
+                ua[1, 0] = 0.
+    return color
+
+
+# -----------------------------------------------------------------------------
+# junction of the arms stop, held at jam density, and go, which share their
+# flux over all arms: the density irho whose Greenshield flux
+# irho (1 - k irho) is the flux of the go arms over the number of arms, the
+# smaller root of -k irho^2 + irho - q = 0 in closed form (the critical
+# density for a flux above capacity), goes to the junction cell of the go
+# arms and to the cell past it of the stop arms
+def junction(stop, go):
+    j = nx // 2
+    u[stop, 0, j] = 1.
+    rho = u[go, 0, j]
+    q = np.sum(rho * vel_vec(rho)) / len(u)
+    irho = (1 - np.sqrt(max(1 - 4 * k * q, 0.))) / (2 * k)
+    u[go, 0, j] = irho
+    u[stop, 0, j + 1] = irho
+
+
+# -----------------------------------------------------------------------------
+# largest density residual away from the cells set by the boundary conditions
+def resnorm(res):
+    r = abs(res[..., 0, 1:-1])
+    r[..., nx // 2 - 1:nx // 2 + 1] = 0.
+    return r.max()
+
+
+# -----------------------------------------------------------------------------
+# largest eigenvalue of every arm of the stacked (narms, lmax, nx) state and
+# one step of all of them: a single call of the whole-array kernels, or arm
+# by arm for the per-cell backends
+def maxlam_arms(u):
+    if backend == 'numpy': return maxlam(u)
+    return np.array([maxlam(ua) for ua in u])
+
+
+def solver_arms(u, lam):
+    global res
+    if backend == 'numpy': return solver(u, lam)
+    arms = []
+    for (ua, lama) in zip(u, lam):
+        arms.append((solver(ua, lama), res))
+    res = np.stack([r for (ua, r) in arms])
+    return np.stack([ua for (ua, r) in arms])
+
+
+# -----------------------------------------------------------------------------
+# time loop over the arms, kept in u; monitor(i, time, color) is called
+# after every step. The largest residual of the arms is kept in history, and
+# a steady run stops once it falls below eps; resume (see checkpoint.py)
+# continues a run after its step-th step from the given time and history,
+# with u already restored
+def run(monitor=None, resume=None):
+    global dt, u, maxres, history
+    time = 0
+    history = []
+    first = 0
+    if resume is not None:
+        (first, time) = (resume['step'], resume['time'])
+        history = list(resume['history'])
+    elif steady: bc(time)
+    for i in range(first, imax):
+        # step size of the fastest arm; the AV of every arm scales with its own
+        lam = maxlam_arms(u)
+        dt = step(u, lam.max())
+
+        u = solver_arms(u, lam)
+        maxres = resnorm(res)
+        history.append(maxres)
+
+        time += dt
+        color = bc(time)
+
+        # if (time > tmax): time = 0
+
+        if monitor is not None: monitor(i, time, color)
+        if steady and maxres < eps: break
+    return time
+
+
 if __name__ == '__main__':
 
     # -----------------------------------------------------------------------------
@@ -319,9 +774,11 @@ if __name__ == '__main__':
     cfl = 0.5
     imax = 1500
     eps = 1e-5
+    steady = False  # stop once the largest density residual drops below eps
     tmax = 50
     k = 0.9  # for Greenshield model
     c0 = 0.5  # for PW model
+    dtype = 'float64'  # or float32, see main.py
 
     # -----------------------------------------------------------------------------
     # traffic flow model
@@ -341,102 +798,66 @@ if __name__ == '__main__':
     # acceptable values:
     ## lax, lax-wendroff, maccormack, steger-warming
     ## rk4, roe, tvd-superbee, tvd-vanleer
+    ## muscl-minmod, muscl-mc, weno5 (reconstructions with SSP Runge-Kutta)
     method = 'lax-wendroff'
 
     avmodel = True
     kappa2 = .2
     kappa4 = 0.02
 
-    # turn off AV model for first-order schemes
+    # computational backend
+    # acceptable values:
+    ## numpy (whole-array kernels)
+    ## loop  (per-cell reference implementation)
+    ## numba (compiled per-cell kernels; numpy when numba is missing)
+    backend = 'numpy'
+
+    # turn off AV model for first-order schemes and the reconstructions
     order = get_order(method)
-    if (order == 1): avmodel = False
+    if (order == 1 or get_stages(method) is not None): avmodel = False
+
+    # -----------------------------------------------------------------------------
+    # output
+    # headless runs never load a GUI backend; every nsave-th step (or every
+    # dtsave of simulated time) of all four arms is written to a memory-mapped
+    # space-time array in out
+    headless = False
+    out = 'intersection.npy'
+    nsave = 10
+    dtsave = None
+    # capacity of the output file; the simulated end time is not known before
+    # the run (the steps grow as the road jams), but a dtsave snapshot is
+    # taken at most once per step. The file is created sparse, so capacity
+    # left unwritten takes no disk space on most file systems
+    nsnap = (imax // nsave + 1) if (dtsave is None) else (imax + 1)
 
     # grid points
     (x, dx) = set_mesh()
     # initial condition
     kmax = 2
-    u1 = ic()  # horizontal (rightward)
-    u2 = ic()  # horizontal (leftward)
-    u3 = ic()  # vertical (downward)
-    u4 = ic()  # vertical (upward)
-
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-
-    y1 = [-5, -1]
-    y2 = [1, 5]
-    X1, Y1 = np.meshgrid(x, y1)
-    X2, Y2 = np.meshgrid(x[::-1], y2)
-    X3, Y3 = np.meshgrid(x[::-1], y1)
-    X4, Y4 = np.meshgrid(x, y2)
-
-    time = 0
-    for i in range(0, imax):
-        # step size
-        dt = min(step(u1), step(u2), step(u3), step(u4))
-
-        u1 = solver(u1)
-        u2 = solver(u2)
-        u3 = solver(u3)
-        u4 = solver(u4)
+    # arms: horizontal (rightward, leftward), vertical (downward, upward)
+    u = np.stack([ic() for a in range(0, 4)])
+
+    if headless:
+        rec = snapshot.Snapshots(out, u.shape, nsnap, nsave, dtsave,
+                                 {'xmin': xmin, 'xmax': xmax, 'nx': nx, 'model': model,
+                                  'state': state, 'method': method, 'rho0': rho0,
+                                  'fr': fr, 'cfl': cfl, 'tmax': tmax})
+    else:
+        # live view of the arms at fps frames per second of wall time, the
+        # images created once (see liveview.py)
+        import liveview
+        view = liveview.crossing(x, lambda: u, fps=25.)
 
-        time += dt
-        if time < tmax * fr:
-            color = 'r'
-            if model == 'lwr':
-                u1[0, nx / 2] = 1.
-                u2[0, nx / 2] = 1.
-                # u3[0,nx/2] = rho0
-                # u4[0,nx/2] = rho0
-                rho3 = u3[0, nx / 2]
-                rho4 = u4[0, nx / 2]
-                irho = min(np.roots([-k, 1., -.25 * (rho3 * vel(rho3) + rho4 * vel(rho4))]))
-                u3[0, nx / 2] = irho
-                u4[0, nx / 2] = irho
-                u1[0, nx / 2 + 1] = irho
-                u2[0, nx / 2 + 1] = irho
+    # -----------------------------------------------------------------------------
+    # record the four arms after every step or show them
+    def draw(i, time, color):
+        if headless:
+            rec.write(u, i, time)
         else:
-            color = 'g'
-            if model == 'lwr':
-                # u1[0,nx/2] = rho0
-                # u2[0,nx/2] = rho0
-                u3[0, nx / 2] = 1.
-                u4[0, nx / 2] = 1.
-                rho1 = u1[0, nx / 2]
-                rho2 = u2[0, nx / 2]
-                irho = min(np.roots([-k, 1., -.25 * (rho1 * vel(rho1) + rho2 * vel(rho2))]))
-                u1[0, nx / 2] = irho
-                u2[0, nx / 2] = irho
-                u3[0, nx / 2 + 1] = irho
-                u4[0, nx / 2 + 1] = irho
-        u1[:, -1] = u1[:, -2]
-        u2[:, -1] = u2[:, -2]
-        u3[:, -1] = u3[:, -2]
-        u4[:, -1] = u4[:, -2]
+            view(i, time, color)
 
-        # if (time > tmax): time = 0
-        #
-        # if (i == 0):
-        #     line1, = ax.plot(x, u1[0,],'-o')
-        #     line1.set_color(color)
-        #     ax.set_ylim(0,1)
-        #     fig.show()
-        # else:
-        #     line1.set_ydata(u1[0,])
-        #     line1.set_color(color)
-        #     fig.canvas.draw()
-
-        if i == 0:
-            ax.contourf(X1, Y1, np.tile(u1[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.contourf(X2, Y2, np.tile(u2[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.contourf(Y3, X3, np.tile(u3[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.contourf(Y4, X4, np.tile(u4[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.set_xlim(-100, 100)
-            ax.set_ylim(-100, 100)
-            fig.show()
-        else:
-            ax.contourf(X1, Y1, np.tile(u1[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.contourf(X2, Y2, np.tile(u2[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.contourf(Y3, X3, np.tile(u3[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            ax.contourf(Y4, X4, np.tile(u4[0,], (2, 1)), 10, vmin=0, vmax=1, cmap=plt.cm.RdBu)
-            fig.canvas.draw()
+    run(draw)
+
+    if headless: rec.close()
+    else: view.close()
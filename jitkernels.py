@@ -0,0 +1,400 @@
+import sys
+import time
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# compiled per-cell kernels for the 'numba' backend; machine code is cached
+# on disk next to this file so only the first run pays for compilation.
+# Without numba (or for batched states and per-member parameters) the
+# callers fall back to the whole-array numpy kernels.
+enabled = njit is not None
+
+MODELS = {'lwr': 0, 'pw': 1, 'zhang': 2}
+STATES = {'greenshield': 0, 'greenberg': 1, 'underwood': 2}
+METHODS = {'lax': 0, 'lax-wendroff': 1, 'maccormack': 2, 'rk4': 3,
+           'beam-warming': 4, 'steger-warming': 5, 'roe': 6,
+           'tvd-superbee': 7, 'tvd-vanleer': 8}
+
+
+def jit(f):
+    return njit(cache=True)(f) if enabled else f
+
+
+# -----------------------------------------------------------------------------
+# model for velocity
+@jit
+def vel(rho, state, k):
+    if state == 0:
+        return 1 - k * rho
+    elif state == 1:
+        vmax = 10.
+        if rho < 1 / np.exp(vmax):
+            return vmax
+        return min(vmax, np.log(1 / rho))
+    return np.exp(-rho)
+
+
+# derivative of the velocity
+@jit
+def dvel(rho, state, k):
+    if state == 0:
+        return -k
+    elif state == 1:
+        if rho < 1 / np.exp(10.):
+            return 0.
+        return -1 / rho
+    return -np.exp(-rho)
+
+
+# -----------------------------------------------------------------------------
+# flux vector at a single grid point
+@jit
+def ee(r, m, model, state, k, c0):
+    if model == 0:
+        return r * vel(r, state, k), 0.
+    elif model == 1:
+        v = m / r
+        return r * v, r * v ** 2 + c0 ** 2 * r
+    vr = vel(r, state, k)
+    return m + r * vr, m ** 2 / r + m * vr
+
+
+# -----------------------------------------------------------------------------
+# Jacobi matrix A at a single grid point
+@jit
+def aa(r, m, model, state, k, c0):
+    if model == 0:
+        return vel(r, state, k), 0., 0., 0.
+    elif model == 1:
+        v = m / r
+        return 0., 1., c0 ** 2 - v ** 2, 2 * v
+    vr = vel(r, state, k)
+    dv = dvel(r, state, k)
+    return r * dv + vr, 1., -m ** 2 / r ** 2 + m * dv, 2 * m / r + vr
+
+
+# -----------------------------------------------------------------------------
+# second row of the modal matrix T (the first row is [1, 1])
+@jit
+def tt(r, m, model, state, k, c0):
+    if model == 1:
+        v = m / r
+        return v + c0, v - c0
+    vr = vel(r, state, k)
+    v = m / r + vr
+    return v - vr - r * dvel(r, state, k), v - vr
+
+
+# -----------------------------------------------------------------------------
+# Roe-averaging of all interfaces; returns the characteristic jumps, the
+# eigenvalues and the second row of T, each (2, nx - 1)
+@jit
+def roe_avg(u, model, state, k, c0):
+    nx = u.shape[1]
+    delta = np.empty((2, nx - 1))
+    avglam = np.empty((2, nx - 1))
+    avgt = np.empty((2, nx - 1))
+    for i in range(0, nx - 1):
+        rho1 = max(u[0, i], 1e-3)
+        rho2 = max(u[0, i + 1], 1e-3)
+        R = np.sqrt(rho2 / rho1)
+        avgrho = R * rho1
+        if model == 1:
+            v1 = min(u[1, i] / u[0, i], 10.)
+            v2 = min(u[1, i + 1] / u[0, i + 1], 10.)
+            avgv = (R * v2 + v1) / (R + 1)
+            avgm = avgrho * avgv
+            lam1 = avgv + c0
+            lam2 = avgv - c0
+        else:
+            v1 = u[1, i] / rho1 + vel(rho1, state, k)
+            v2 = u[1, i + 1] / rho2 + vel(rho2, state, k)
+            avgv = (R * v2 + v1) / (R + 1)
+            avgm = avgrho * (avgv - vel(avgrho, state, k))
+            lam1 = avgv
+            lam2 = avgv + avgrho * dvel(avgrho, state, k)
+        (t10, t11) = tt(avgrho, avgm, model, state, k, c0)
+        # inverse of [[1, 1], [t10, t11]] in closed form
+        det = t11 - t10
+        d0 = u[0, i + 1] - u[0, i]
+        d1 = u[1, i + 1] - u[1, i]
+        delta[0, i] = (t11 * d0 - d1) / det
+        delta[1, i] = (-t10 * d0 + d1) / det
+        avglam[0, i] = lam1
+        avglam[1, i] = lam2
+        avgt[0, i] = t10
+        avgt[1, i] = t11
+    return delta, avglam, avgt
+
+
+# -----------------------------------------------------------------------------
+# compute maximum eigenvalue of Jacobi matrix
+@jit
+def maxlam(u, model, state, k, c0):
+    lam = 0.
+    for i in range(0, u.shape[1]):
+        if model == 0:
+            lam = max(lam, abs(vel(u[0, i], state, k)))
+        elif model == 1:
+            lam = max(lam, abs(u[1, i] / u[0, i]) + c0)
+        else:
+            vi = u[1, i] / u[0, i] + vel(u[0, i], state, k)
+            lam = max(lam, abs(vi), abs(vi + u[0, i] * dvel(u[0, i], state, k)))
+    return lam
+
+
+# -----------------------------------------------------------------------------
+# flux vector
+@jit
+def flux(u, stage, lam0, model, state, method, k, c0, dt, dx,
+         avmodel, kappa2, kappa4):
+    lmax = u.shape[0]
+    nx = u.shape[1]
+    e = np.zeros((lmax, nx - 1))
+    if method >= 6:
+        (delta, avglam, avgt) = roe_avg(u, model, state, k, c0)
+    else:
+        delta = np.zeros((2, 0))
+        avglam = np.zeros((2, 0))
+        avgt = np.zeros((2, 0))
+    for i in range(0, nx - 1):
+        r1 = u[0, i]
+        r2 = u[0, i + 1]
+        m1 = u[1, i] if lmax > 1 else 0.
+        m2 = u[1, i + 1] if lmax > 1 else 0.
+        (e10, e11) = ee(r1, m1, model, state, k, c0)
+        (e20, e21) = ee(r2, m2, model, state, k, c0)
+        f0 = .5 * (e10 + e20)
+        f1 = .5 * (e11 + e21)
+        # Lax method
+        if method == 0:
+            f0 -= .5 * dx / dt * (r2 - r1)
+            f1 -= .5 * dx / dt * (m2 - m1)
+        # Lax-Wendroff method
+        elif method == 1:
+            (a00, a01, a10, a11) = aa(r1, m1, model, state, k, c0)
+            (b00, b01, b10, b11) = aa(r2, m2, model, state, k, c0)
+            f0 -= .5 * dt / dx * (.5 * (a00 + b00) * (e20 - e10) + .5 * (a01 + b01) * (e21 - e11))
+            f1 -= .5 * dt / dx * (.5 * (a10 + b10) * (e20 - e10) + .5 * (a11 + b11) * (e21 - e11))
+        # MacCormack method
+        elif method == 2:
+            if stage == 0:
+                f0 = e20
+                f1 = e21
+            else:
+                f0 = e10
+                f1 = e11
+        # Steger & Warming flux vetcor splitting
+        elif method == 5:
+            if model == 1:
+                v1 = m1 / r1
+                v2 = m2 / r2
+                l1p = max(v1 + c0, 0.)
+                l2p = max(v1 - c0, 0.)
+                l1m = min(v2 + c0, 0.)
+                l2m = min(v2 - c0, 0.)
+            else:
+                v1 = m1 / r1 + vel(r1, state, k)
+                v2 = m2 / r2 + vel(r2, state, k)
+                l1p = max(v1, 0.)
+                l2p = max(v1 + r1 * dvel(r1, state, k), 0.)
+                l1m = min(v2, 0.)
+                l2m = min(v2 + r2 * dvel(r2, state, k), 0.)
+            (s10, s11) = tt(r1, m1, model, state, k, c0)
+            (q10, q11) = tt(r2, m2, model, state, k, c0)
+            # E+ = T Lam+ T^-1 u of the left cell, E- = T Lam- T^-1 u of the
+            # right one
+            g1p = l1p * ((s11 * r1 - m1) / (s11 - s10))
+            g2p = l2p * ((-s10 * r1 + m1) / (s11 - s10))
+            g1m = l1m * ((q11 * r2 - m2) / (q11 - q10))
+            g2m = l2m * ((-q10 * r2 + m2) / (q11 - q10))
+            f0 = (g1p + g2p) + (g1m + g2m)
+            f1 = (s10 * g1p + s11 * g2p) + (q10 * g1m + q11 * g2m)
+        # Roe's approximate Riemann solver
+        elif method == 6:
+            w0 = .5 * delta[0, i] * abs(avglam[0, i])
+            w1 = .5 * delta[1, i] * abs(avglam[1, i])
+            f0 -= w0 + w1
+            f1 -= w0 * avgt[0, i] + w1 * avgt[1, i]
+        # TVD method
+        elif method >= 7 and 0 < i < nx - 2:
+            for l in range(0, 2):
+                lam = avglam[l, i]
+                sig = np.sign(lam)
+                d = delta[l, i]
+                if d == 0:
+                    r = 1e2
+                elif sig > 0:
+                    r = delta[l, i - 1] / d
+                else:
+                    r = delta[l, i + 1] / d
+                # Roe superbee limiter
+                if method == 7:
+                    phi = max(0., min(1., 2 * r), min(r, 2.))
+                else:
+                    phi = (r + abs(r)) / (1 + abs(r))
+                w = .5 * (sig + phi * (lam * dt / dx - sig)) * d * abs(lam)
+                f0 -= w
+                f1 -= w * avgt[l, i]
+        e[0, i] = f0
+        if lmax > 1: e[1, i] = f1
+
+    # artificial viscosity
+    if avmodel:
+        av(u, e, lam0, kappa2, kappa4)
+    return e
+
+
+# -----------------------------------------------------------------------------
+# source vector
+@jit
+def source(u, state, k):
+    s = np.zeros(u.shape)
+    tau = 1.
+    for i in range(0, u.shape[1]):
+        rhoi = u[0, i]
+        vi = u[1, i] / u[0, i]
+        s[1, i] = rhoi * (vel(rhoi, state, k) - vi) / tau
+    return s
+
+
+# -----------------------------------------------------------------------------
+# residual
+@jit
+def residual(u, e, model, state, k, dx):
+    res = np.zeros(u.shape)
+    for i in range(1, u.shape[1] - 1):
+        for l in range(0, u.shape[0]):
+            res[l, i] = -(e[l, i] - e[l, i - 1]) / dx
+    if model == 1: res += source(u, state, k)
+    return res
+
+
+# -----------------------------------------------------------------------------
+# artificial viscosity (in place)
+@jit
+def av(u, e, lam0, kappa2, kappa4):
+    # Von-Neumann & Ritchmyer
+    u0 = .5
+    for i in range(1, u.shape[1] - 2):
+        for l in range(0, u.shape[0]):
+            du = u[l, i + 1] - u[l, i]
+            d3u = u[l, i + 2] - 3 * u[l, i + 1] + 3 * u[l, i] - u[l, i - 1]
+            eps2 = kappa2 * abs(du) / u0
+            eps4 = kappa4
+            e[l, i] -= (eps2 * du - eps4 * d3u) * lam0
+    return e
+
+
+# -----------------------------------------------------------------------------
+# compiled kernels take a single float64 (lmax, nx) state, one of the
+# built-in fundamental diagrams and scalar parameters only
+def usable(u, state, *params):
+    return enabled and u.ndim == 2 and u.dtype == np.float64 and \
+           isinstance(state, str) and state in STATES and \
+           all(np.ndim(p) == 0 for p in params)
+
+
+if __name__ == '__main__':
+
+    # regression check of the compiled and whole-array kernels against the
+    # per-cell loops, with their speedup: for every ported scheme, model and
+    # built-in diagram one flux + residual evaluation of main.py, of
+    # intersection.py (no beam-warming) and of simulation.Simulation (array
+    # kernels only). Every residual must be within tol of the loop residual
+    # of its module (of main.py for Simulation), relative to the largest of
+    # them, else the check fails with exit status 1. The compiled kernels are
+    # skipped where usable() is false: python jitkernels.py [nx]
+    import intersection
+    import main
+    import simulation
+    import sweep
+
+    tol = 1e-10
+    nx = int(float(sys.argv[1])) if (len(sys.argv) > 1) else 2001
+    nrep = 20
+    param = {'nx': nx, 'xmin': 0., 'xmax': 200., 'dt': .1, 'k': .9, 'c0': .5,
+             'kappa2': .2, 'kappa4': .02, 'smooth': 0.}
+    for base in (main, intersection):
+        for (name, value) in param.items():
+            setattr(base, name, value)
+        base.dx = (base.xmax - base.xmin) / (nx - 1.)
+    compiled = usable(np.zeros((1, nx)), 'greenshield', .9)
+    backends = ('loop', 'numpy', 'numba') if compiled else ('loop', 'numpy')
+    if (not compiled): print('numba is not usable here: the compiled kernels are skipped')
+
+    # residual of a module for state u on a backend, and its mean wall time
+    # over n evaluations
+    def evaluate(base, u, backend, n):
+        base.backend = backend
+        if (base is main):
+            (main.u, main.lam0) = (u, main.maxlam(u))
+            call = lambda: main.residual(main.flux())
+        else:
+            call = lambda: base.residual(u, base.flux(u))
+        res = call()
+        t0 = time.perf_counter()
+        for rep in range(0, n):
+            call()
+        return (res, (time.perf_counter() - t0) / n * 1e3)
+
+    def deviation(res, ref):
+        return float(abs(res - ref).max() / max(abs(ref).max(), 1e-300))
+
+    print('%-6s %-12s %-15s %10s %10s %10s %8s %10s %10s' %
+          ('model', 'state', 'method', 'loop [ms]', 'numpy', 'numba', 'x loop',
+           'dev numpy', 'dev numba'))
+    failed = []
+    for model in ('lwr', 'pw', 'zhang'):
+        lmax = 1 if (model == 'lwr') else 2
+        u = np.ones((lmax, nx))
+        u[0, :] = .3 + .2 * np.sin(np.linspace(0, 8 * np.pi, nx))
+        if (model == 'pw'): u[1, :] = u[0, :] * .6
+        if (model == 'zhang'): u[1, :] = .05
+        for state in STATES:
+            for method in METHODS:
+                if (model == 'lwr' and (method == 'steger-warming' or method == 'roe'
+                                        or method[:3] == 'tvd')): continue
+                devs = dict((backend, 0.) for backend in backends[1:])
+                for base in (main, intersection):
+                    if (base is intersection and method == 'beam-warming'): continue
+                    (base.model, base.lmax, base.state, base.method) = (model, lmax, state, method)
+                    base.avmodel = sweep.needs_av(method)
+                    wall = []
+                    for backend in backends:
+                        (res, ms) = evaluate(base, u, backend, 1 if (backend == 'loop') else nrep)
+                        wall.append(ms)
+                        if (backend == 'loop'):
+                            ref = res
+                            if (base is main): mainref = res
+                            continue
+                        dev = deviation(res, ref)
+                        devs[backend] = max(devs[backend], dev)
+                        if (dev > tol): failed.append('%s %s %s %s %s: %.2e'
+                                                      % (base.__name__, backend, model, state,
+                                                         method, dev))
+                    if (base is main): times = wall
+                sim = simulation.Simulation(dict(sweep.defaults, model=model, state=state,
+                                                 method=method, **param))
+                (sim.u[...], sim.lam0, sim.dt) = (u, main.maxlam(u), param['dt'])
+                sim.flux(0)
+                sim.residual()
+                dev = deviation(sim.res, mainref)
+                devs['numpy'] = max(devs['numpy'], dev)
+                if (dev > tol): failed.append('simulation numpy %s %s %s: %.2e'
+                                              % (model, state, method, dev))
+                print('%-6s %-12s %-15s %10.3f %10.3f %10s %8.1f %10.2e %10s' %
+                      (model, state, method, times[0], times[1],
+                       '%.3f' % times[2] if compiled else '-', times[0] / times[-1],
+                       devs['numpy'], '%.2e' % devs['numba'] if compiled else '-'))
+    if failed:
+        print('%d kernels deviate from the per-cell loops by more than %g:' % (len(failed), tol))
+        for f in failed:
+            print('  ' + f)
+        sys.exit(1)
+    print('all kernels within %g of the per-cell loops' % tol)
@@ -0,0 +1,173 @@
+import sys
+import time
+
+import numpy as np
+
+
+# -----------------------------------------------------------------------------
+# live view of a run, passed to run() as its monitor. The artists are
+# created once and changed in place by update(i, time, color) (set_data,
+# set_ydata, ...); they are animated, so a frame restores the background
+# saved at the last full draw (after a resize, say), draws only them and
+# blits the figure, or asks for a full redraw where the canvas cannot blit.
+# Frames follow the wall clock, not the steps: a step before the next frame
+# is due returns at once, and the next frame is due 1 / fps after the last
+# one, or later if blitting would otherwise take more than a share load of
+# the wall time. The solver thus runs at nearly full speed however slow the
+# drawing is; the steps between frames are skipped
+class LiveView(object):
+
+    def __init__(self, fig, artists, update, fps=25., load=.1):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.artists = list(artists)
+        self.update = update
+        (self.fps, self.load) = (fps, load)
+        self.blit = getattr(self.canvas, 'supports_blit', False)
+        self.background = None
+        self.frames = 0
+        self.skipped = 0
+        self.last = None  # arguments of the last call
+        self.drawn = True  # the last call was drawn
+        self.tnext = 0.
+        for a in self.artists:
+            a.set_animated(True)
+        self.cid = self.canvas.mpl_connect('draw_event', self.grab)
+
+    def __call__(self, i, time_, color):
+        self.last = (i, time_, color)
+        now = time.perf_counter()
+        if (now < self.tnext):
+            self.skipped += 1
+            self.drawn = False
+            return
+        self.frame(i, time_, color)
+        # the first frame draws the whole figure and is not counted
+        cost = (time.perf_counter() - now) if (self.frames > 1) else 0.
+        self.tnext = now + max(1. / self.fps, cost / self.load)
+
+    # draw one frame of the current state; the first one shows the figure
+    def frame(self, i, time_, color):
+        self.update(i, time_, color)
+        if (self.frames == 0):
+            self.fig.show()
+            self.canvas.draw()
+        elif (self.blit and self.background is not None):
+            self.canvas.restore_region(self.background)
+            self.paint()
+            self.canvas.blit(self.fig.bbox)
+        else:
+            self.canvas.draw_idle()
+        self.canvas.flush_events()
+        self.frames += 1
+        self.drawn = True
+
+    # background without the animated artists, saved at every full draw
+    def grab(self, event):
+        if self.blit: self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.paint()
+
+    def paint(self):
+        for a in self.artists:
+            self.fig.draw_artist(a)
+
+    # draw the last state if its step was skipped
+    def close(self):
+        if (self.last is not None and not self.drawn): self.frame(*self.last)
+        self.canvas.mpl_disconnect(self.cid)
+
+
+# -----------------------------------------------------------------------------
+# density along the corridor of main.py at grid points x, read from state()
+# at every frame, in the signal color
+def corridor(x, state, fps=25., load=.1):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    (line,) = ax.plot(x, state()[0], '-o')
+    ax.set_ylim(0, 1)
+    label = ax.text(.02, .95, '', transform=ax.transAxes)
+
+    def update(i, time_, color):
+        line.set_ydata(state()[0])
+        line.set_color(color)
+        label.set_text('step %d, t = %.2f' % (i + 1, time_))
+
+    return LiveView(fig, [line, label], update, fps, load)
+
+
+# -----------------------------------------------------------------------------
+# densities of the four arms of intersection.py (rightward, leftward,
+# downward, upward) at grid points x, read from state() as the stacked
+# (narms, lmax, nx) array at every frame; every arm is an image one cell
+# wide whose data is the density row itself, reversed by its extent
+def crossing(x, state, fps=25., load=.1):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    (lo, hi) = (x[0], x[-1])
+    u = state()
+    style = {'vmin': 0, 'vmax': 1, 'cmap': plt.cm.RdBu, 'interpolation': 'nearest',
+             'aspect': 'auto'}
+    images = [ax.imshow(u[0, 0][np.newaxis], extent=(lo, hi, -5, -1), **style),
+              ax.imshow(u[1, 0][np.newaxis], extent=(hi, lo, 1, 5), **style),
+              ax.imshow(u[2, 0][:, np.newaxis], extent=(-5, -1, lo, hi), **style),
+              ax.imshow(u[3, 0][:, np.newaxis], extent=(1, 5, hi, lo), **style)]
+    ax.set_xlim(lo, hi)
+    ax.set_ylim(lo, hi)
+    label = ax.text(.02, .95, '', transform=ax.transAxes)
+
+    def update(i, time_, color):
+        u = state()
+        images[0].set_data(u[0, 0][np.newaxis])
+        images[1].set_data(u[1, 0][np.newaxis])
+        images[2].set_data(u[2, 0][:, np.newaxis])
+        images[3].set_data(u[3, 0][:, np.newaxis])
+        label.set_text('step %d, t = %.2f, %s' % (i + 1, time_,
+                                                  'red' if (color == 'r') else 'green'))
+
+    return LiveView(fig, images + [label], update, fps, load)
+
+
+if __name__ == '__main__':
+
+    # wall time of the corridor of main.py without a view, redrawing the
+    # whole figure after every step (as main.py did) and with a live view:
+    # python liveview.py [imax] [nx] [fps]
+    import matplotlib.pyplot as plt
+
+    import main
+    import sweep
+
+    imax = int(sys.argv[1]) if (len(sys.argv) > 1) else 300
+    nx = int(float(sys.argv[2])) if (len(sys.argv) > 2) else 151
+    fps = float(sys.argv[3]) if (len(sys.argv) > 3) else 25.
+    config = {'imax': imax, 'nx': nx, 'method': 'tvd-superbee', 'model': 'zhang'}
+
+    def every(i, tsim, color):
+        line.set_ydata(main.u[0])
+        line.set_color(color)
+        fig.canvas.draw()
+        fig.canvas.flush_events()
+
+    for kind in ('none', 'every step', 'live view'):
+        sweep.setup(config)
+        monitor = None
+        if (kind == 'every step'):
+            fig = plt.figure()
+            (line,) = fig.add_subplot(111).plot(main.x, main.u[0], '-o')
+            fig.show()
+            monitor = every
+        elif (kind == 'live view'):
+            monitor = corridor(main.x, lambda: main.u, fps)
+        t0 = time.perf_counter()
+        with np.errstate(all='ignore'):
+            main.run(monitor)
+        if (kind == 'live view'): monitor.close()
+        wall = time.perf_counter() - t0
+        print('%-10s %8.3f s%s' % (kind, wall, '' if (kind != 'live view') else
+                                   ', %d frames, %d steps skipped'
+                                   % (monitor.frames, monitor.skipped)))
+        plt.close('all')
@@ -1,5 +1,10 @@
+import sys
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+import diagram
+import jitkernels
+import snapshot
 
 
 # -----------------------------------------------------------------------------
@@ -13,7 +18,7 @@ def set_mesh():
 # -----------------------------------------------------------------------------
 # define initial condition
 def ic():
-    u = np.ones((lmax, nx))
+    u = np.ones((lmax, nx), dtype=dtype)
     if (model == 'lwr'):
         u[0, :] *= rho0
     elif (model == 'pw'):
@@ -26,64 +31,91 @@ def ic():
 
 
 # -----------------------------------------------------------------------------
-# compute step size
+# compute step size; with local pseudo-time stepping every cell also gets its
+# own step tau from the characteristic speeds around it (at most 100 global
+# steps; see sweep.check_steady for the schemes it converges)
 def step():
-    dt = cfl * dx / maxlam(u)
+    global lam0, tau
+    lam0 = maxlam(u)
+    dt = cfl * dx / float(lam0)
+    tau = dt
+    if ltime:
+        lam = speed_vec(u)
+        lam[1:-1] = np.maximum(np.maximum(lam[:-2], lam[1:-1]), lam[2:])
+        tau = cfl * dx / np.maximum(lam, .01 * lam0)
     return dt
 
 
 # -----------------------------------------------------------------------------
 # solver
 def solver():
-    global u, res
+    global u, res, lam0
     if (method == 'maccormack'):
         for stage in range(0, 2):
+            if (stage > 0): lam0 = maxlam(u)
             e = flux(stage)
             res = residual(e)
             if (stage == 0):
                 u_old = np.copy(u)
-                u += dt * res
+                u += tau * res
             elif (stage == 1):
-                u = .5 * (u + u_old + dt * res)
+                u = .5 * (u + u_old + tau * res)
     elif (method == 'rk4'):
         alpha = [1. / 4, 1. / 3, 1. / 2, 1.]
         u_old = np.copy(u)
         for stage in range(0, 4):
+            if (stage > 0): lam0 = maxlam(u)
+            e = flux()
+            res = residual(e)
+            u = u_old + alpha[stage] * tau * res
+    elif (get_stages(method) is not None):
+        # strong-stability-preserving Runge-Kutta in Shu-Osher form
+        u_old = np.copy(u)
+        for (stage, (a, b)) in enumerate(get_stages(method)):
+            if (stage > 0): lam0 = maxlam(u)
             e = flux()
             res = residual(e)
-            u = u_old + alpha[stage] * dt * res
+            u = a * u_old + b * (u + tau * res)
+    elif (method == 'beam-warming' and backend != 'loop'):
+        e = flux()
+        res = residual(e)
+        u += bw_vec(u, res)
     elif (method == 'beam-warming'):
         e = flux()
         res = residual(e)
-        # Thomas algorithm
-        ci = np.zeros(nx - 1)
-        ci[0] = .25 * dt / dx * aa(u[:, 1])
-        for i in range(1, nx - 2):
-            ci[i] = (.25 * dt / dx * aa(u[:, i + 1])) / (1 - \
-                                                         (-.25 * dt / dx * aa(u[:, i - 1]) * ci[i - 1]))
-        di = np.zeros(nx)
-        di[0] = dt * res[:, 0]
-        for i in range(1, nx - 1):
-            di[i] = (dt * res[:, i] - \
-                     (-.25 * dt / dx * aa(u[:, i - 1])) * di[i - 1]) / (1 - \
-                                                                        (-.25 * dt / dx * aa(u[:, i - 1])) * ci[i - 1])
-        di[-1] = (- .25 * dt / dx * aa(u[:, -2]) * di[-2]) / \
-                 (1 - .25 * dt / dx * aa(u[:, -1]) * ci[-1])
-        du = np.zeros(nx)
-        du[-1] = di[-1]
+        # block Thomas algorithm on the system of bw_vec
+        eps = 1.
+        c = eps * dt / dx * float(lam0) * np.eye(lmax)
+        a = [.25 * dt / dx * np.reshape(aa(u[:, i]), (lmax, lmax)) for i in range(0, nx)]
+        cp = np.zeros((nx, lmax, lmax))
+        dp = np.zeros((nx, lmax))
+        for i in range(0, nx):
+            di = np.eye(lmax) + 2 * c
+            bi = dt * res[:, i]
+            if (i > 0):
+                lo = -a[i - 1] - c
+                di = di - lo @ cp[i - 1]
+                bi = bi - lo @ dp[i - 1]
+            if (i < nx - 1): cp[i] = np.linalg.solve(di, a[i + 1] - c)
+            dp[i] = np.linalg.solve(di, bi)
+        du = np.zeros((lmax, nx))
+        du[:, -1] = dp[-1]
         for i in range(nx - 2, -1, -1):
-            du[i] += di[i] - ci[i] * du[i + 1]
+            du[:, i] = dp[i] - cp[i] @ du[:, i + 1]
         u += du
     else:
         e = flux()
         res = residual(e)
-        u += dt * res
+        u += tau * res
     return
 
 
 # -----------------------------------------------------------------------------
 # compute maximum eigenvalue of Jacobi matrix
 def maxlam(u):
+    if (backend == 'numba' and jitkernels.usable(u, state, k, c0)):
+        return jitkernels.maxlam(u, jitkernels.MODELS[model], jitkernels.STATES[state], k, c0)
+    if (backend != 'loop'): return lam_vec(u).max(axis=-1)
     lam = 0.
     for i in range(0, nx):
         if (model == 'lwr'):
@@ -92,24 +124,48 @@ def maxlam(u):
             lam = max(lam, abs(u[1, i] / u[0, i]) + c0)
         elif (model == 'zhang'):
             vi = u[1, i] / u[0, i] + vel(u[0, i])
-            lam = max(lam, abs(vi), abs(vi + u[0, i] * (-k)))
+            lam = max(lam, abs(vi), abs(vi + u[0, i] * dvel(u[0, i])))
     return lam
 
 
 # -----------------------------------------------------------------------------
-# model for velocity
+# the diagram and the whole-array kernels below read their parameters from
+# p, the globals of this module by default or an object with the same names
+# (see simulation.Simulation), and write their results to out if given.
+# scratch returns their temporaries: new arrays, unless p keeps them from
+# call to call in a dictionary work
+this = sys.modules[__name__]
+
+
+def scratch(p, key, shape, dtype):
+    work = getattr(p, 'work', None)
+    if (work is None): return np.empty(shape, dtype)
+    key = (key, shape, dtype)
+    if (key not in work): work[key] = np.empty(shape, dtype)
+    return work[key]
+
+
+# -----------------------------------------------------------------------------
+# fundamental diagram of the state and k parameters of p (see diagram.py),
+# built again when either is reassigned
+law = None
+
+
+def fd(p=None):
+    if (p is None): p = this
+    if (p.law is None or p.law[0] is not p.state or p.law[1] is not p.k):
+        p.law = (p.state, p.k, diagram.get(p.state, p.k))
+    return p.law[2]
+
+
+# -----------------------------------------------------------------------------
+# model for velocity and its derivative
 def vel(rho):
-    if (state == 'greenshield'):
-        v = 1 - k * rho
-    elif (state == 'greenberg'):
-        vmax = 10.
-        if (rho < 1 / np.exp(vmax)):
-            v = vmax
-        else:
-            v = min(vmax, np.log(1 / rho))
-    elif (state == 'underwood'):
-        v = np.exp(-rho)
-    return v
+    return fd().v(rho)
+
+
+def dvel(rho):
+    return fd().dv(rho)
 
 
 # -----------------------------------------------------------------------------
@@ -141,8 +197,8 @@ def aa(ui):
     elif (model == 'zhang'):
         rhoi = ui[0]
         mi = ui[1]
-        ai = np.array([[rhoi * (-k) + vel(rhoi), 1], \
-                       [-mi ** 2 / rhoi ** 2 + mi * (-k), 2 * mi / rhoi + vel(rhoi)]])
+        ai = np.array([[rhoi * dvel(rhoi) + vel(rhoi), 1], \
+                       [-mi ** 2 / rhoi ** 2 + mi * dvel(rhoi), 2 * mi / rhoi + vel(rhoi)]])
     return ai
 
 
@@ -155,7 +211,7 @@ def tt(ui):
     elif (model == 'zhang'):
         rhoi = ui[0]
         vi = ui[1] / rhoi + vel(rhoi)
-        ti = np.array([[1, 1], [vi - vel(rhoi) - rhoi * (-k), vi - vel(rhoi)]])
+        ti = np.array([[1, 1], [vi - vel(rhoi) - rhoi * dvel(rhoi), vi - vel(rhoi)]])
     return ti
 
 
@@ -177,17 +233,29 @@ def roe_avg(u1, u2):
         v2 = u2[1] / rho2 + vel(rho2)
         avgv = (R * v2 + v1) / (R + 1)
         avgu = [avgrho, avgrho * (avgv - vel(avgrho))]
-        avglam = np.array([avgv, avgv + avgrho * (-k)])
+        avglam = np.array([avgv, avgv + avgrho * dvel(avgrho)])
     avgt = tt(avgu)
     avgsig = np.sign(avglam)
-    delta = np.dot(np.linalg.inv(avgt), u2 - u1)
+    # inverse of T = [[1, 1], [t10, t11]] in closed form
+    det = avgt[1, 1] - avgt[1, 0]
+    d = u2 - u1
+    delta = np.array([(avgt[1, 1] * d[0] - d[1]) / det, (-avgt[1, 0] * d[0] + d[1]) / det])
     return (delta, avglam, avgt, avgsig)
 
 
 # -----------------------------------------------------------------------------
 # flux vector
 def flux(stage=0):
+    if (backend == 'numba' and method in jitkernels.METHODS and
+            jitkernels.usable(u, state, k, c0, dt)):
+        return jitkernels.flux(u, stage, lam0, jitkernels.MODELS[model], jitkernels.STATES[state],
+                               jitkernels.METHODS[method], k, c0, dt, dx, avmodel, kappa2, kappa4)
+    # the reconstructions only have whole-array kernels
+    if (backend != 'loop' or get_stages(method) is not None): return flux_vec(u, stage, lam0)
     e = np.zeros((lmax, nx - 1))
+    # Roe averages of every interface, shared by its neighbours in TVD
+    if (method == 'roe' or method[:3] == 'tvd'):
+        roe = [roe_avg(u[:, i], u[:, i + 1]) for i in range(0, nx - 1)]
     for i in range(0, nx - 1):
         # Lax method
         if (method == 'lax'):
@@ -233,13 +301,13 @@ def flux(stage=0):
                 v1 = u[1, i] / rho1 + vel(rho1)
                 v2 = u[1, i + 1] / rho2 + vel(rho2)
                 lam1_p = max(v1, 0)
-                lam2_p = max(v1 + rho1 * (-k), 0)
+                lam2_p = max(v1 + rho1 * dvel(rho1), 0)
                 lam1_m = min(v2, 0)
-                lam2_m = min(v2 + rho2 * (-k), 0)
+                lam2_m = min(v2 + rho2 * dvel(rho2), 0)
             Lam_p = np.array([[lam1_p, 0], [0, lam2_p]])
             Lam_m = np.array([[lam1_m, 0], [0, lam2_m]])
-            a_p = np.dot(tt(u[:, i]), Lam_p, np.linalg.inv(tt(u[:, i])))
-            a_m = np.dot(tt(u[:, i + 1]), Lam_m, np.linalg.inv(tt(u[:, i + 1])))
+            a_p = np.dot(np.dot(tt(u[:, i]), Lam_p), np.linalg.inv(tt(u[:, i])))
+            a_m = np.dot(np.dot(tt(u[:, i + 1]), Lam_m), np.linalg.inv(tt(u[:, i + 1])))
             e_p = np.dot(a_p, u[:, i])
             e_m = np.dot(a_m, u[:, i + 1])
             e[:, i] = e_p + e_m
@@ -247,7 +315,7 @@ def flux(stage=0):
         elif (method == 'roe'):
             e1 = ee(u[:, i])
             e2 = ee(u[:, i + 1])
-            (delta, avglam, avgt, avgsig) = roe_avg(u[:, i], u[:, i + 1])
+            (delta, avglam, avgt, avgsig) = roe[i]
             e[:, i] = .5 * (e1 + e2)
             for l in range(0, lmax):
                 e[:, i] -= .5 * delta[l] * abs(avglam[l]) * avgt[:, l]
@@ -258,12 +326,9 @@ def flux(stage=0):
 
             e[:, i] = .5 * (e1 + e2)
             if (i > 0 and i < nx - 2):
-                (delta, avglam, avgt, avgsig) = \
-                    roe_avg(u[:, i], u[:, i + 1])
-                (delta1, avglam1, avgt1, avgsig1) = \
-                    roe_avg(u[:, i - 1], u[:, i])
-                (delta2, avglam2, avgt2, avgsig2) = \
-                    roe_avg(u[:, i + 1], u[:, i + 2])
+                (delta, avglam, avgt, avgsig) = roe[i]
+                delta1 = roe[i - 1][0]
+                delta2 = roe[i + 1][0]
                 for l in range(0, lmax):
                     if (avgsig[l] > 0):
                         r = 1e2 if (delta[l] == 0) else delta1[l] / delta[l]
@@ -298,18 +363,66 @@ def source(u):
 # -----------------------------------------------------------------------------
 # residual
 def residual(e):
-    res = np.zeros((lmax, nx))
-    for i in range(1, nx - 1):
-        res[:, i] = -(e[:, i] - e[:, i - 1]) / dx
-    if (model == 'pw'): res += source(u)
+    if (backend == 'numba' and jitkernels.usable(u, state, k)):
+        res = jitkernels.residual(u, e, jitkernels.MODELS[model], jitkernels.STATES[state], k, dx)
+    elif (backend != 'loop'):
+        res = residual_vec(u, e)
+    else:
+        res = np.zeros((lmax, nx))
+        for i in range(1, nx - 1):
+            res[:, i] = -(e[:, i] - e[:, i - 1]) / dx
+        if (model == 'pw'): res += source(u)
+    if (smooth > 0): res = smoothing(res)
     return res
 
 
+# -----------------------------------------------------------------------------
+# implicit residual smoothing (1 - smooth * d2/di2) res_s = res on the interior
+# cells, in place, which widens the stable pseudo-time step of steady runs;
+# the operator factors into (smooth / r) (1 - r E) (1 - r / E), E the shift
+# by one cell, so it is inverted by one recurrence to the right and one to
+# the left
+def smoothing(res, p=None):
+    if (p is None): p = this
+    smooth = p.smooth
+    r = float(1 + 2 * smooth - np.sqrt(1 + 4 * smooth)) / (2 * smooth)
+    ends = scratch(p, 'smoothing.ends', res.shape[:-1] + (2,), res.dtype)
+    (ends[..., 0], ends[..., 1]) = (res[..., 0], res[..., -1])
+    recurrence(res, r, p)
+    recurrence(res[..., ::-1], r, p)
+    res *= r / smooth
+    (res[..., 0], res[..., -1]) = (ends[..., 0], ends[..., 1])
+    return res
+
+
+# -----------------------------------------------------------------------------
+# y_i = y_i + r y_i-1 along the last axis (|r| < 1) in place, by recursive
+# doubling; stops once r**s drops below round-off
+def recurrence(y, r, p=None):
+    s = 1
+    n = y.shape[-1]
+    g = scratch(p, 'recurrence.g', y.shape, y.dtype)
+    while (s < n and abs(r) > 1e-17):
+        np.multiply(y[..., :-s], r, out=g[..., :n - s])
+        y[..., s:] += g[..., :n - s]
+        r *= r
+        s *= 2
+    return y
+
+
+# -----------------------------------------------------------------------------
+# largest density residual away from the cells set by the boundary conditions
+def resnorm(res, p=None):
+    if (p is None): p = this
+    r = np.abs(res[0, 1:-1], out=scratch(p, 'resnorm.r', (p.nx - 2,), res.dtype))
+    r[p.nx // 2 - 1] = 0.
+    return r.max()
+
+
 # -----------------------------------------------------------------------------
 # artificial viscosity
 def av(e):
     # Von-Neumann & Ritchmyer
-    lam0 = maxlam(u)
     u0 = .5
     for i in range(1, nx - 2):
         du = u[:, i + 1] - u[:, i]
@@ -320,6 +433,522 @@ def av(e):
     return e
 
 
+# -----------------------------------------------------------------------------
+# model for velocity and its derivative (whole array)
+def vel_vec(rho, out=None, p=None):
+    return fd(p).v(rho, out)
+
+
+def dvel_vec(rho, out=None, p=None):
+    return fd(p).dv(rho, out)
+
+
+# -----------------------------------------------------------------------------
+# spectral radius of Jacobi matrix at all grid points
+def lam_vec(u, out=None, p=None):
+    if (p is None): p = this
+    (rho, m) = (u[..., 0, :], u[..., -1, :])
+    if (out is None): out = np.empty(rho.shape, u.dtype)
+    if (p.model == 'lwr'):
+        vel_vec(rho, out, p)
+        np.abs(out, out=out)
+    elif (p.model == 'pw'):
+        np.divide(m, rho, out=out)
+        np.abs(out, out=out)
+        out += p.c0
+    elif (p.model == 'zhang'):
+        v = scratch(p, 'lam.v', rho.shape, u.dtype)
+        s = scratch(p, 'lam.s', rho.shape, u.dtype)
+        np.divide(m, rho, out=v)
+        v += vel_vec(rho, s, p)
+        np.multiply(rho, dvel_vec(rho, s, p), out=s)
+        s += v
+        np.abs(s, out=s)
+        np.abs(v, out=out)
+        np.maximum(out, s, out=out)
+    return out
+
+
+# -----------------------------------------------------------------------------
+# flux vectors at all grid points, shape (..., lmax, n)
+def ee_vec(u, out=None, p=None):
+    if (p is None): p = this
+    (rho, m) = (u[..., 0, :], u[..., -1, :])
+    if (out is None): out = np.empty(u.shape, u.dtype)
+    if (p.model == 'lwr'):
+        vel_vec(rho, out[..., 0, :], p)
+        out[..., 0, :] *= rho
+    elif (p.model == 'pw'):
+        v = scratch(p, 'ee.v', rho.shape, u.dtype)
+        s = scratch(p, 'ee.s', rho.shape, u.dtype)
+        np.divide(m, rho, out=v)
+        np.multiply(rho, v, out=out[..., 0, :])
+        np.square(v, out=s)
+        s *= rho
+        np.multiply(rho, p.c0 ** 2, out=out[..., 1, :])
+        out[..., 1, :] += s
+    elif (p.model == 'zhang'):
+        v = scratch(p, 'ee.v', rho.shape, u.dtype)
+        s = scratch(p, 'ee.s', rho.shape, u.dtype)
+        vel_vec(rho, v, p)
+        np.multiply(rho, v, out=out[..., 0, :])
+        out[..., 0, :] += m
+        np.square(m, out=out[..., 1, :])
+        out[..., 1, :] /= rho
+        np.multiply(m, v, out=s)
+        out[..., 1, :] += s
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Jacobi matrices A at all grid points, shape (..., lmax, lmax, n)
+def aa_vec(u, out=None, p=None):
+    if (p is None): p = this
+    (rho, m) = (u[..., 0, :], u[..., -1, :])
+    (l, n) = u.shape[-2:]
+    if (out is None): out = np.empty(u.shape[:-2] + (l, l, n), u.dtype)
+    if (p.model == 'lwr'):
+        vel_vec(rho, out[..., 0, 0, :], p)
+    elif (p.model == 'pw'):
+        v = scratch(p, 'aa.v', rho.shape, u.dtype)
+        np.divide(m, rho, out=v)
+        out[..., 0, 0, :] = 0
+        out[..., 0, 1, :] = 1
+        np.square(v, out=out[..., 1, 0, :])
+        np.subtract(p.c0 ** 2, out[..., 1, 0, :], out=out[..., 1, 0, :])
+        np.multiply(v, 2, out=out[..., 1, 1, :])
+    elif (p.model == 'zhang'):
+        v = scratch(p, 'aa.v', rho.shape, u.dtype)
+        s = scratch(p, 'aa.s', rho.shape, u.dtype)
+        vel_vec(rho, v, p)
+        np.multiply(rho, dvel_vec(rho, out[..., 0, 0, :], p), out=out[..., 0, 0, :])
+        out[..., 0, 0, :] += v
+        out[..., 0, 1, :] = 1
+        np.square(m, out=out[..., 1, 0, :])
+        np.negative(out[..., 1, 0, :], out=out[..., 1, 0, :])
+        np.square(rho, out=s)
+        out[..., 1, 0, :] /= s
+        np.multiply(m, dvel_vec(rho, s, p), out=s)
+        out[..., 1, 0, :] += s
+        np.multiply(m, 2, out=out[..., 1, 1, :])
+        out[..., 1, 1, :] /= rho
+        out[..., 1, 1, :] += v
+    return out
+
+
+# -----------------------------------------------------------------------------
+# modal matrices T at all grid points, shape (..., 2, 2, n)
+def tt_vec(u, out=None, p=None):
+    if (p is None): p = this
+    (rho, m) = (u[..., 0, :], u[..., 1, :])
+    if (out is None): out = np.empty(u.shape[:-2] + (2, 2, u.shape[-1]), u.dtype)
+    out[..., 0, :, :] = 1
+    if (p.model == 'pw'):
+        v = scratch(p, 'tt.v', rho.shape, u.dtype)
+        np.divide(m, rho, out=v)
+        np.add(v, p.c0, out=out[..., 1, 0, :])
+        np.subtract(v, p.c0, out=out[..., 1, 1, :])
+    elif (p.model == 'zhang'):
+        v = scratch(p, 'tt.v', rho.shape, u.dtype)
+        s = scratch(p, 'tt.s', rho.shape, u.dtype)
+        vel_vec(rho, v, p)
+        np.divide(m, rho, out=out[..., 1, 0, :])
+        out[..., 1, 0, :] += v
+        np.subtract(out[..., 1, 0, :], v, out=out[..., 1, 1, :])
+        np.multiply(rho, dvel_vec(rho, s, p), out=s)
+        np.subtract(out[..., 1, 1, :], s, out=out[..., 1, 0, :])
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Roe-averaging at all interfaces between u1 and u2: the jumps delta = T^-1
+# (u2 - u1), the eigenvalues, the modal matrices T and the signs of the
+# eigenvalues, all scratch arrays of p; the closed-form inverse of
+# T = [[1, 1], [t10, t11]] replaces np.linalg.inv
+def roe_avg_vec(u1, u2, p=None):
+    if (p is None): p = this
+    (shape, dtype) = (u1.shape[:-2] + u1.shape[-1:], u1.dtype)
+    (rho1, rho2, R, avgrho, v1, v2, avgv, s) = [scratch(p, 'roe.' + name, shape, dtype) for name in
+                                                ('rho1', 'rho2', 'R', 'avgrho', 'v1', 'v2', 'avgv', 's')]
+    (delta, avglam, avgsig, avgu) = [scratch(p, 'roe.' + name, u1.shape, dtype) for name in
+                                     ('delta', 'avglam', 'avgsig', 'avgu')]
+    np.maximum(u1[..., 0, :], 1e-3, out=rho1)
+    np.maximum(u2[..., 0, :], 1e-3, out=rho2)
+    np.divide(rho2, rho1, out=R)
+    np.sqrt(R, out=R)
+    np.multiply(R, rho1, out=avgrho)
+    avgu[..., 0, :] = avgrho
+    if (p.model == 'pw'):
+        np.divide(u1[..., 1, :], u1[..., 0, :], out=v1)
+        np.minimum(v1, 10., out=v1)
+        np.divide(u2[..., 1, :], u2[..., 0, :], out=v2)
+        np.minimum(v2, 10., out=v2)
+    elif (p.model == 'zhang'):
+        np.divide(u1[..., 1, :], rho1, out=v1)
+        v1 += vel_vec(rho1, s, p)
+        np.divide(u2[..., 1, :], rho2, out=v2)
+        v2 += vel_vec(rho2, s, p)
+    np.multiply(R, v2, out=avgv)
+    avgv += v1
+    np.add(R, 1, out=s)
+    avgv /= s
+    if (p.model == 'pw'):
+        np.multiply(avgrho, avgv, out=avgu[..., 1, :])
+        np.add(avgv, p.c0, out=avglam[..., 0, :])
+        np.subtract(avgv, p.c0, out=avglam[..., 1, :])
+    elif (p.model == 'zhang'):
+        np.subtract(avgv, vel_vec(avgrho, s, p), out=avgu[..., 1, :])
+        avgu[..., 1, :] *= avgrho
+        avglam[..., 0, :] = avgv
+        np.multiply(avgrho, dvel_vec(avgrho, avglam[..., 1, :], p), out=avglam[..., 1, :])
+        avglam[..., 1, :] += avgv
+    avgt = tt_vec(avgu, scratch(p, 'roe.avgt', u1.shape[:-2] + (2, 2, u1.shape[-1]), dtype), p)
+    np.sign(avglam, out=avgsig)
+    # u2 - u1 in delta, then delta = T^-1 (u2 - u1)
+    (t10, t11) = (avgt[..., 1, 0, :], avgt[..., 1, 1, :])
+    np.subtract(u2, u1, out=delta)
+    np.subtract(t11, t10, out=s)
+    np.multiply(t11, delta[..., 0, :], out=v1)
+    v1 -= delta[..., 1, :]
+    np.multiply(t10, delta[..., 0, :], out=v2)
+    np.subtract(delta[..., 1, :], v2, out=delta[..., 1, :])
+    np.divide(v1, s, out=delta[..., 0, :])
+    delta[..., 1, :] /= s
+    return (delta, avglam, avgt, avgsig)
+
+
+# -----------------------------------------------------------------------------
+# e -= c T w for the modal matrices T = [[1, 1], [t10, t11]] of roe_avg_vec
+def sub_modes(e, avgt, w, c=1., p=None):
+    (shape, dtype) = (w.shape[:-2] + w.shape[-1:], w.dtype)
+    s = scratch(p, 'modes.s', shape, dtype)
+    g = scratch(p, 'modes.g', shape, dtype)
+    np.add(w[..., 0, :], w[..., 1, :], out=s)
+    s *= c
+    e[..., 0, :] -= s
+    np.multiply(avgt[..., 1, 0, :], w[..., 0, :], out=s)
+    np.multiply(avgt[..., 1, 1, :], w[..., 1, :], out=g)
+    s += g
+    s *= c
+    e[..., 1, :] -= s
+    return e
+
+
+# -----------------------------------------------------------------------------
+# largest characteristic speed at all grid points; lam_vec of lwr is the
+# vehicle speed, not the slope of the flux
+def speed_vec(u, out=None, p=None):
+    if (p is None): p = this
+    if (p.model != 'lwr'): return lam_vec(u, out, p)
+    rho = u[..., 0, :]
+    if (out is None): out = np.empty(rho.shape, u.dtype)
+    s = scratch(p, 'speed.s', rho.shape, u.dtype)
+    vel_vec(rho, out, p)
+    out += np.multiply(rho, dvel_vec(rho, s, p), out=s)
+    np.abs(out, out=out)
+    return out
+
+
+# -----------------------------------------------------------------------------
+# fifth-order WENO value at the right face of cell v2 from cells v0..v4
+# (Jiang & Shu smoothness indicators)
+def weno5(v0, v1, v2, v3, v4):
+    eps = 1e-6
+    q0 = (2 * v0 - 7 * v1 + 11 * v2) / 6
+    q1 = (-v1 + 5 * v2 + 2 * v3) / 6
+    q2 = (2 * v2 + 5 * v3 - v4) / 6
+    b0 = 13. / 12 * (v0 - 2 * v1 + v2) ** 2 + .25 * (v0 - 4 * v1 + 3 * v2) ** 2
+    b1 = 13. / 12 * (v1 - 2 * v2 + v3) ** 2 + .25 * (v1 - v3) ** 2
+    b2 = 13. / 12 * (v2 - 2 * v3 + v4) ** 2 + .25 * (3 * v2 - 4 * v3 + v4) ** 2
+    a0 = .1 / (eps + b0) ** 2
+    a1 = .6 / (eps + b1) ** 2
+    a2 = .3 / (eps + b2) ** 2
+    return (a0 * q0 + a1 * q1 + a2 * q2) / (a0 + a1 + a2)
+
+
+# -----------------------------------------------------------------------------
+# states left and right of all interfaces, reconstructed from the cells
+# around them by MUSCL (minmod or monotonized central slopes) or WENO5; the
+# ends of the road are extended by copies of its end cells
+def reconstruct(u, p=None):
+    if (p is None): p = this
+    n = u.shape[-1]
+    if (p.method == 'weno5'):
+        v = np.pad(u, [(0, 0)] * (u.ndim - 1) + [(2, 2)], mode='edge')
+        # c[j] holds cell i - 2 + j of every interface i
+        c = [v[..., j:j + n - 1] for j in range(0, 6)]
+        return (weno5(c[0], c[1], c[2], c[3], c[4]), weno5(c[5], c[4], c[3], c[2], c[1]))
+    v = np.pad(u, [(0, 0)] * (u.ndim - 1) + [(1, 1)], mode='edge')
+    dm = v[..., 1:-1] - v[..., :-2]
+    dp = v[..., 2:] - v[..., 1:-1]
+    if (p.method == 'muscl-minmod'):
+        s = np.minimum(abs(dm), abs(dp))
+    elif (p.method == 'muscl-mc'):
+        s = np.minimum(np.minimum(2 * abs(dm), 2 * abs(dp)), .5 * abs(dm + dp))
+    s = np.where(dm * dp > 0, np.sign(dm) * s, 0.)
+    return (u[..., :-1] + .5 * s[..., :-1], u[..., 1:] - .5 * s[..., 1:])
+
+
+# -----------------------------------------------------------------------------
+# flux vector at all interfaces at once; lam0 has the batch shape u.shape[:-2]
+def flux_vec(u, stage=0, lam0=None, out=None, p=None):
+    if (p is None): p = this
+    (method, dt, dx) = (p.method, p.dt, p.dx)
+    (ul, ur) = (u[..., :-1], u[..., 1:])
+    (shape, dtype) = (ul.shape, u.dtype)
+    e = np.empty(shape, dtype) if (out is None) else out
+    if (method in ('lax', 'lax-wendroff', 'rk4', 'beam-warming', 'roe', 'tvd-superbee',
+                   'tvd-vanleer')):
+        ev = ee_vec(u, scratch(p, 'flux.ev', u.shape, dtype), p)
+        np.add(ev[..., :-1], ev[..., 1:], out=e)
+        e *= .5
+    # Lax method
+    if (method == 'lax'):
+        d = scratch(p, 'flux.d', shape, dtype)
+        np.subtract(ur, ul, out=d)
+        d *= .5 * dx / dt
+        e -= d
+    # Lax-Wendroff method
+    elif (method == 'lax-wendroff'):
+        l = u.shape[-2]
+        ai = aa_vec(u, scratch(p, 'flux.ai', u.shape[:-2] + (l, l, u.shape[-1]), dtype), p)
+        a = scratch(p, 'flux.a', ul.shape[:-2] + (l, l, ul.shape[-1]), dtype)
+        np.add(ai[..., :-1], ai[..., 1:], out=a)
+        a *= .5
+        (de, g, s) = [scratch(p, 'flux.' + name, shape, dtype) for name in ('de', 'g', 's')]
+        np.subtract(ev[..., 1:], ev[..., :-1], out=de)
+        np.multiply(a[..., 0, :], de[..., 0:1, :], out=g)
+        for j in range(1, l):
+            np.multiply(a[..., j, :], de[..., j:j + 1, :], out=s)
+            g += s
+        g *= .5 * dt / dx
+        e -= g
+    # MacCormack method
+    elif (method == 'maccormack'):
+        ev = ee_vec(u, scratch(p, 'flux.ev', u.shape, dtype), p)
+        if (stage == 0):
+            e[...] = ev[..., 1:]
+        elif (stage == 1):
+            e[...] = ev[..., :-1]
+    # Steger & Warming flux vetcor splitting
+    elif (method == 'steger-warming'):
+        n = u.shape[-1]
+        (rho, mom) = (u[..., 0, :], u[..., 1, :])
+        (lam1, lam2, s, w1, w2, det) = [scratch(p, 'flux.' + name, rho.shape, dtype) for name in
+                                        ('lam1', 'lam2', 's', 'w1', 'w2', 'det')]
+        if (p.model == 'pw'):
+            np.divide(mom, rho, out=s)
+            np.add(s, p.c0, out=lam1)
+            np.subtract(s, p.c0, out=lam2)
+        elif (p.model == 'zhang'):
+            np.divide(mom, rho, out=lam1)
+            lam1 += vel_vec(rho, s, p)
+            np.multiply(rho, dvel_vec(rho, lam2, p), out=lam2)
+            lam2 += lam1
+        # E+ = T Lam+ T^-1 u from the left cell, E- = T Lam- T^-1 u from the
+        # right one, with the characteristic variables w = T^-1 u of every
+        # cell in closed form
+        t = tt_vec(u, scratch(p, 'flux.t', u.shape[:-2] + (2, 2, n), dtype), p)
+        (t10, t11) = (t[..., 1, 0, :], t[..., 1, 1, :])
+        np.subtract(t11, t10, out=det)
+        np.multiply(t11, rho, out=w1)
+        w1 -= mom
+        w1 /= det
+        np.multiply(t10, rho, out=w2)
+        np.subtract(mom, w2, out=w2)
+        w2 /= det
+        (g1p, g2p, g1m, g2m) = [scratch(p, 'flux.' + name, shape[:-2] + shape[-1:], dtype)
+                                for name in ('g1p', 'g2p', 'g1m', 'g2m')]
+        np.maximum(lam1[..., :-1], 0, out=g1p)
+        g1p *= w1[..., :-1]
+        np.maximum(lam2[..., :-1], 0, out=g2p)
+        g2p *= w2[..., :-1]
+        np.minimum(lam1[..., 1:], 0, out=g1m)
+        g1m *= w1[..., 1:]
+        np.minimum(lam2[..., 1:], 0, out=g2m)
+        g2m *= w2[..., 1:]
+        s = s[..., :-1]
+        np.add(g1p, g2p, out=e[..., 0, :])
+        np.add(g1m, g2m, out=s)
+        e[..., 0, :] += s
+        np.multiply(t10[..., :-1], g1p, out=e[..., 1, :])
+        np.multiply(t11[..., :-1], g2p, out=s)
+        e[..., 1, :] += s
+        np.multiply(t10[..., 1:], g1m, out=g1p)
+        np.multiply(t11[..., 1:], g2m, out=g2p)
+        g1p += g2p
+        e[..., 1, :] += g1p
+    # Roe's approximate Riemann solver
+    elif (method == 'roe'):
+        (delta, avglam, avgt, avgsig) = roe_avg_vec(ul, ur, p)
+        w = scratch(p, 'flux.w', shape, dtype)
+        np.abs(avglam, out=w)
+        w *= delta
+        sub_modes(e, avgt, w, .5, p)
+    # TVD method
+    elif (method[:3] == 'tvd'):
+        # one Roe average per interface; the limiter of interface i takes the
+        # jumps of its neighbours i - 1 and i + 1 by slicing
+        (delta, avglam, avgt, avgsig) = roe_avg_vec(ul, ur, p)
+        (d, d1, d2) = (delta[..., 1:-1], delta[..., :-2], delta[..., 2:])
+        (lam, sig) = (avglam[..., 1:-1], avgsig[..., 1:-1])
+        (r, q, phi) = [scratch(p, 'flux.' + name, d.shape, dtype) for name in ('r', 'q', 'phi')]
+        mask = scratch(p, 'flux.mask', d.shape, bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(d1, d, out=r)
+            np.divide(d2, d, out=q)
+        np.less_equal(sig, 0, out=mask)
+        np.copyto(r, q, where=mask)
+        np.equal(d, 0, out=mask)
+        np.copyto(r, 1e2, where=mask)
+        # Roe superbee limiter
+        if (method == 'tvd-superbee'):
+            np.multiply(r, 2, out=phi)
+            np.minimum(phi, 1, out=phi)
+            np.minimum(r, 2, out=q)
+            np.maximum(phi, q, out=phi)
+            np.maximum(phi, 0, out=phi)
+        elif (method == 'tvd-vanleer'):
+            np.abs(r, out=q)
+            np.add(r, q, out=phi)
+            q += 1
+            phi /= q
+        np.multiply(lam, dt, out=q)
+        q /= dx
+        q -= sig
+        q *= phi
+        q += sig
+        q *= .5
+        q *= d
+        np.abs(lam, out=r)
+        q *= r
+        sub_modes(e[..., 1:-1], avgt[..., 1:-1], q, 1., p)
+    # MUSCL / WENO5 reconstruction with the local Lax-Friedrichs flux
+    elif (get_stages(method) is not None):
+        (ul, ur) = reconstruct(u, p)
+        a = np.maximum(speed_vec(ul, p=p), speed_vec(ur, p=p))[..., np.newaxis, :]
+        e[...] = .5 * (ee_vec(ul, p=p) + ee_vec(ur, p=p)) - .5 * a * (ur - ul)
+
+    # artificial viscosity
+    if (p.avmodel): av_vec(u, e, lam0, p)
+    return e
+
+
+# -----------------------------------------------------------------------------
+# source vector at all grid points
+def source_vec(u, out=None, p=None):
+    if (p is None): p = this
+    (rho, m) = (u[..., 0, :], u[..., 1, :])
+    if (out is None): out = np.empty(u.shape, u.dtype)
+    tau = 1.
+    v = scratch(p, 'source.v', rho.shape, u.dtype)
+    s = out[..., 1, :]
+    out[..., 0, :] = 0.
+    vel_vec(rho, s, p)
+    np.divide(m, rho, out=v)
+    s -= v
+    s *= rho
+    s /= tau
+    return out
+
+
+# -----------------------------------------------------------------------------
+# residual at all grid points
+def residual_vec(u, e, out=None, p=None):
+    if (p is None): p = this
+    res = np.empty(u.shape, u.dtype) if (out is None) else out
+    np.subtract(e[..., 1:], e[..., :-1], out=res[..., 1:-1])
+    res[..., 1:-1] /= -p.dx
+    res[..., 0] = 0.
+    res[..., -1] = 0.
+    if (p.model == 'pw'):
+        res[..., 1, :] += source_vec(u, scratch(p, 'residual.s', u.shape, u.dtype), p)[..., 1, :]
+    return res
+
+
+# -----------------------------------------------------------------------------
+# artificial viscosity at all interfaces
+def av_vec(u, e, lam0=None, p=None):
+    if (p is None): p = this
+    # Von-Neumann & Ritchmyer
+    if (lam0 is None): lam0 = maxlam(u)
+    if (np.ndim(lam0) > 0): lam0 = np.asarray(lam0)[..., np.newaxis, np.newaxis]
+    u0 = .5
+    (du, g, d3u, s) = [scratch(p, 'av.' + name, u[..., 3:].shape, u.dtype) for name in
+                       ('du', 'g', 'd3u', 's')]
+    np.subtract(u[..., 2:-1], u[..., 1:-2], out=du)
+    np.abs(du, out=g)
+    g *= p.kappa2
+    g /= u0
+    g *= du
+    np.multiply(u[..., 2:-1], 3, out=d3u)
+    np.subtract(u[..., 3:], d3u, out=d3u)
+    np.multiply(u[..., 1:-2], 3, out=s)
+    d3u += s
+    d3u -= u[..., :-3]
+    d3u *= p.kappa4
+    g -= d3u
+    g *= lam0
+    e[..., 1:-1] -= g
+    return e
+
+
+# -----------------------------------------------------------------------------
+# block-tridiagonal solve by cyclic reduction; lo, di, up are the (n, l, l)
+# blocks left of, on and right of the diagonal (lo[0], up[-1] unused) and b
+# is (n, l); every level eliminates the even rows from the odd ones at once
+def btrisolve(lo, di, up, b):
+    n = len(b)
+    if (n == 1):
+        return np.linalg.solve(di, b[..., np.newaxis])[..., 0]
+    if (n % 2 == 0):
+        # pad with a decoupled identity row so every odd row has two neighbours
+        eye = np.eye(di.shape[-1])[np.newaxis]
+        zero = np.zeros_like(eye)
+        x = btrisolve(np.concatenate([lo, zero]), np.concatenate([di, eye]),
+                      np.concatenate([up, zero]), np.concatenate([b, b[:1] * 0]))
+        return x[:n]
+    inv = np.linalg.inv(di[0::2])
+    alpha = -lo[1::2] @ inv[:-1]
+    beta = -up[1::2] @ inv[1:]
+    x = np.empty_like(b)
+    x[1::2] = btrisolve(alpha @ lo[0:-1:2],
+                        di[1::2] + alpha @ up[0:-1:2] + beta @ lo[2::2],
+                        beta @ up[2::2],
+                        b[1::2] + (alpha @ b[0:-1:2, :, np.newaxis] +
+                                   beta @ b[2::2, :, np.newaxis])[..., 0])
+    xm = np.zeros_like(b[0::2])
+    xp = np.zeros_like(b[0::2])
+    xm[1:] = x[1::2]
+    xp[:-1] = x[1::2]
+    r = b[0::2] - (lo[0::2] @ xm[..., np.newaxis] + up[0::2] @ xp[..., np.newaxis])[..., 0]
+    x[0::2] = (inv @ r[..., np.newaxis])[..., 0]
+    return x
+
+
+# -----------------------------------------------------------------------------
+# implicit Beam & Warming correction du from
+# du_i + dt / (4 dx) * (A_i+1 du_i+1 - A_i-1 du_i-1)
+#      - eps * dt / dx * lam0 * (du_i+1 - 2 du_i + du_i-1) = dt * res_i
+# the second difference is implicit dissipation: it leaves steady states
+# alone and damps the waves the explicit AV cannot hold at large steps
+def bw_vec(u, res, p=None):
+    if (p is None): p = this
+    (dt, dx, l) = (p.dt, p.dx, u.shape[-2])
+    eps = 1.
+    ai = aa_vec(u, scratch(p, 'bw.ai', (l, l, u.shape[-1]), u.dtype), p)
+    a = np.moveaxis(.25 * dt / dx * ai, -1, 0)
+    c = eps * dt / dx * float(p.lam0) * np.eye(l)
+    n = len(a)
+    lo = np.zeros_like(a)
+    up = np.zeros_like(a)
+    lo[1:] = -a[:-1] - c
+    up[:-1] = a[1:] - c
+    di = np.broadcast_to(np.eye(l) + 2 * c, (n, l, l))
+    du = btrisolve(lo, di, up, dt * res.T)
+    return du.T
+
+
 # -----------------------------------------------------------------------------
 # determine the order of given method
 def get_order(method):
@@ -331,104 +960,228 @@ def get_order(method):
              'steger-warming': 1,
              'roe': 1,
              'tvd-superbee': 2,
-             'tvd-vanleer': 2}
+             'tvd-vanleer': 2,
+             'muscl-minmod': 2,
+             'muscl-mc': 2,
+             'weno5': 5}
     return order[method]
 
 
 # -----------------------------------------------------------------------------
-# parameters
-xmin = 0
-xmax = 200
-nx = 151  # number of grid points
+# stages (a, b) of the strong-stability-preserving Runge-Kutta scheme of a
+# reconstructing method, u = a * u_old + b * (u + dt * res) from the state
+# at the start of the step and the previous stage (SSP-RK2 for MUSCL, SSP-RK3
+# for WENO5); None for the other methods
+def get_stages(method):
+    stages = {'muscl-minmod': [(0., 1.), (.5, .5)],
+              'muscl-mc': [(0., 1.), (.5, .5)],
+              'weno5': [(0., 1.), (.75, .25), (1. / 3, 2. / 3)]}
+    return stages.get(method)
 
-rho0 = 0.3
-fr = 0.5
-cfl = 0.5
-imax = 800
-eps = 1e-5
-tmax = 50
-k = 0.9  # for Greenshield model
-c0 = 0.5  # for PW model
 
 # -----------------------------------------------------------------------------
-# traffic flow model
-# acceptable values:
-## lwr   (Lighthill-Whitham-Richards model)
-## pw    (Payne-Whitham model)
-## zhang (Zhang model)
-model = 'lwr'
-lmax = 1 if (model == 'lwr') else 2
+# streamed forcing (see forcing.py): the upstream density and the signal
+# state (above .5 for red) as functions of the simulated time; None keeps
+# the free outflow upstream and the fixed red phase fr of the cycle tmax
+inflow = None
+signal = None
 
-# relationship between density and speed
-# acceptable values: greenshield, greenberg, underwood
-state = 'greenshield'
 
 # -----------------------------------------------------------------------------
-# numerical methods
-# acceptable values:
-## lax, lax-wendroff, maccormack, beam-warming, steger-warming
-## rk4, roe, tvd-superbee, tvd-vanleer
-method = 'beam-warming'
-
-avmodel = True
-kappa2 = .2
-kappa4 = 0.02
-
-# turn off AV model for first-order schemes
-order = get_order(method)
-if (order == 1): avmodel = False
-
-# grid points
-(x, dx) = set_mesh()
-# initial condition
-u = ic()
-
-fig = plt.figure()
-ax = fig.add_subplot(111)
-
-time = 0
-for i in range(0, imax):
-    # step size
-    dt = step()
-
-    solver()
-
-    # maxres = max(abs(res[0,]))
-    # if (maxres < 1e-5): break
-    time += dt
-    if time < tmax * fr:
+# signal at the middle of the road and outflow boundaries; time is the
+# signal clock and tsim the simulated time the streamed forcing is read at
+def bc(time, tsim=0.):
+    if (signal is None):
+        red = time < tmax * fr
+    else:
+        red = signal(tsim) > .5
+    if red:
         color = 'r'
         if model == 'lwr':
-            u[0, nx / 2] = 1.
+            u[0, nx // 2] = 1.
             # u[0,nx/2]   = 0.
         elif model == 'pw':
-            u[0, nx / 2] = 1.
-            u[1, nx / 2] = u[0, nx / 2] * vel(u[0, nx / 2])
+            u[0, nx // 2] = 1.
+            u[1, nx // 2] = u[0, nx // 2] * vel(u[0, nx // 2])
         elif model == 'zhang':
-            u[0, nx / 2] = 1.
-            u[1, nx / 2] = 0.
+            u[0, nx // 2] = 1.
+            u[1, nx // 2] = 0.
     else:
         color = 'g'
         if model == 'lwr':
-            u[0, nx / 2] = rho0
+            u[0, nx // 2] = rho0
             # u[0,nx/2]   = rho0
         elif model == 'pw':
-            u[0, nx / 2] = rho0
-            u[1, nx / 2] = u[0, nx / 2] * vel(u[0, nx / 2])
+            u[0, nx // 2] = rho0
+            u[1, nx // 2] = u[0, nx // 2] * vel(u[0, nx // 2])
         elif model == 'zhang':
-            u[0, nx / 2] = rho0
-            u[1, nx / 2] = 0.
+            u[0, nx // 2] = rho0
+            u[1, nx // 2] = 0.
     u[:, 0] = u[:, 1]
     u[:, -1] = u[:, -2]
+    if (inflow is not None):
+        u[0, 0] = inflow(tsim)
+        if model == 'pw':
+            u[1, 0] = u[0, 0] * vel(u[0, 0])
+        elif model == 'zhang':
+            u[1, 0] = 0.
+    return color
+
+
+# -----------------------------------------------------------------------------
+# time loop; monitor(i, time, color) is called after every step with the
+# simulated time since the start. The residual norm of every step is kept in
+# history, and a steady run stops once it falls below eps. The signal clock
+# is kept in clock; resume (see checkpoint.py) continues a run after its
+# step-th step from the given clock, simulated time and history, with u
+# already restored
+def run(monitor=None, resume=None):
+    global dt, maxres, history, clock
+    clock = 0
+    tsim = 0
+    history = []
+    first = 0
+    if (resume is not None):
+        (first, clock, tsim) = (resume['step'], resume['time'], resume['tsim'])
+        history = list(resume['history'])
+    # a steady problem is posed by its boundary conditions from the start
+    elif steady: bc(clock)
+    for i in range(first, imax):
+        # step size
+        dt = step()
+
+        solver()
+
+        maxres = resnorm(res)
+        history.append(maxres)
+        clock += dt
+        tsim += dt
+        color = bc(clock, tsim)
+
+        if clock > tmax: clock = 0
+
+        if (monitor is not None): monitor(i, tsim, color)
+        if (steady and maxres < eps): break
+    return tsim
+
 
-    if time > tmax: time = 0
+if __name__ == '__main__':
 
-    if i == 0:
-        line1, = ax.plot(x, u[0,], '-o')
-        line1.set_color(color)
-        ax.set_ylim(0, 1)
-        fig.show()
+    # -----------------------------------------------------------------------------
+    # parameters
+    xmin = 0
+    xmax = 200
+    nx = 151  # number of grid points
+
+    rho0 = 0.3
+    fr = 0.5
+    cfl = 0.5
+    imax = 800
+    eps = 1e-5
+    tmax = 50
+    k = 0.9  # for Greenshield model
+    c0 = 0.5  # for PW model
+
+    # floating-point type of the state and of the flux, residual and AV arrays;
+    # float32 halves memory and bandwidth (see simulation.accuracy for its error)
+    dtype = 'float64'
+
+    # -----------------------------------------------------------------------------
+    # traffic flow model
+    # acceptable values:
+    ## lwr   (Lighthill-Whitham-Richards model)
+    ## pw    (Payne-Whitham model)
+    ## zhang (Zhang model)
+    model = 'lwr'
+    lmax = 1 if (model == 'lwr') else 2
+
+    # relationship between density and speed
+    # acceptable values: greenshield, greenberg, underwood
+    state = 'greenshield'
+
+    # -----------------------------------------------------------------------------
+    # numerical methods
+    # acceptable values:
+    ## lax, lax-wendroff, maccormack, beam-warming, steger-warming
+    ## rk4, roe, tvd-superbee, tvd-vanleer
+    ## muscl-minmod, muscl-mc, weno5 (reconstructions with SSP Runge-Kutta;
+    ## limited, so they need no AV)
+    ## (beam-warming is implicit; with its implicit dissipation it stays
+    ## stable up to cfl 5 for lwr and zhang and up to cfl 3 for pw)
+    method = 'beam-warming'
+
+    avmodel = True
+    kappa2 = .2
+    kappa4 = 0.02
+
+    # computational backend
+    # acceptable values:
+    ## numpy (whole-array kernels)
+    ## loop  (per-cell reference implementation)
+    ## numba (compiled per-cell kernels; numpy when numba is missing)
+    backend = 'numpy'
+
+    # -----------------------------------------------------------------------------
+    # steady state
+    # a steady run stops once the largest density residual drops below eps;
+    # local pseudo-time steps (ltime; rk4 on lwr and zhang) and implicit
+    # residual smoothing (smooth > 0; rk4 and roe on lwr and zhang) give up
+    # time accuracy for it. Smoothing pays only with a larger cfl (smooth 2
+    # at cfl 2 for rk4, smooth 1 at cfl 1.5 for roe), as a smoothed
+    # iteration costs about twice a plain one
+    steady = False
+    ltime = False
+    smooth = 0.
+    # (the same restriction as sweep.check_steady)
+    if (smooth > 0 and (model == 'pw' or method not in ('rk4', 'roe'))):
+        raise ValueError('residual smoothing converges rk4 and roe on lwr and zhang '
+                         'only, not %s on %s' % (method, model))
+    if (ltime and (model == 'pw' or method != 'rk4')):
+        raise ValueError('local time stepping converges rk4 on lwr and zhang '
+                         'only, not %s on %s' % (method, model))
+
+    # turn off AV model for first-order schemes and the reconstructions
+    order = get_order(method)
+    if (order == 1 or get_stages(method) is not None): avmodel = False
+
+    # -----------------------------------------------------------------------------
+    # output
+    # headless runs never load a GUI backend; every nsave-th step (or every dtsave
+    # of simulated time) is written to a memory-mapped space-time array in out
+    headless = False
+    out = 'main.npy'
+    nsave = 10
+    dtsave = None
+    # capacity of the output file; the simulated end time is not known before
+    # the run (the steps grow as the road jams), but a dtsave snapshot is
+    # taken at most once per step. The file is created sparse, so capacity
+    # left unwritten takes no disk space on most file systems
+    nsnap = (imax // nsave + 1) if (dtsave is None) else (imax + 1)
+
+    # grid points
+    (x, dx) = set_mesh()
+    # initial condition
+    u = ic()
+
+    if (headless):
+        rec = snapshot.Snapshots(out, u.shape, nsnap, nsave, dtsave,
+                                 {'xmin': xmin, 'xmax': xmax, 'nx': nx, 'model': model,
+                                  'state': state, 'method': method, 'rho0': rho0,
+                                  'fr': fr, 'cfl': cfl, 'tmax': tmax})
     else:
-        line1.set_ydata(u[0,])
-        line1.set_color(color)
-        fig.canvas.draw()
+        # live view at fps frames per second of wall time (see liveview.py)
+        import liveview
+        view = liveview.corridor(x, lambda: u, fps=25.)
+
+    # -----------------------------------------------------------------------------
+    # record the state after every step or show it
+    def draw(i, tsim, color):
+        if headless:
+            rec.write(u, i, tsim)
+        else:
+            view(i, tsim, color)
+
+    run(draw)
+
+    if (headless): rec.close()
+    else: view.close()
@@ -0,0 +1,466 @@
+import json
+import sys
+
+import numpy as np
+
+import intersection as base
+
+
+# -----------------------------------------------------------------------------
+# pack the links of a graph into one buffer and build the offset and
+# movement tables; every link holds ng ghost cells at both ends so the
+# widest stencil (TVD/AV) never reaches into a neighbouring link
+#
+# graph = {'links': [{'name': .., 'length': .., 'rho0': .., 'inflow': ..}],
+#          'nodes': [{'type': 'merge' | 'diverge' | 'signal' | 'junction',
+#                     'in': [..], 'out': [..], ...}]}
+def build(graph):
+    global names, ncell, off, first, last, ntot, up_free, dn_free, inflow, rho_ic
+    global mov_in, mov_out, mov_frac, mov_node, mov_phase
+    global node_cycle, node_green, node_offset
+    links = graph['links']
+    names = [l['name'] for l in links]
+    index = dict((name, i) for (i, name) in enumerate(names))
+    ncell = np.array([max(int(round(l['length'] / dx)), 2) for l in links])
+    off = np.concatenate([[0], np.cumsum(ncell + 2 * ng)[:-1]])
+    first = off + ng
+    last = off + ng + ncell - 1
+    ntot = int(np.sum(ncell + 2 * ng))
+    inflow = np.array([l.get('inflow', 0.) for l in links], dtype=float)
+    rho_ic = np.array([l.get('rho0', rho0) for l in links], dtype=float)
+
+    # movements (in link, out link, turning fraction, node, signal phase)
+    mov = []
+    nodes = graph['nodes']
+    for (n, node) in enumerate(nodes):
+        ins = [index[name] for name in node['in']]
+        outs = [index[name] for name in node['out']]
+        if (node['type'] == 'merge'):
+            mov += [(i, outs[0], 1., n, -1) for i in ins]
+        elif (node['type'] == 'diverge'):
+            split = node.get('split', [1. / len(outs)] * len(outs))
+            mov += [(ins[0], j, a, n, -1) for (j, a) in zip(outs, split)]
+        elif (node['type'] == 'signal'):
+            phase = node.get('phase', [i % 2 for i in range(len(ins))])
+            mov += [(i, j, 1., n, p) for (i, j, p) in zip(ins, outs, phase)]
+        elif (node['type'] == 'junction'):
+            phase = node.get('phase', [-1] * len(ins))
+            for (jj, j) in enumerate(outs):
+                for (ii, i) in enumerate(ins):
+                    a = node['turn'][jj][ii]
+                    if (a > 0): mov.append((i, j, a, n, phase[ii]))
+    (mov_in, mov_out, mov_frac, mov_node, mov_phase) = \
+        [np.array(col) for col in zip(*mov)] if mov else [np.zeros(0, int)] * 5
+    mov_in = mov_in.astype(int)
+    mov_out = mov_out.astype(int)
+    mov_frac = mov_frac.astype(float)
+    mov_node = mov_node.astype(int)
+    mov_phase = mov_phase.astype(int)
+    node_cycle = np.array([node.get('cycle', 1.) for node in nodes], dtype=float)
+    node_green = np.array([node.get('green', 1.) for node in nodes], dtype=float)
+    node_offset = np.array([node.get('offset', 0.) for node in nodes], dtype=float)
+
+    # link ends not attached to any node are open boundaries
+    up_free = np.ones(len(links), dtype=bool)
+    dn_free = np.ones(len(links), dtype=bool)
+    up_free[mov_out] = False
+    dn_free[mov_in] = False
+
+
+# -----------------------------------------------------------------------------
+# load a graph from a JSON file
+def load(path):
+    with open(path) as f:
+        build(json.load(f))
+
+
+# -----------------------------------------------------------------------------
+# Manhattan grid of one-way streets (eastbound rows, southbound columns)
+# crossing at signalized intersections
+def grid(nrow, ncol, length=200., q=.1):
+    links = []
+    nodes = []
+    for r in range(0, nrow):
+        for c in range(0, ncol + 1):
+            links.append({'name': 'e%d_%d' % (r, c), 'length': length,
+                          'inflow': q if (c == 0) else 0.})
+    for c in range(0, ncol):
+        for r in range(0, nrow + 1):
+            links.append({'name': 's%d_%d' % (r, c), 'length': length,
+                          'inflow': q if (r == 0) else 0.})
+    for r in range(0, nrow):
+        for c in range(0, ncol):
+            nodes.append({'type': 'signal',
+                          'in': ['e%d_%d' % (r, c), 's%d_%d' % (r, c)],
+                          'out': ['e%d_%d' % (r, c + 1), 's%d_%d' % (r + 1, c)],
+                          'cycle': cycle, 'green': fr,
+                          'offset': (r + c) * offset})
+    return {'links': links, 'nodes': nodes}
+
+
+# -----------------------------------------------------------------------------
+# hand the model and scheme to the whole-array kernels
+def setup():
+    for name in ('lmax', 'state', 'method', 'avmodel', 'kappa2', 'kappa4',
+                 'k', 'dx'):
+        setattr(base, name, globals()[name])
+    base.model = 'lwr'
+    base.nx = ntot
+    base.backend = 'numpy'
+
+
+# -----------------------------------------------------------------------------
+# define initial condition of all links in the packed buffer
+def ic():
+    u = np.zeros((lmax, ntot))
+    for l in range(0, len(ncell)):
+        u[0, off[l]:off[l] + ncell[l] + 2 * ng] = rho_ic[l]
+    return u
+
+
+# -----------------------------------------------------------------------------
+# fill ghost cells from the first and last cell of every link (or of the
+# links whose first and last cells are lo and hi)
+def fill(u, lo=None, hi=None):
+    if (lo is None): (lo, hi) = (first, last)
+    for g in range(0, ng):
+        u[:, lo - ng + g] = u[:, lo]
+        u[:, hi + 1 + g] = u[:, hi]
+
+
+# -----------------------------------------------------------------------------
+# closed ring of links joined end to end by merges, with the given lengths
+# and initial densities
+def ring(lengths, rho):
+    n = len(lengths)
+    links = [{'name': 'r%d' % l, 'length': lengths[l], 'rho0': rho[l]} for l in range(0, n)]
+    nodes = [{'type': 'merge', 'in': ['r%d' % l], 'out': ['r%d' % ((l + 1) % n)]}
+             for l in range(0, n)]
+    return {'links': links, 'nodes': nodes}
+
+
+# -----------------------------------------------------------------------------
+# critical density (maximum of the flux rho * v(rho))
+def rhoc():
+    return base.fd().critical()
+
+
+# -----------------------------------------------------------------------------
+# sending (demand) and receiving (supply) flow of a cell
+def demand(rho):
+    r = np.minimum(rho, rhoc())
+    return r * base.vel_vec(r)
+
+
+def supply(rho):
+    r = np.maximum(rho, rhoc())
+    return r * base.vel_vec(r)
+
+
+# -----------------------------------------------------------------------------
+# junction fluxes of all nodes at once: every movement asks for its share of
+# the upstream demand, every out link scales the movements into it down to
+# its supply, and an in link is held back by the most restrictive of its out
+# links (first in, first out); returns the flux entering and leaving every link
+def junction(u, time):
+    return movements(u[0, last], u[0, first], time)
+
+
+# -----------------------------------------------------------------------------
+# junction fluxes from the density of the last and first cell of every link
+def movements(rho_last, rho_first, time):
+    d = demand(rho_last)
+    s = supply(rho_first)
+    nl = len(ncell)
+
+    phase = ((time + node_offset) % node_cycle) >= node_green * node_cycle
+    gate = (mov_phase < 0) | (mov_phase == phase[mov_node])
+    md = d[mov_in] * mov_frac * gate
+    mtot = np.bincount(mov_out, md, minlength=nl)
+    theta = np.ones(nl)
+    np.divide(s, mtot, out=theta, where=(mtot > s))
+    fifo = np.ones(nl)
+    np.minimum.at(fifo, mov_in, theta[mov_out])
+
+    qdn = np.where(dn_free, d, np.bincount(mov_in, md, minlength=nl) * fifo)
+    qup = np.bincount(mov_out, md * fifo[mov_in], minlength=nl)
+    qup = np.where(up_free, np.minimum(inflow, s), qup)
+    return qup, qdn
+
+
+# -----------------------------------------------------------------------------
+# flux vector of the packed buffer with the junction fluxes at the link ends;
+# ends = (lo, hi, qup, qdn) instead gives the first and last cells of the
+# links held in u and fixed fluxes through their ends
+def flux(u, stage=0, lam0=None, ends=None):
+    if (ends is None): ends = (first, last) + junction(u, time)
+    (lo, hi, qup, qdn) = ends
+    fill(u, lo, hi)
+    e = base.flux_vec(u, stage, lam0)
+    e[0, lo - 1] = qup
+    e[0, hi] = qdn
+    return e
+
+
+# -----------------------------------------------------------------------------
+# solver
+def solver(u, lam0=None, ends=None):
+    if (method == 'maccormack'):
+        for stage in range(0, 2):
+            if (stage > 0): lam0 = None
+            e = flux(u, stage, lam0, ends)
+            res = base.residual_vec(u, e)
+            if (stage == 0):
+                u_old = np.copy(u)
+                u += dt * res
+            elif (stage == 1):
+                u = .5 * (u + u_old + dt * res)
+    elif (method == 'rk4'):
+        alpha = [1. / 4, 1. / 3, 1. / 2, 1.]
+        u_old = np.copy(u)
+        for stage in range(0, 4):
+            if (stage > 0): lam0 = None
+            e = flux(u, lam0=lam0, ends=ends)
+            res = base.residual_vec(u, e)
+            u = u_old + alpha[stage] * dt * res
+    elif (base.get_stages(method) is not None):
+        u_old = np.copy(u)
+        for (stage, (a, b)) in enumerate(base.get_stages(method)):
+            if (stage > 0): lam0 = None
+            e = flux(u, lam0=lam0, ends=ends)
+            res = base.residual_vec(u, e)
+            u = a * u_old + b * (u + dt * res)
+    else:
+        e = flux(u, lam0=lam0, ends=ends)
+        res = base.residual_vec(u, e)
+        u += dt * res
+    if (ends is None): fill(u)
+    else: fill(u, ends[0], ends[1])
+    return u
+
+
+# -----------------------------------------------------------------------------
+# local time step of every link: link l takes 2**level[l] steps per network
+# step dt, each within its own CFL limit and never shorter than the global
+# step; the ends of a link are synchronized at the rate of the finest link at
+# their node. Returns dt, the levels of the links and of their upstream and
+# downstream ends, and the wave speed of every link: the largest slope of
+# the flux, which in a jam is far above the vehicle speed, over its cells and
+# the end cells of the links joined to it, whose waves enter it within a step
+# (a link near the critical density is slow on its own)
+def rates(u):
+    speed = base.speed_vec(u)
+    lam = np.maximum.reduceat(speed, off)
+    np.maximum.at(lam, mov_out, speed[last[mov_in]])
+    np.maximum.at(lam, mov_in, speed[first[mov_out]])
+    h = cfl * dx / np.maximum(lam, 1e-12)
+    dt = h.min() * 2 ** min(int(np.log2(h.max() / h.min())), mmax)
+    level = np.clip(np.ceil(np.log2(dt / h) - 1e-9), 0, mmax).astype(int)
+    node = np.zeros(len(node_cycle), dtype=int)
+    np.maximum.at(node, mov_node, level[mov_in])
+    np.maximum.at(node, mov_node, level[mov_out])
+    level_up = level.copy()
+    level_dn = level.copy()
+    np.maximum.at(level_up, mov_out, node[mov_node])
+    np.maximum.at(level_dn, mov_in, node[mov_node])
+    return dt, level, level_up, level_dn, lam
+
+
+# -----------------------------------------------------------------------------
+# indices of the cells (ghosts included) of links ls in the packed buffer,
+# and the first and last cell of every one of them in the gathered array
+def cells(ls):
+    n = ncell[ls] + 2 * ng
+    start = np.cumsum(n) - n
+    idx = np.repeat(off[ls] - start, n) + np.arange(n.sum())
+    return idx, start + ng, start + ng + ncell[ls] - 1
+
+
+# -----------------------------------------------------------------------------
+# one network step with local time stepping; returns the new state and the
+# step. A link of level m advances every 2**(top - m) micro-steps with the
+# junction fluxes of its first micro-step held fixed; the junction fluxes are
+# evaluated every micro-step from the link ends (interpolated in time across
+# the step of a coarser link) and integrated at the rate of each node, and a
+# link completing its step has its end cells corrected by the difference, so
+# what leaves one link at a node enters the others
+def multirate(u, time):
+    global dt
+    (step, level, level_up, level_dn, lam) = rates(u)
+    nl = len(ncell)
+    top = level.max()
+    delta = step / 2 ** top
+    stride = 2 ** (top - level)
+    stride_up = 2 ** (top - level_up)
+    stride_dn = 2 ** (top - level_dn)
+    classes = []
+    for m in range(0, top + 1):
+        ls = np.flatnonzero(level == m)
+        if (len(ls) == nl):
+            classes.append((2 ** (top - m), ls, lam.max(), slice(None), first, last))
+        elif len(ls):
+            classes.append((2 ** (top - m), ls, lam[ls].max()) + cells(ls))
+
+    old_last = u[0, last]
+    old_first = u[0, first]
+    used_up = np.zeros(nl)
+    used_dn = np.zeros(nl)
+    sum_up = np.zeros(nl)
+    sum_dn = np.zeros(nl)
+    for s in range(0, 2 ** top + 1):
+        start = (s % stride == 0)
+        if (s > 0):
+            u[0, first[start]] += (sum_up[start] - used_up[start]) / dx
+            u[0, last[start]] -= (sum_dn[start] - used_dn[start]) / dx
+            sum_up[start] = 0.
+            sum_dn[start] = 0.
+        if (s == 2 ** top): break
+        old_last = np.where(start, u[0, last], old_last)
+        old_first = np.where(start, u[0, first], old_first)
+
+        theta = (s % stride) / stride
+        rho_last = old_last + theta * (u[0, last] - old_last)
+        rho_first = old_first + theta * (u[0, first] - old_first)
+        (qup, qdn) = movements(rho_last, rho_first, time + s * delta)
+        sum_up += np.where(s % stride_up == 0, qup * (delta * stride_up), 0.)
+        sum_dn += np.where(s % stride_dn == 0, qdn * (delta * stride_dn), 0.)
+
+        for (n, ls, lam0, idx, lo, hi) in classes:
+            if (s % n): continue
+            dt = delta * n
+            base.dt = dt
+            used_up[ls] = qup[ls] * dt
+            used_dn[ls] = qdn[ls] * dt
+            u[:, idx] = solver(u[:, idx], lam0, (lo, hi, qup[ls], qdn[ls]))
+    fill(u)
+    return u, step
+
+
+# -----------------------------------------------------------------------------
+# cell updates of one multirate step relative to a global step
+def work(u):
+    (step, level, level_up, level_dn, lam) = rates(u)
+    n = ncell + 2 * ng
+    return np.sum(n * 2 ** level) / float(np.sum(n) * 2 ** level.max())
+
+
+# -----------------------------------------------------------------------------
+# local time stepping against global steps: a copy of u takes multirate
+# steps from time 0 until it passes horizon, another one global steps to the
+# same time; returns the largest density of each and the largest difference
+# of the densities of the links
+def compare(u, horizon):
+    global time, dt
+    (ul, ug) = (np.copy(u), np.copy(u))
+    tend = 0.
+    while (tend < horizon):
+        (ul, step) = multirate(ul, tend)
+        tend += step
+    time = 0.
+    while (time < tend):
+        lam = base.speed_vec(ug).max()
+        dt = min(cfl * dx / lam, tend - time)
+        base.dt = dt
+        ug = solver(ug, lam)
+        time += dt
+    inner = np.concatenate([np.arange(first[l], last[l] + 1) for l in range(0, len(ncell))])
+    return (ul[0, inner].max(), ug[0, inner].max(), abs(ul[0, inner] - ug[0, inner]).max())
+
+
+# -----------------------------------------------------------------------------
+# regression check of local time stepping, run on purpose with python
+# network.py check: on a jammed ring of unequal links, whose levels differ,
+# multirate steps have to follow global steps to within tol over horizon;
+# returns the largest difference or raises RuntimeError. maccormack, whose
+# one-sided stages depart by .028 here, takes global steps only
+def check(tol=.02, horizon=300.):
+    if (method == 'maccormack'):
+        raise ValueError('local time stepping does not support maccormack')
+    build(ring([200, 60, 400, 100, 300, 80], [.95, .3, .95, .6, .95, .2]))
+    setup()
+    u = ic()
+    fill(u)
+    (high, low, diff) = compare(u, horizon)
+    if (diff > tol):
+        raise RuntimeError('local time stepping departs from global steps on a jammed '
+                           'ring by %.3g (largest densities %.3f and %.3f)' % (diff, high, low))
+    return diff
+
+
+# -----------------------------------------------------------------------------
+# density of link l (interior cells only)
+def link(u, l):
+    return u[0, first[l]:last[l] + 1]
+
+
+if __name__ == '__main__':
+
+    # -----------------------------------------------------------------------------
+    # parameters
+    dx = 10.  # cell length shared by all links
+    ng = 2  # ghost cells at each link end
+
+    rho0 = 0.1
+    fr = 0.5  # green fraction of the cycle
+    cycle = 60.
+    offset = 10.
+    cfl = 0.5
+    imax = 800
+    lts = True  # local time stepping (not with maccormack)
+    mmax = 4  # at most 2**mmax link steps per network step
+    k = 0.9  # for Greenshield model
+
+    # relationship between density and speed
+    # acceptable values: greenshield, greenberg, underwood
+    state = 'greenshield'
+    lmax = 1
+
+    # -----------------------------------------------------------------------------
+    # numerical methods
+    # acceptable values:
+    ## lax, lax-wendroff, maccormack (global steps only), rk4
+    ## muscl-minmod, muscl-mc, weno5
+    method = 'lax-wendroff'
+
+    avmodel = True
+    kappa2 = .2
+    kappa4 = 0.02
+
+    # turn off AV model for first-order schemes and the reconstructions
+    order = base.get_order(method)
+    if (order == 1 or base.get_stages(method) is not None): avmodel = False
+    # the stencil of WENO5 reaches three cells past a link end
+    if (method == 'weno5'): ng = 3
+    if (lts and method == 'maccormack'):
+        raise ValueError('local time stepping does not support maccormack; set lts = False')
+
+    # python network.py check: local time stepping against global steps
+    if (len(sys.argv) > 1 and sys.argv[1] == 'check'):
+        print('largest difference from global steps: %.3g' % check())
+        sys.exit(0)
+
+    # road network: a JSON graph file or a synthetic city grid
+    # load('district.json')
+    build(grid(20, 20))
+    setup()
+    u = ic()
+    fill(u)
+
+    time = 0
+    for i in range(0, imax):
+        if lts:
+            (u, step) = multirate(u, time)
+            time += step
+            continue
+        lam = base.speed_vec(u).max()
+        dt = cfl * dx / lam
+        base.dt = dt
+        u = solver(u, lam)
+        time += dt
+
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.plot(u[0])
+    ax.set_ylim(0, 1)
+    plt.show()
@@ -0,0 +1,280 @@
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import main
+import sweep
+
+
+# -----------------------------------------------------------------------------
+# cells every subdomain copies from each neighbour before a stage: the widest
+# stencil of a residual is two cells per side (TVD limiter, AV, MUSCL), three
+# for WENO5
+def get_halo(method):
+    return 3 if (method == 'weno5') else 2
+
+
+# -----------------------------------------------------------------------------
+# owned ranges [lo, hi) of n contiguous subdomains of nx cells
+def split(nx, n):
+    bounds = [nx * r // n for r in range(0, n + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# -----------------------------------------------------------------------------
+# one subdomain of the corridor, run by one worker process: the cells
+# [a, b) = [lo - halo, hi + halo) clipped to the road, of which [lo, hi) are
+# its own. The main.py of the worker is set up for the b - a cells (nx) with
+# the step dx of the whole road, so its kernels, any backend but the loop,
+# work on the subdomain as they would on the road. main.maxlam is replaced
+# by exchange(): it is called before the step size and before every further
+# stage of a step, which is exactly when the halos are needed. An exchange
+# writes the own cells to one of two shared copies of the road, waits for
+# all workers and reads the halos back from it; the copies alternate, so a
+# worker still reading one is never overwritten. Step sizes and residual
+# norms are maxima over the workers, taken through a shared slot per worker,
+# so every worker follows the same steps as a single process
+class Subdomain(object):
+
+    def __init__(self, rank, bounds, config, names, barrier):
+        param = dict(sweep.defaults)
+        param.update(config)
+        (self.rank, self.barrier) = (rank, barrier)
+        (self.nx, n) = (param['nx'], len(bounds))
+        (self.lo, self.hi) = bounds[rank]
+        halo = get_halo(param['method'])
+        (self.a, self.b) = (max(self.lo - halo, 0), min(self.hi + halo, self.nx))
+        self.own = slice(self.lo - self.a, self.hi - self.a)
+        dtype = np.dtype(param['dtype'])
+        self.shm = [shared_memory.SharedMemory(name) for name in names]
+        lmax = 1 if (param['model'] == 'lwr') else 2
+        self.road = np.ndarray((2, lmax, self.nx), dtype, self.shm[0].buf)
+        self.slot = np.ndarray((2, n), dtype, self.shm[1].buf)
+        self.parity = 0
+
+        # main.py for the subdomain
+        for (name, value) in param.items():
+            setattr(main, name, value)
+        main.lmax = lmax
+        if (not sweep.needs_av(main.method)): main.avmodel = False
+        main.dx = (main.xmax - main.xmin) / (self.nx - 1.)
+        main.nx = self.b - self.a
+        main.u = main.ic()
+        self.maxlam = main.maxlam
+        main.maxlam = self.exchange
+
+    # maximum of every worker's value
+    def reduce(self, value):
+        p = self.parity
+        self.slot[p, self.rank] = value
+        self.barrier.wait()
+        self.parity = 1 - p
+        return self.slot[p].max()
+
+    # publish the own cells of u, fill its halos in place and return the
+    # largest eigenvalue of the road
+    def exchange(self, u):
+        (p, lo, hi) = (self.parity, self.lo, self.hi)
+        self.road[p, :, lo:hi] = u[:, self.own]
+        lam = self.reduce(self.maxlam(u[:, self.own]))
+        u[:, :lo - self.a] = self.road[p, :, self.a:lo]
+        u[:, hi - self.a:] = self.road[p, :, hi:self.b]
+        return lam
+
+    # largest own density residual away from the cells set by the
+    # boundary conditions
+    def resnorm(self, res):
+        r = abs(res[0, self.own])
+        for i in (0, self.nx // 2, self.nx - 1):
+            if (self.lo <= i < self.hi): r[i - self.lo] = 0.
+        return self.reduce(r.max())
+
+    # main.bc on the own cells; the streamed signal is read only by the
+    # worker of the signal cell and the inflow only by the first one
+    def bc(self, time, tsim=0.):
+        (u, j, a) = (main.u, self.nx // 2, self.a)
+        if (self.lo <= j < self.hi):
+            if (main.signal is None):
+                red = time < main.tmax * main.fr
+            else:
+                red = main.signal(tsim) > .5
+            u[0, j - a] = 1. if red else main.rho0
+            if (main.model == 'pw'):
+                u[1, j - a] = u[0, j - a] * main.vel(u[0, j - a])
+            elif (main.model == 'zhang'):
+                u[1, j - a] = 0.
+        if (self.lo == 0):
+            u[:, 0] = u[:, 1]
+            if (main.inflow is not None):
+                u[0, 0] = main.inflow(tsim)
+                if (main.model == 'pw'):
+                    u[1, 0] = u[0, 0] * main.vel(u[0, 0])
+                elif (main.model == 'zhang'):
+                    u[1, 0] = 0.
+        if (self.hi == self.nx): u[:, -1] = u[:, -2]
+
+    # time loop of main.run; ends with the own cells in the next copy of
+    # the road, whose index is returned with the simulated time and the
+    # residual history
+    def run(self):
+        time = 0
+        tsim = 0
+        history = []
+        if main.steady: self.bc(time)
+        for i in range(0, main.imax):
+            main.dt = main.step()
+            main.solver()
+            maxres = self.resnorm(main.res)
+            history.append(maxres)
+            time += main.dt
+            tsim += main.dt
+            self.bc(time, tsim)
+
+            if time > main.tmax: time = 0
+
+            if (main.steady and maxres < main.eps): break
+        self.road[self.parity, :, self.lo:self.hi] = main.u[:, self.own]
+        return (self.parity, tsim, np.array(history))
+
+    def close(self):
+        for shm in self.shm:
+            shm.close()
+
+
+# -----------------------------------------------------------------------------
+# body of a worker process; every worker reports once on the queue, rank 0
+# with the result, and a failing worker breaks the barrier so that the
+# others stop as well
+def work(rank, bounds, config, names, barrier, results):
+    sub = None
+    try:
+        sub = Subdomain(rank, bounds, config, names, barrier)
+        t0 = time.perf_counter()
+        with np.errstate(all='ignore'):
+            out = sub.run()
+        wall = time.perf_counter() - t0
+        results.put((rank, None, out + (wall,) if (rank == 0) else None))
+    except Exception as err:
+        barrier.abort()
+        results.put((rank, '%s: %s' % (type(err).__name__, err), None))
+    finally:
+        if (sub is not None): sub.close()
+
+
+# -----------------------------------------------------------------------------
+# run the corridor of a configuration (see sweep.defaults) split over
+# workers processes; returns the final state, the simulated time, the
+# residual history and the wall time of the time loop. The streamed forcing
+# is that of the configuration or else main.inflow and main.signal; the
+# workers get copies, which must pickle where processes are spawned.
+# Beam-warming and residual smoothing solve along the whole road and cannot
+# be split
+def solve(config=None, workers=None, **params):
+    param = dict(sweep.defaults, inflow=main.inflow, signal=main.signal)
+    param.update(config or {})
+    param.update(params)
+    if (workers is None): workers = os.cpu_count()
+    if (param['method'] == 'beam-warming' or param['smooth'] > 0):
+        raise ValueError('beam-warming and residual smoothing are implicit along '
+                         'the whole road and cannot be decomposed')
+    sweep.check_steady(param)
+    if (param['backend'] == 'loop'):
+        raise ValueError('the loop backend cannot be decomposed')
+    if (param['nx'] // workers < get_halo(param['method'])):
+        raise ValueError('%d cells cannot be split over %d workers' % (param['nx'], workers))
+
+    lmax = 1 if (param['model'] == 'lwr') else 2
+    itemsize = np.dtype(param['dtype']).itemsize
+    shm = [shared_memory.SharedMemory(create=True, size=2 * lmax * param['nx'] * itemsize),
+           shared_memory.SharedMemory(create=True, size=2 * workers * itemsize)]
+    names = [s.name for s in shm]
+    bounds = split(param['nx'], workers)
+    ctx = multiprocessing.get_context()
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=work, args=(rank, bounds, param, names, barrier, results))
+             for rank in range(0, workers)]
+    try:
+        for p in procs:
+            p.start()
+        (reports, errors) = ({}, [])
+        while (len(reports) < workers):
+            try:
+                (rank, error, out) = results.get(timeout=1.)
+            except queue.Empty:
+                lost = [r for (r, p) in enumerate(procs) if (r not in reports and
+                                                             not p.is_alive())]
+                if lost:
+                    barrier.abort()
+                    raise RuntimeError('worker %d exited without a result' % lost[0])
+                continue
+            reports[rank] = out
+            if (error is not None): errors.append('worker %d: %s' % (rank, error))
+        for p in procs:
+            p.join()
+        if errors: raise RuntimeError('; '.join(errors))
+        (parity, tsim, history, wall) = reports[0]
+        road = np.ndarray((2, lmax, param['nx']), param['dtype'], shm[0].buf)
+        u = np.array(road[parity])
+        del road
+        return (u, tsim, history, wall)
+    finally:
+        for p in procs:
+            if p.is_alive(): p.terminate()
+        for s in shm:
+            s.close()
+            s.unlink()
+
+
+# -----------------------------------------------------------------------------
+# the same configuration in this process with main.run; returns what solve
+# returns
+def serial(config=None, **params):
+    sweep.setup(dict(config or {}, **params))
+    t0 = time.perf_counter()
+    with np.errstate(all='ignore'):
+        tsim = main.run()
+    wall = time.perf_counter() - t0
+    return (main.u, tsim, np.array(main.history), wall)
+
+
+# -----------------------------------------------------------------------------
+# strong scaling: the wall time of the time loop of one configuration for
+# every number of workers, its speedup and parallel efficiency over a
+# single process, and whether the state and residual history are
+# bit-identical to it
+def scaling(config=None, workers=(1, 2, 4, 8), **params):
+    (u, tsim, history, wall) = serial(config, **params)
+    rows = []
+    for n in workers:
+        (un, tn, hn, walln) = solve(config, n, **params)
+        rows.append({'workers': n, 'wall': walln, 'speedup': wall / walln,
+                     'efficiency': wall / walln / n,
+                     'identical': bool(np.array_equal(u, un, equal_nan=True) and tn == tsim
+                                       and np.array_equal(history, hn, equal_nan=True))})
+    return (wall, rows)
+
+
+if __name__ == '__main__':
+
+    # strong scaling of one corridor:
+    # python parallel.py [nx] [method] [model] [steps]
+    nx = int(float(sys.argv[1])) if (len(sys.argv) > 1) else 10 ** 6
+    method = sys.argv[2] if (len(sys.argv) > 2) else 'tvd-superbee'
+    model = sys.argv[3] if (len(sys.argv) > 3) else 'zhang'
+    steps = int(sys.argv[4]) if (len(sys.argv) > 4) else 20
+    counts = [n for n in (1, 2, 4, 8, 16, 32) if (n <= max(os.cpu_count(), 2))]
+    (wall, rows) = scaling({'nx': nx, 'method': method, 'model': model, 'imax': steps},
+                           counts)
+    print('%d cells, %s, %s, %d steps on %d cores: one process %.3f s'
+          % (nx, model, method, steps, os.cpu_count(), wall))
+    for r in rows:
+        print('%3d workers %9.3f s  speedup %6.2f  efficiency %5.2f  %s'
+              % (r['workers'], r['wall'], r['speedup'], r['efficiency'],
+                 'bit-identical' if r['identical'] else 'DIFFERENT'))
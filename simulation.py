@@ -0,0 +1,230 @@
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import main
+import sweep
+
+
+# -----------------------------------------------------------------------------
+# the corridor of main.py as an object: the parameters (those of
+# sweep.defaults) and the state, flux, residual and stage arrays belong to the
+# instance, so independent simulations can share a process or run in threads.
+# The steps call the whole-array kernels of main.py with the instance as
+# their parameters, which update the arrays allocated here in place and keep
+# their scratch arrays in work from the first step on; apart from the
+# block-tridiagonal solve of beam-warming and the masks of the Greenberg
+# diagram a step allocates no memory. The backend parameter is ignored: the
+# kernels are numpy's. All arrays have the type of the dtype parameter; step
+# sizes, times and the residual history are float64
+class Simulation(object):
+
+    def __init__(self, config=None, **params):
+        param = dict(sweep.defaults)
+        param.update(config or {})
+        param.update(params)
+        for (name, value) in param.items():
+            setattr(self, name, value)
+        self.lmax = 1 if (self.model == 'lwr') else 2
+        self.law = None  # fundamental diagram, see main.fd
+        self.work = {}  # scratch arrays of the kernels, see main.scratch
+        if (not sweep.needs_av(self.method)): self.avmodel = False
+        if (self.model == 'lwr' and
+                self.method in ('steger-warming', 'roe', 'tvd-superbee', 'tvd-vanleer')):
+            raise ValueError('%s needs the 2x2 system of pw or zhang' % self.method)
+        if (main.get_stages(self.method) is not None):
+            raise ValueError('the reconstruction of %s runs in main.py only' % self.method)
+        sweep.check_steady(param)
+
+        (l, n, dtype) = (self.lmax, self.nx, self.dtype)
+        self.dx = (self.xmax - self.xmin) / (n - 1.)
+        self.x = np.linspace(self.xmin, self.xmax, n)
+        self.old = np.empty((l, n), dtype)  # state at the start of a multi-stage step
+        self.e = np.empty((l, n - 1), dtype)  # flux at the interfaces
+        self.res = np.zeros((l, n), dtype)  # residual
+        self.lam = np.empty(n, dtype)  # spectral radius at the grid points
+        self.tau = np.empty(n, dtype)  # local time steps
+        self.g = np.empty((l, n), dtype)  # scratch of the state's shape
+        self.w = np.empty(n, dtype)  # scratch of a grid line
+        self.u = self.ic()
+        self.history = np.zeros(self.imax)  # residual norm of every step
+        self.steps = 0
+        self.dt = 0.
+        self.lam0 = 0.
+        self.maxres = np.nan
+
+    # initial condition
+    def ic(self):
+        u = np.ones((self.lmax, self.nx), dtype=self.dtype)
+        u[0, :] *= self.rho0
+        if (self.model == 'pw'):
+            u[1, :] *= self.rho0 * main.vel_vec(self.rho0, p=self)
+        elif (self.model == 'zhang'):
+            u[1, :] *= 0.
+        return u
+
+    # largest spectral radius of the Jacobi matrices
+    def maxlam(self):
+        return main.lam_vec(self.u, self.lam, self).max()
+
+    # flux vector at all interfaces
+    def flux(self, stage=0):
+        return main.flux_vec(self.u, stage, self.lam0, self.e, self)
+
+    # residual at all grid points, smoothed if smooth > 0
+    def residual(self):
+        main.residual_vec(self.u, self.e, self.res, self)
+        if (self.smooth > 0): main.smoothing(self.res, self)
+        return self.res
+
+    # largest density residual away from the cells set by the boundary conditions
+    def resnorm(self):
+        return main.resnorm(self.res, self)
+
+    # step size, and the local steps of ltime in tau
+    def step(self):
+        self.lam0 = self.maxlam()
+        self.dt = self.cfl * self.dx / float(self.lam0)
+        if (self.ltime):
+            (lam, g) = (main.speed_vec(self.u, self.lam, self), self.w[:self.nx - 2])
+            np.maximum(lam[:-2], lam[1:-1], out=g)
+            np.maximum(g, lam[2:], out=g)
+            lam[1:-1] = g
+            np.maximum(lam, .01 * self.lam0, out=self.tau)
+            np.divide(self.cfl * self.dx, self.tau, out=self.tau)
+        return self.dt
+
+    # u = base + c * tau * res, tau the global or the local steps
+    def update(self, base, c):
+        g = self.g
+        if (self.ltime):
+            np.multiply(self.tau, c, out=self.w)
+            np.multiply(self.w, self.res, out=g)
+        else:
+            np.multiply(self.res, c * self.dt, out=g)
+        np.add(base, g, out=self.u)
+
+    # advance the state by one step of the scheme
+    def solver(self):
+        u = self.u
+        if (self.method == 'maccormack'):
+            self.flux(0)
+            self.residual()
+            self.old[:] = u
+            self.update(u, 1.)
+            self.lam0 = self.maxlam()
+            self.flux(1)
+            self.residual()
+            # u = .5 * (u + u_old + dt * res)
+            g = self.g
+            np.multiply(self.res, self.dt, out=g)
+            u += self.old
+            u += g
+            u *= .5
+        elif (self.method == 'rk4'):
+            alpha = [1. / 4, 1. / 3, 1. / 2, 1.]
+            self.old[:] = u
+            for stage in range(0, 4):
+                if (stage > 0): self.lam0 = self.maxlam()
+                self.flux()
+                self.residual()
+                self.update(self.old, alpha[stage])
+        elif (self.method == 'beam-warming'):
+            self.flux()
+            self.residual()
+            u += main.bw_vec(u, self.res, self)
+        else:
+            self.flux()
+            self.residual()
+            self.update(u, 1.)
+
+    # signal at the middle of the road and outflow boundaries
+    def bc(self, time):
+        (u, j) = (self.u, self.nx // 2)
+        color = 'r' if (time < self.tmax * self.fr) else 'g'
+        u[0, j] = 1. if (color == 'r') else self.rho0
+        if (self.model == 'pw'):
+            main.vel_vec(u[0, j:j + 1], u[1, j:j + 1], self)
+            u[1, j] *= u[0, j]
+        elif (self.model == 'zhang'):
+            u[1, j] = 0.
+        u[:, 0] = u[:, 1]
+        u[:, -1] = u[:, -2]
+        return color
+
+    # one time step: step size, solver and residual norm
+    def advance(self):
+        self.step()
+        self.solver()
+        self.maxres = self.resnorm()
+        return self.maxres
+
+    # time loop, as main.run; history[:steps] holds the residual norms
+    def run(self, monitor=None):
+        time = 0
+        tsim = 0
+        self.steps = 0
+        if (self.steady): self.bc(time)
+        for i in range(0, self.imax):
+            maxres = self.advance()
+            self.history[i] = maxres
+            self.steps = i + 1
+            time += self.dt
+            tsim += self.dt
+            color = self.bc(time)
+
+            if (time > self.tmax): time = 0
+
+            if (monitor is not None): monitor(i, tsim, color)
+            if (self.steady and maxres < self.eps): break
+        return tsim
+
+
+# -----------------------------------------------------------------------------
+# deviation of a reduced-precision run from the float64 reference of the same
+# configuration after the same number of steps: the largest absolute
+# deviation of every variable, that of the density relative to its largest
+# value, and the drift of the density sum and of the simulated time; ok if
+# the relative deviation stays within tol
+def accuracy(config=None, dtype='float32', tol=1e-3, **params):
+    runs = []
+    for t in ('float64', dtype):
+        sim = Simulation(config, **dict(params, dtype=t))
+        with np.errstate(all='ignore'):
+            tsim = sim.run()
+        runs.append((sim, tsim))
+    ((ref, tref), (low, tlow)) = runs
+    dev = abs(low.u.astype(np.float64) - ref.u)
+    scale = max(abs(ref.u[0]).max(), np.finfo(float).tiny)
+    mass = np.sum(ref.u[0], dtype=np.float64)
+    reldev = float(dev[0].max() / scale)
+    return {'dtype': dtype, 'steps': low.steps, 'ref_steps': ref.steps,
+            'maxdev': dev.max(axis=-1).tolist(), 'reldev': reldev,
+            'mass': float(abs(np.sum(low.u[0], dtype=np.float64) - mass) / abs(mass)),
+            'time': abs(tlow - tref), 'bytes': low.u.nbytes, 'ref_bytes': ref.u.nbytes,
+            'ok': bool(reldev <= tol)}
+
+
+if __name__ == '__main__':
+
+    # independent corridors in threads, one per relationship between density
+    # and speed, and for another dtype their deviation from float64:
+    # python simulation.py [model] [method] [dtype]
+    model = sys.argv[1] if (len(sys.argv) > 1) else 'lwr'
+    method = sys.argv[2] if (len(sys.argv) > 2) else 'lax-wendroff'
+    dtype = sys.argv[3] if (len(sys.argv) > 3) else 'float64'
+    states = ('greenshield', 'greenberg', 'underwood')
+    sims = [Simulation(model=model, state=state, method=method, dtype=dtype)
+            for state in states]
+    with ThreadPoolExecutor() as pool:
+        times = list(pool.map(Simulation.run, sims))
+    for (sim, tsim) in zip(sims, times):
+        print('%-12s t = %8.3f  max rho = %.4f' % (sim.state, tsim, sim.u[0].max()))
+    if (np.dtype(dtype) != np.float64):
+        for state in states:
+            r = accuracy(model=model, state=state, method=method, dtype=dtype)
+            print('%-12s %s: max deviation %.2e (relative %.2e), mass drift %.2e, '
+                  'time %.2e, %s' % (state, dtype, max(r['maxdev']), r['reldev'],
+                                     r['mass'], r['time'], 'ok' if r['ok'] else 'NOT ok'))
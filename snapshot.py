@@ -0,0 +1,114 @@
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import diagram
+
+
+# -----------------------------------------------------------------------------
+# decimated space-time record of a run in a preallocated memory-mapped .npy
+# file; a snapshot is taken every nsave steps or, if dtsave is given, every
+# dtsave of simulated time, and run parameters go to a small JSON sidecar; a
+# diagram instance as state is saved by its description
+class Snapshots(object):
+
+    def __init__(self, path, shape, nsnap, nsave=1, dtsave=None, meta=None):
+        self.path = path
+        self.nsave = nsave
+        self.dtsave = dtsave
+        self.meta = dict(meta or {})
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                              shape=(nsnap,) + tuple(shape))
+        self.times = np.zeros(nsnap)
+        self.steps = np.zeros(nsnap, dtype=int)
+        self.count = 0
+        self.tnext = 0.
+
+    def write(self, u, i, time):
+        if (self.count == len(self.data)): return False
+        if (self.dtsave is None):
+            if (i % self.nsave): return False
+        else:
+            if (time < self.tnext): return False
+            while (self.tnext <= time): self.tnext += self.dtsave
+        self.data[self.count] = u
+        self.times[self.count] = time
+        self.steps[self.count] = i
+        self.count += 1
+        return True
+
+    def close(self):
+        self.data.flush()
+        meta = dict(self.meta)
+        meta['count'] = self.count
+        meta['shape'] = list(self.data.shape[1:])
+        meta['times'] = self.times[:self.count].tolist()
+        meta['steps'] = self.steps[:self.count].tolist()
+        if isinstance(meta.get('state'), diagram.Diagram): meta['state'] = meta['state'].describe()
+        with open(sidecar(self.path), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+
+# -----------------------------------------------------------------------------
+# name of the metadata sidecar of a snapshot file
+def sidecar(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+# -----------------------------------------------------------------------------
+# open a snapshot file read-only; returns the written snapshots and metadata
+def load(path):
+    with open(sidecar(path)) as f:
+        meta = json.load(f)
+    data = np.load(path, mmap_mode='r')
+    return data[:meta['count']], meta
+
+
+# -----------------------------------------------------------------------------
+# round trip of a record whose state is a diagram instance, run on purpose
+# with python snapshot.py check: the sidecar has to hold the description of
+# the diagram, from which diagram.get builds the same speeds again; raises
+# RuntimeError otherwise
+def check():
+    fd = diagram.Curve([0., .3, .6, 1.], [1., .8, .3, 0.]).table(65)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'check.npy')
+        snap = Snapshots(path, (1, 8), 2, meta={'state': fd, 'nx': 8})
+        snap.write(np.ones((1, 8)), 0, 0.)
+        snap.close()
+        (data, meta) = load(path)
+    rho = np.linspace(0, 1, 101)
+    if (meta['state'] != fd.describe() or len(data) != 1 or
+            not np.array_equal(diagram.get(meta['state']).v(rho), fd.v(rho))):
+        raise RuntimeError('the sidecar does not describe the diagram %s: %s'
+                           % (fd.describe(), meta['state']))
+    return meta['state']
+
+
+if __name__ == '__main__':
+
+    # python snapshot.py check: a diagram as state through the sidecar
+    if (len(sys.argv) > 1 and sys.argv[1] == 'check'):
+        print('diagram saved as %s' % json.dumps(check()))
+        sys.exit(0)
+
+    # offline space-time plot of the density: python snapshot.py run.npy
+    import matplotlib.pyplot as plt
+
+    (data, meta) = load(sys.argv[1])
+    rho = data.reshape((len(data), -1) + data.shape[-2:])[:, :, 0, :]
+    t = np.array(meta['times'])
+    xmin = meta.get('xmin', 0)
+    xmax = meta.get('xmax', rho.shape[-1] - 1)
+
+    fig = plt.figure()
+    for a in range(0, rho.shape[1]):
+        ax = fig.add_subplot(1, rho.shape[1], a + 1)
+        ax.imshow(rho[:, a, :], origin='lower', aspect='auto', vmin=0, vmax=1,
+                  cmap=plt.cm.RdBu, extent=[xmin, xmax, t[0], t[-1]])
+        ax.set_xlabel('x')
+        if (a == 0): ax.set_ylabel('t')
+    plt.show()
@@ -0,0 +1,162 @@
+import csv
+import itertools
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import main
+
+# -----------------------------------------------------------------------------
+# parameters of main.py used where a configuration does not set them
+defaults = {'xmin': 0, 'xmax': 200, 'nx': 151,
+            'rho0': 0.3, 'fr': 0.5, 'cfl': 0.5, 'imax': 800, 'eps': 1e-5,
+            'tmax': 50, 'k': 0.9, 'c0': 0.5,
+            'model': 'lwr', 'state': 'greenshield', 'method': 'lax-wendroff',
+            'avmodel': True, 'kappa2': .2, 'kappa4': 0.02, 'backend': 'numpy',
+            'steady': False, 'ltime': False, 'smooth': 0., 'dtype': 'float64'}
+
+# scalar outputs recorded for every run
+outputs = ['status', 'wall', 'steps', 'time', 'maxrho', 'throughput', 'maxres', 'error']
+
+# a run whose state leaves [-blowup, blowup] counts as diverged
+blowup = 1e3
+
+
+# -----------------------------------------------------------------------------
+# all combinations of the given parameter values, e.g.
+# grid(model=['lwr', 'pw'], rho0=[.2, .3])
+def grid(**axes):
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[axes[name] for name in names])]
+
+
+# -----------------------------------------------------------------------------
+# whether a scheme runs with the AV model when a configuration asks for it:
+# the first-order schemes need none and the limited reconstructions would
+# lose their order with it (the same for main.py and intersection.py)
+def needs_av(method):
+    return main.get_order(method) > 1 and main.get_stages(method) is None
+
+
+# -----------------------------------------------------------------------------
+# the steady-state accelerations are allowed where they converge: local
+# pseudo-time steps (ltime) for rk4 on lwr and zhang, residual smoothing for
+# rk4 and roe on lwr and zhang. The local steps are not consistent in time:
+# the queue front that runs upstream from the signal crosses cells of
+# different steps and overshoots past 1 / k, where the speed turns negative.
+# rk4 damps it on lwr and zhang; the first-order upwind schemes and pw, whose
+# jam breaks the subcharacteristic condition rho |V'| <= c0, lock into a
+# limit cycle, and residual smoothing stalls them the same way
+def check_steady(param):
+    (model, method) = (param['model'], param['method'])
+    if (param['smooth'] > 0 and (model == 'pw' or method not in ('rk4', 'roe'))):
+        raise ValueError('residual smoothing converges rk4 and roe on lwr and zhang '
+                         'only, not %s on %s' % (method, model))
+    if (param['ltime'] and (model == 'pw' or method != 'rk4')):
+        raise ValueError('local time stepping converges rk4 on lwr and zhang '
+                         'only, not %s on %s' % (method, model))
+
+
+# -----------------------------------------------------------------------------
+# set the parameters of main.py from a configuration and build the mesh and
+# initial condition, as its __main__ block does
+def setup(config):
+    param = dict(defaults)
+    param.update(config)
+    check_steady(param)
+    for (name, value) in param.items():
+        setattr(main, name, value)
+    main.lmax = 1 if (main.model == 'lwr') else 2
+    if (not needs_av(main.method)): main.avmodel = False
+    (main.x, main.dx) = main.set_mesh()
+    main.u = main.ic()
+
+
+# -----------------------------------------------------------------------------
+# run one configuration of the corridor in main.py; a run that raises or
+# blows up is recorded, not propagated
+def run(config):
+    out = {'status': 'ok', 'wall': 0., 'steps': 0, 'time': 0.,
+           'maxrho': np.nan, 'throughput': 0., 'maxres': np.nan, 'error': ''}
+    t0 = time.perf_counter()
+    try:
+        setup(config)
+
+        def monitor(i, tsim, color):
+            out['steps'] = i + 1
+            out['time'] = float(tsim)
+            # vehicles leaving through the downstream boundary
+            out['throughput'] += main.dt * main.ee_vec(main.u[:, -1:])[0, 0]
+            if not (np.max(abs(main.u)) <= blowup):
+                raise FloatingPointError('state blew up at step %d' % (i + 1))
+
+        with np.errstate(all='ignore'):
+            main.run(monitor)
+    except FloatingPointError as err:
+        out['status'] = 'diverged'
+        out['error'] = str(err)
+    except Exception as err:
+        out['status'] = 'failed'
+        out['error'] = '%s: %s' % (type(err).__name__, err)
+    out['wall'] = time.perf_counter() - t0
+    if (out['status'] == 'ok'):
+        out['maxrho'] = float(np.max(main.u[0]))
+        out['maxres'] = float(main.maxres)
+    out['throughput'] = float(out['throughput'])
+    return out
+
+
+# -----------------------------------------------------------------------------
+# fan the configurations out over a process pool; returns one column per
+# parameter and output, in the order of configs
+def sweep(configs, workers=None, chunksize=None):
+    if (workers is None): workers = os.cpu_count()
+    if (chunksize is None): chunksize = max(1, len(configs) // (4 * workers))
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(run, configs, chunksize=chunksize))
+    return table(configs, results)
+
+
+# -----------------------------------------------------------------------------
+# columnar table from the configurations and their outputs
+def table(configs, results):
+    names = []
+    for config in configs:
+        names += [name for name in config if name not in names]
+    columns = {}
+    for name in names:
+        columns[name] = np.array([config.get(name, defaults.get(name)) for config in configs])
+    for name in outputs:
+        columns[name] = np.array([result[name] for result in results])
+    return columns
+
+
+# -----------------------------------------------------------------------------
+# write a table as CSV
+def write(columns, path):
+    names = list(columns)
+    with open(path, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(names)
+        for row in zip(*[columns[name] for name in names]):
+            w.writerow(row)
+
+
+if __name__ == '__main__':
+
+    configs = grid(model=['lwr', 'pw', 'zhang'],
+                   method=['lax', 'lax-wendroff', 'maccormack', 'rk4', 'roe', 'tvd-superbee'],
+                   rho0=[.2, .3, .4],
+                   imax=[200])
+
+    columns = sweep(configs)
+    write(columns, 'sweep.csv')
+
+    names = list(columns)
+    print(' '.join('%12s' % name[:12] for name in names[:-1]))
+    for row in zip(*[columns[name] for name in names[:-1]]):
+        print(' '.join('%12s' % (('%.4g' % v) if isinstance(v, float) else str(v))[:12] for v in row))
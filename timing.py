@@ -0,0 +1,202 @@
+import json
+import math
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import intersection
+import sweep
+
+# parameters of intersection.py used where a configuration does not set them
+defaults = dict(sweep.defaults, xmin=-100, xmax=100, fr=.3, imax=10 ** 7)
+
+# ranges searched: cycle length, share of the cycle in red for the arms of
+# intersection.groups[0], and offset of the cycle start as a share of it
+bounds = {'cycle': (10., 100.), 'split': (.2, .8), 'offset': (0., 1.)}
+
+# resolution plans are rounded to, so that nearby samples share cache entries
+resolution = {'cycle': 1., 'split': .01, 'offset': .01}
+
+
+# -----------------------------------------------------------------------------
+# fixed-time signal plan, used as intersection.signal: red for the first
+# split of every cycle, the cycles starting offset * cycle before time 0
+class Plan(object):
+
+    def __init__(self, cycle, split, offset=0.):
+        (self.cycle, self.split, self.offset) = (cycle, split, offset)
+
+    def __call__(self, time):
+        return 1. if ((time / self.cycle + self.offset) % 1. < self.split) else 0.
+
+    def key(self):
+        return (self.cycle, self.split, self.offset)
+
+
+class Horizon(Exception):
+    pass
+
+
+# -----------------------------------------------------------------------------
+# run the intersection of a configuration under a plan until time horizon;
+# returns the time after every step and the cumulative total delay (vehicle
+# time lost against the free-flow speed, over all arms) and throughput
+# (vehicles leaving the downstream ends of the arms)
+def evaluate(task):
+    (config, key, horizon) = task
+    param = dict(defaults)
+    param.update(config)
+    for (name, value) in param.items():
+        setattr(intersection, name, value)
+    intersection.lmax = 1 if (intersection.model == 'lwr') else 2
+    if (not sweep.needs_av(intersection.method)): intersection.avmodel = False
+    (intersection.x, intersection.dx) = intersection.set_mesh()
+    intersection.u = np.stack([intersection.ic() for a in range(0, 4)])
+    intersection.signal = Plan(*key)
+    intersection.inflow = None
+    vfree = float(intersection.vel_vec(np.zeros(1))[0])
+    out = {'time': [], 'delay': [], 'throughput': []}
+    (delay, throughput) = (0., 0.)
+
+    def monitor(i, time, color):
+        nonlocal delay, throughput
+        (u, dt, dx) = (intersection.u, intersection.dt, intersection.dx)
+        q = intersection.ee_vec(u)[:, 0]
+        delay += dt * dx * float(np.sum(u[:, 0] - q / vfree))
+        throughput += dt * float(np.sum(q[:, -1]))
+        out['time'].append(float(time))
+        out['delay'].append(delay)
+        out['throughput'].append(throughput)
+        if (time >= horizon): raise Horizon
+
+    try:
+        with np.errstate(all='ignore'):
+            intersection.run(monitor)
+    except Horizon:
+        pass
+    return out
+
+
+# -----------------------------------------------------------------------------
+# canonical form of the parameters a configuration runs with, its defaults
+# filled in: JSON with sorted names, values JSON cannot hold by their repr
+def canonical(config):
+    param = dict(defaults)
+    param.update(config)
+    return json.dumps(param, sort_keys=True, default=repr)
+
+
+# -----------------------------------------------------------------------------
+# evaluations of plans, by (canonical configuration, plan key): the
+# cumulative curves of the longest run so far, which answer every shorter
+# horizon too; kept in a JSON file if a path is given. Entries of another
+# configuration, or of a file without one, are never returned
+class Cache(object):
+
+    def __init__(self, path=None):
+        self.path = path
+        self.runs = {}
+        self.hits = 0
+        if (path is not None and os.path.exists(path)):
+            with open(path) as f:
+                self.runs = dict(((r.get('config'), tuple(r['plan'])), r['run'])
+                                 for r in json.load(f))
+
+    def get(self, key, horizon):
+        run = self.runs.get(key)
+        if (run is None or not run['time'] or run['time'][-1] < horizon): return None
+        self.hits += 1
+        return run
+
+    def put(self, key, run):
+        self.runs[key] = run
+
+    def save(self):
+        if (self.path is None): return
+        with open(self.path, 'w') as f:
+            json.dump([{'config': key[0], 'plan': list(key[1]), 'run': run}
+                       for (key, run) in self.runs.items()], f)
+
+
+# -----------------------------------------------------------------------------
+# objective of a run at time horizon, lower is better: the total delay or
+# the negated throughput, interpolated between the steps around horizon
+def score(run, horizon, objective='delay'):
+    value = float(np.interp(horizon, run['time'], run[objective]))
+    return value if (objective == 'delay') else -value
+
+
+# -----------------------------------------------------------------------------
+# n plans drawn uniformly from bounds and rounded to resolution
+def sample(n, rng):
+    plans = set()
+    while (len(plans) < n):
+        key = []
+        for name in ('cycle', 'split', 'offset'):
+            (lo, hi) = bounds[name]
+            step = resolution[name]
+            key.append(round(round(rng.uniform(lo, hi) / step) * step, 10))
+        plans.add(tuple(key))
+    return sorted(plans)
+
+
+# -----------------------------------------------------------------------------
+# successive halving: every round evaluates the remaining plans up to a
+# partial horizon on the worker pool (plans in the cache far enough are not
+# run again), keeps the best 1 / eta of them and multiplies the horizon by
+# eta, until the full horizon. Returns the plans by increasing score at the
+# last horizon each reached, with the rounds they survived
+def optimize(config=None, n=27, eta=3, horizon=300., objective='delay', plans=None,
+             workers=None, cache=None, seed=0):
+    config = dict(config or {})
+    name = canonical(config)
+    if (plans is None): plans = sample(n, np.random.default_rng(seed))
+    if (cache is None): cache = Cache()
+    levels = int(math.ceil(math.log(len(plans)) / math.log(eta) - 1e-9)) + 1
+    budget = horizon / eta ** (levels - 1)
+    ranked = {}
+    with ProcessPoolExecutor(workers) as pool:
+        rnd = 0
+        while True:
+            todo = [key for key in plans if (cache.get((name, key), budget) is None)]
+            tasks = [(config, key, budget) for key in todo]
+            for (key, run) in zip(todo, pool.map(evaluate, tasks)):
+                cache.put((name, key), run)
+            scores = [score(cache.runs[(name, key)], budget, objective) for key in plans]
+            order = np.argsort(scores, kind='stable')
+            for i in order:
+                ranked[plans[i]] = {'plan': plans[i], 'score': scores[i],
+                                    'horizon': budget, 'rounds': rnd + 1}
+            if (len(plans) == 1 or budget >= horizon): break
+            plans = [plans[i] for i in order[:max(1, len(plans) // eta)]]
+            budget = min(horizon, budget * eta)
+            rnd += 1
+    cache.save()
+    return sorted(ranked.values(), key=lambda r: (-r['horizon'], r['score']))
+
+
+if __name__ == '__main__':
+
+    # search a plan for the lwr intersection and compare it with the split fr
+    # of intersection.py: python timing.py [delay|throughput] [n] [horizon]
+    import time
+
+    objective = sys.argv[1] if (len(sys.argv) > 1) else 'delay'
+    n = int(sys.argv[2]) if (len(sys.argv) > 2) else 27
+    horizon = float(sys.argv[3]) if (len(sys.argv) > 3) else 300.
+    cache = Cache('timing.json')
+    t0 = time.perf_counter()
+    ranked = optimize(n=n, horizon=horizon, objective=objective, cache=cache)
+    wall = time.perf_counter() - t0
+    base = score(evaluate(({}, (defaults['tmax'], defaults['fr'], 0.), horizon)),
+                 horizon, objective)
+    print('%d plans, %d evaluations from the cache, %.2f s' % (n, cache.hits, wall))
+    print('%8s %6s %7s %10s %8s %6s' % ('cycle', 'split', 'offset', objective, 'horizon', 'rounds'))
+    for r in ranked[:5]:
+        print('%8.1f %6.2f %7.2f %10.4f %8.1f %6d'
+              % (r['plan'] + (abs(r['score']), r['horizon'], r['rounds'])))
+    print('fixed split fr = %.2f of tmax = %.0f: %s %.4f'
+          % (defaults['fr'], defaults['tmax'], objective, abs(base)))